@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+analyze_jobs.py
+
+Пакетный анализ архивных XPS-заданий без службы и GUI — например, чтобы
+дозаполнить учёт страниц по десяткам тысяч старых файлов. Работает и на
+Linux: нужен только xps_analysis, pywin32 и tkinter не импортируются.
+
+Запуск:
+    py analyze_jobs.py C:\\archive                     -> JSON Lines в stdout
+    py analyze_jobs.py "C:\\archive\\2024-*\\*.xps" --format csv -o report.csv
+    py printer_worker.py analyze C:\\archive --workers 8
+
+Файлы анализируются в пуле процессов тем же analyze_xps, что и в службе;
+результаты выводятся по мере готовности в порядке входных файлов.
+С --shard страницы больших пакетов делятся между процессами
+(xps_sharding) — полезно, когда в архиве есть файлы на тысячи страниц.
+"""
+
+import os
+import sys
+import glob
+import argparse
+
+from xps_analysis import analyze_xps
+
+CSV_FIELDS = (
+    "path", "job_id", "file_size", "page_count", "page_size",
+    "width", "height", "page_sizes", "landscape_pages",
+)
+
+
+def iter_xps_files(targets, recursive=False, missing=None):
+    """
+    Разворачивает аргументы командной строки в пути к XPS-файлам:
+    каталог (с подкаталогами при recursive), glob-шаблон или файл.
+    Несуществующий файл не выдаётся, а сообщается в stderr и, если
+    передан список missing, добавляется в него.
+    """
+    for target in targets:
+        if os.path.isdir(target):
+            if recursive:
+                for dirpath, _dirnames, filenames in os.walk(target):
+                    for name in sorted(filenames):
+                        if name.lower().endswith(".xps"):
+                            yield os.path.join(dirpath, name)
+            else:
+                with os.scandir(target) as it:
+                    names = sorted(e.name for e in it if e.is_file())
+                for name in names:
+                    if name.lower().endswith(".xps"):
+                        yield os.path.join(target, name)
+        elif glob.has_magic(target):
+            for path in sorted(glob.iglob(target, recursive=recursive)):
+                if os.path.isfile(path):
+                    yield path
+        elif os.path.isfile(target):
+            yield target
+        else:
+            print(f"Файл не найден: {target}", file=sys.stderr)
+            if missing is not None:
+                missing.append(target)
+
+
+def iter_records(paths, workers, shard=False):
+    if workers <= 1:
+        for path in paths:
+            yield analyze_xps(path)
+        return
+    if shard:
+        yield from iter_records_sharded(paths, workers)
+        return
+    import multiprocessing
+
+    with multiprocessing.Pool(workers) as pool:
+        for record in pool.imap(analyze_xps, paths, chunksize=16):
+            yield record
+
+
+def iter_records_sharded(paths, workers):
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+    from xps_sharding import analyze_xps_sharded
+
+    # Потоки только раздают части пакетов процессам и ждут результат;
+    # окно ограничено, чтобы не ставить в очередь весь архив сразу
+    window = deque()
+    with ProcessPoolExecutor(workers) as pool, ThreadPoolExecutor(workers) as coordinators:
+        for path in paths:
+            window.append(coordinators.submit(analyze_xps_sharded, path, pool, workers))
+            if len(window) >= workers * 4:
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
+
+
+def write_jsonl(records, out):
+    import json
+
+    count = 0
+    for record in records:
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        count += 1
+    return count
+
+
+def write_csv(records, out):
+    import csv
+
+    writer = csv.DictWriter(out, fieldnames=CSV_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    count = 0
+    for record in records:
+        row = dict(record)
+        row["page_sizes"] = ";".join(f"{k}={v}" for k, v in record["page_sizes"].items())
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="analyze",
+        description="Пакетный анализ XPS-заданий (страницы, форматы) в JSON Lines или CSV.",
+    )
+    parser.add_argument("targets", nargs="+", help="каталоги, glob-шаблоны или файлы .xps")
+    parser.add_argument("--format", choices=("jsonl", "csv"), default="jsonl")
+    parser.add_argument("-o", "--output", help="файл результата (по умолчанию stdout)")
+    parser.add_argument("-r", "--recursive", action="store_true",
+                        help="обходить подкаталоги (и ** в шаблонах)")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1,
+                        help="число процессов анализа")
+    parser.add_argument("--shard", action="store_true",
+                        help="делить страницы больших пакетов между процессами")
+    args = parser.parse_args(argv)
+
+    missing = []
+    paths = iter_xps_files(args.targets, args.recursive, missing)
+    records = iter_records(paths, args.workers, args.shard)
+    writer = write_csv if args.format == "csv" else write_jsonl
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8", newline="") as out:
+            count = writer(records, out)
+    else:
+        count = writer(records, sys.stdout)
+    print(f"Обработано файлов: {count}", file=sys.stderr)
+    return 1 if missing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
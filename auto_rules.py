@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+auto_rules.py
+
+Правила автоматического решения по заданиям — чтобы служба работала
+без оператора (например, ночью).
+
+Правила читаются из JSON-файла и проверяются сразу после анализа; первое
+подходящее правило определяет действие:
+    "forward" — отправить на принтер, "delete" — удалить,
+    "hold"    — оставить в окне очереди до решения оператора.
+
+Пример rules.json:
+    {
+      "default": "hold",
+      "rules": [
+        {"name": "черновики", "action": "delete",
+         "when": {"filename": "draft_*.xps"}},
+        {"name": "короткие A4 днём", "action": "forward",
+         "when": {"max_pages": 20, "page_sizes": ["A4"],
+                  "hours": "08:00-20:00", "weekdays": [1, 2, 3, 4, 5]}},
+        {"name": "большие", "action": "hold",
+         "when": {"min_pages": 200}}
+      ]
+    }
+
+Условия (все указанные должны выполняться):
+    min_pages, max_pages           — число страниц;
+    min_file_size, max_file_size   — размер файла: байты или "10MB", "512KB";
+    page_sizes                     — все страницы задания в этих форматах;
+    filename / filename_regex      — маска (fnmatch) или регулярное выражение
+                                     для имени файла;
+    hours                          — интервал "ЧЧ:ММ-ЧЧ:ММ" (может переходить
+                                     через полночь);
+    weekdays                       — дни недели, 1 = понедельник.
+
+Правила компилируются в функции-предикаты один раз при загрузке.
+RuleEngine следит за временем изменения файла и перезагружает правила на
+лету; если новый файл с ошибкой, продолжают действовать прежние правила.
+"""
+
+import os
+import re
+import json
+import time
+import fnmatch
+import datetime
+import threading
+
+FORWARD = "forward"
+DELETE = "delete"
+HOLD = "hold"
+
+ACTIONS = (FORWARD, DELETE, HOLD)
+
+SIZE_UNITS = {"": 1, "B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+
+# Как часто проверять, не изменился ли файл правил, секунды
+RELOAD_CHECK_INTERVAL = 2.0
+
+
+class RuleError(ValueError):
+    pass
+
+
+def parse_size(value):
+    if isinstance(value, (int, float)):
+        return int(value)
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMG]?B?)\s*", str(value).upper())
+    if not match:
+        raise RuleError(f"Неверный размер: {value!r}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+
+def parse_minutes(text):
+    hours, minutes = text.strip().split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def expect(value, types, what):
+    """
+    Проверка типа значения из rules.json: иначе ошибка в правиле всплыла
+    бы AttributeError/TypeError при загрузке или, хуже, при проверке
+    задания.
+    """
+    if not isinstance(value, types) or isinstance(value, bool):
+        raise RuleError(f"{what}: неверное значение {value!r}")
+    return value
+
+
+def compile_hours(spec):
+    expect(spec, str, "hours")
+    try:
+        start_text, end_text = spec.split("-")
+        start, end = parse_minutes(start_text), parse_minutes(end_text)
+    except ValueError:
+        raise RuleError(f"Неверный интервал времени: {spec!r}")
+
+    def check(record, now):
+        minute = now.hour * 60 + now.minute
+        if start <= end:
+            return start <= minute < end
+        return minute >= start or minute < end
+
+    return check
+
+
+def compile_condition(key, value):
+    """
+    Превращает одно условие правила в функцию check(record, now).
+    """
+    if key == "min_pages":
+        limit = int(value)
+        return lambda record, now: record["page_count"] >= limit
+    if key == "max_pages":
+        limit = int(value)
+        return lambda record, now: record["page_count"] <= limit
+    if key == "min_file_size":
+        limit = parse_size(value)
+        return lambda record, now: record["file_size"] >= limit
+    if key == "max_file_size":
+        limit = parse_size(value)
+        return lambda record, now: record["file_size"] <= limit
+    if key == "page_sizes":
+        allowed = frozenset(expect(item, str, key) for item in expect(value, list, key))
+        return lambda record, now: bool(record["page_sizes"]) and allowed.issuperset(record["page_sizes"])
+    if key == "filename":
+        pattern = re.compile(fnmatch.translate(expect(value, str, key).lower()))
+        return lambda record, now: pattern.match(os.path.basename(record["path"]).lower()) is not None
+    if key == "filename_regex":
+        try:
+            pattern = re.compile(expect(value, str, key))
+        except re.error as e:
+            raise RuleError(f"Неверное регулярное выражение {value!r}: {e}")
+        return lambda record, now: pattern.search(os.path.basename(record["path"])) is not None
+    if key == "hours":
+        return compile_hours(value)
+    if key == "weekdays":
+        days = frozenset(int(day) for day in expect(value, list, key))
+        return lambda record, now: now.isoweekday() in days
+    raise RuleError(f"Неизвестное условие: {key!r}")
+
+
+class RuleSet:
+    """
+    Скомпилированный набор правил.
+    """
+
+    def __init__(self, config):
+        expect(config, dict, "файл правил")
+        self.default = config.get("default", HOLD)
+        if self.default not in ACTIONS:
+            raise RuleError(f"Неизвестное действие по умолчанию: {self.default!r}")
+        self.rules = []
+        for number, rule in enumerate(expect(config.get("rules", []), list, "rules"), 1):
+            name = f"правило {number}"
+            expect(rule, dict, name)
+            name = str(rule.get("name", name))
+            action = rule.get("action")
+            if action not in ACTIONS:
+                raise RuleError(f"{name}: неизвестное действие {action!r}")
+            when = expect(rule.get("when", {}), dict, f"{name}: when")
+            try:
+                checks = [compile_condition(key, value) for key, value in when.items()]
+            except (ValueError, TypeError) as e:
+                raise RuleError(f"{name}: {e}")
+            self.rules.append((name, action, checks))
+
+    def evaluate(self, record, now=None):
+        """
+        Возвращает (действие, имя правила); имя None — сработало умолчание.
+        """
+        if now is None:
+            now = datetime.datetime.now()
+        for name, action, checks in self.rules:
+            if all(check(record, now) for check in checks):
+                return action, name
+        return self.default, None
+
+
+class RuleEngine:
+    """
+    Правила из файла с горячей перезагрузкой. Отсутствующий файл означает
+    «все задания — на решение оператору».
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.ruleset = RuleSet({})
+        self.mtime_ns = None
+        self.last_check = 0.0
+        self.last_error = None
+        self.reload()
+
+    def reload(self):
+        try:
+            mtime_ns = os.stat(self.path).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        if mtime_ns == self.mtime_ns:
+            return False
+        if mtime_ns is None:
+            self.ruleset = RuleSet({})
+            self.mtime_ns = None
+            return True
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                ruleset = RuleSet(json.load(f))
+        except Exception as e:
+            # Время изменения не запоминается: файл перечитывается при
+            # следующей проверке, пока не загрузится (его могли не дописать)
+            error = f"{self.path}: {e}"
+            if error != self.last_error:
+                print(f"Правила не загружены, действуют прежние: {error}")
+            self.last_error = error
+            return False
+        self.ruleset = ruleset
+        self.mtime_ns = mtime_ns
+        self.last_error = None
+        return True
+
+    def evaluate(self, record, now=None):
+        current = time.monotonic()
+        if current - self.last_check >= RELOAD_CHECK_INTERVAL:
+            with self.lock:
+                if current - self.last_check >= RELOAD_CHECK_INTERVAL:
+                    self.last_check = current
+                    self.reload()
+        return self.ruleset.evaluate(record, now)
+
+
+class AutoDecider:
+    """
+    Функция решения для JobPipeline: сначала правила, затем — оператор.
+
+    act(record, action) выполняет FORWARD/DELETE и возвращает результат
+    для конвейера; fallback(record) — решение оператора (окно очереди).
+    """
+
+    def __init__(self, engine, act, fallback, metrics=None):
+        self.engine = engine
+        self.act = act
+        self.fallback = fallback
+        self.metrics = metrics
+
+    def decide(self, record):
+        action, rule = self.engine.evaluate(record)
+        if action == HOLD:
+            return self.fallback(record)
+        if self.metrics is not None:
+            self.metrics.increment(f"auto_{action}")
+        print(f"Правило «{rule or 'по умолчанию'}»: {action} {os.path.basename(record['path'])}")
+        return self.act(record, action)
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+benchmark.py
+
+Бенчмарки обработчика заданий на синтетических XPS (xps_corpus).
+
+Измеряется:
+    analysis — пропускная способность analyze_xps (файлов/с, страниц/с, МБ/с)
+               и пиковая память Python при анализе самого большого файла;
+    latency  — задержка от появления файла в папке до вызова решения
+               (JobPipeline с реальным наблюдателем), p50/p95/max;
+    forward  — скорость пересылки на принтер-заглушку FileSink
+               (буфер readinto и mmap);
+    sharding — масштабирование анализа одного большого пакета по числу
+               процессов (xps_sharding): время и ускорение относительно
+               analyze_xps в одном потоке для 1, 2, 4 ... процессов;
+    preview  — миниатюры очереди заданий (job_preview): первый показ
+               задания и повторный из LRU-кэша, мс на задание.
+
+Запуск:
+    py benchmark.py                          — все замеры, вывод в консоль
+    py benchmark.py --quick --only analysis
+    py benchmark.py --save results/v2.json
+    py benchmark.py --compare results/v1.json
+
+Результаты сохраняются в JSON (плоский словарь метрик) и сравниваются
+с сохранёнными ранее: единица в имени метрики задаёт, что лучше —
+больше (*_per_s) или меньше (*_ms, *_mb).
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import threading
+import tracemalloc
+
+from xps_corpus import generate_corpus, generate_xps
+from xps_analysis import analyze_xps
+
+MB = 1024 * 1024
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def bench_analysis(workdir, quick):
+    jobs, max_pages = (20, 40) if quick else (100, 200)
+    paths = generate_corpus(os.path.join(workdir, "corpus"), jobs=jobs, max_pages=max_pages,
+                            glyph_runs=100, resource_size=256 * 1024)
+    total_bytes = sum(os.path.getsize(p) for p in paths)
+
+    started = time.perf_counter()
+    pages = sum(analyze_xps(p)["page_count"] for p in paths)
+    seconds = time.perf_counter() - started
+
+    big_pages = 50 if quick else 300
+    big = generate_xps(os.path.join(workdir, "big.xps"), ["A4"] * big_pages,
+                       glyph_runs=2000, resource_size=MB)
+    tracemalloc.start()
+    started = time.perf_counter()
+    analyze_xps(big)
+    big_seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "analysis.files_per_s": jobs / seconds,
+        "analysis.pages_per_s": pages / seconds,
+        "analysis.input_mb_per_s": total_bytes / MB / seconds,
+        "analysis.big_file_ms": big_seconds * 1000,
+        "analysis.big_file_peak_mb": peak / MB,
+    }
+
+
+def bench_latency(workdir, quick):
+    from job_pipeline import JobPipeline
+
+    jobs = 20 if quick else 200
+    staging = os.path.join(workdir, "staging")
+    spool = os.path.join(workdir, "spool")
+    paths = generate_corpus(staging, jobs=jobs, max_pages=20)
+    os.makedirs(spool, exist_ok=True)
+
+    appeared = {}
+    latencies = []
+    done = threading.Event()
+
+    def decide(record):
+        latencies.append(time.perf_counter() - appeared[record["path"]])
+        if len(latencies) == jobs:
+            done.set()
+
+    stop_event = threading.Event()
+    pipeline = JobPipeline(spool, decide)
+    runner = threading.Thread(target=pipeline.run, args=(stop_event,), daemon=True)
+    runner.start()
+    time.sleep(0.2)
+
+    burst_started = time.perf_counter()
+    for path in paths:
+        target = os.path.join(spool, os.path.basename(path))
+        appeared[target] = time.perf_counter()
+        os.replace(path, target)
+    done.wait(timeout=60)
+    burst_seconds = time.perf_counter() - burst_started
+    stop_event.set()
+    runner.join(timeout=5)
+
+    return {
+        "latency.p50_ms": percentile(latencies, 0.5) * 1000,
+        "latency.p95_ms": percentile(latencies, 0.95) * 1000,
+        "latency.max_ms": max(latencies) * 1000 if latencies else 0.0,
+        "latency.burst_jobs_per_s": len(latencies) / burst_seconds,
+    }
+
+
+def bench_forward(workdir, quick):
+    from printer_sink import FileSink, forward_file
+
+    size = (32 if quick else 256) * MB
+    source = os.path.join(workdir, "forward.bin")
+    with open(source, "wb") as f:
+        block = os.urandom(MB)
+        for _ in range(size // MB):
+            f.write(block)
+
+    results = {}
+    for mode, use_mmap in (("buffered", False), ("mmap", True)):
+        stats = forward_file(source, FileSink(os.path.join(workdir, "printer.out")), use_mmap=use_mmap)
+        results[f"forward.{mode}_mb_per_s"] = stats["throughput"] / MB
+    return results
+
+
+def worker_counts():
+    counts = []
+    n = 1
+    while n < (os.cpu_count() or 1):
+        counts.append(n)
+        n *= 2
+    counts.append(os.cpu_count() or 1)
+    return counts
+
+
+def bench_sharding(workdir, quick):
+    from concurrent.futures import ProcessPoolExecutor
+    from xps_sharding import analyze_xps_sharded
+
+    pages = 600 if quick else 4000
+    big = generate_xps(os.path.join(workdir, "sharded.xps"), ["A4", "A4", "A3", "A4-L"] * (pages // 4),
+                       glyph_runs=400, resource_size=64 * 1024)
+
+    started = time.perf_counter()
+    expected = analyze_xps(big)
+    serial = time.perf_counter() - started
+    results = {"sharding.serial_ms": serial * 1000}
+
+    for workers in worker_counts():
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # Прогрев: процессы запускаются до замера
+            list(pool.map(abs, range(workers)))
+            started = time.perf_counter()
+            record = analyze_xps_sharded(big, pool, workers, threshold=0)
+            seconds = time.perf_counter() - started
+        if record != expected:
+            raise RuntimeError(f"Результат с {workers} процессами отличается от analyze_xps")
+        results[f"sharding.w{workers}_ms"] = seconds * 1000
+        results[f"sharding.w{workers}_speedup"] = serial / seconds
+    return results
+
+
+def bench_preview(workdir, quick):
+    from job_preview import PreviewLoader
+
+    jobs = 100 if quick else 500
+    paths = generate_corpus(os.path.join(workdir, "preview"), jobs=jobs, max_pages=20,
+                            glyph_runs=50, resource_size=64 * 1024)
+    loader = PreviewLoader()
+    results = {}
+    for phase in ("cold", "cached"):
+        started = time.perf_counter()
+        shown = sum(1 for path in paths if loader.get(path) is not None)
+        results[f"preview.{phase}_ms"] = (time.perf_counter() - started) * 1000 / len(paths)
+        if shown != len(paths):
+            raise RuntimeError(f"Миниатюры есть только у {shown} заданий из {len(paths)}")
+    loader.shutdown()
+    return results
+
+
+BENCHMARKS = {
+    "analysis": bench_analysis,
+    "latency": bench_latency,
+    "forward": bench_forward,
+    "sharding": bench_sharding,
+    "preview": bench_preview,
+}
+
+
+def lower_is_better(metric):
+    return metric.endswith("_ms") or metric.endswith("_mb")
+
+
+def compare(current, baseline, threshold):
+    """
+    Печатает сравнение с базовыми результатами. Возвращает число регрессий.
+    """
+    regressions = 0
+    print(f"\nСравнение с {baseline.get('label') or '?'} ({baseline.get('timestamp', '?')}):")
+    for metric, value in sorted(current["results"].items()):
+        old = baseline["results"].get(metric)
+        if not old:
+            print(f"  {metric:32} {value:12.2f}   (нет в базе)")
+            continue
+        change = (value - old) / old
+        worse = change > threshold if lower_is_better(metric) else change < -threshold
+        mark = "  РЕГРЕССИЯ" if worse else ""
+        regressions += worse
+        print(f"  {metric:32} {value:12.2f}   было {old:12.2f}   {change:+7.1%}{mark}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарки обработчика XPS-заданий.")
+    parser.add_argument("--only", help="через запятую: " + ",".join(BENCHMARKS))
+    parser.add_argument("--quick", action="store_true", help="уменьшенные объёмы")
+    parser.add_argument("--save", help="сохранить результаты в JSON")
+    parser.add_argument("--compare", help="сравнить с ранее сохранёнными результатами")
+    parser.add_argument("--label", default=None, help="метка версии в результатах")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="допустимое ухудшение при сравнении (доля)")
+    args = parser.parse_args(argv)
+
+    names = args.only.split(",") if args.only else list(BENCHMARKS)
+    workdir = tempfile.mkdtemp(prefix="xps_bench_")
+    results = {}
+    try:
+        for name in names:
+            print(f"== {name}", flush=True)
+            for metric, value in BENCHMARKS[name](workdir, args.quick).items():
+                results[metric] = value
+                print(f"  {metric:32} {value:12.2f}", flush=True)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    current = {
+        "label": args.label,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "quick": args.quick,
+        "results": results,
+    }
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(current, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(current, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+file_completion.py
+
+Определение момента, когда спулер закончил писать XPS-файл.
+
+Вместо сравнения размера раз в секунду файл считается готовым, когда:
+    1) в конце файла есть корректная запись End Of Central Directory ZIP
+       (центральный каталог указывает ровно туда, где начинается EOCD);
+    2) файл можно открыть эксклюзивно, т.е. его больше никто не держит
+       открытым на запись (проверяется только в Windows).
+
+Проверки повторяются с экспоненциальной задержкой, начиная с нескольких
+миллисекунд, поэтому быстро записанное задание подхватывается почти сразу.
+Таймаут растёт вместе с размером файла и отсчитывается от последнего
+изменения размера: медленно растущее задание не бросается на полпути.
+
+CompletionTracker ведёт общее расписание проверок всех ожидающих файлов;
+сами проверки (чтение хвоста файла) и обработчики готовых файлов идут в
+небольшом пуле потоков, вне блокировки расписания.
+"""
+
+import os
+import sys
+import time
+import heapq
+import struct
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+EOCD_SIGNATURE = b"PK\x05\x06"
+ZIP64_LOCATOR_SIGNATURE = b"PK\x06\x07"
+ZIP64_EOCD_SIGNATURE = b"PK\x06\x06"
+CENTRAL_DIR_SIGNATURE = b"PK\x01\x02"
+EOCD_STRUCT = struct.Struct("<4s4H2LH")
+ZIP64_LOCATOR_STRUCT = struct.Struct("<4sLQL")
+ZIP64_EOCD_STRUCT = struct.Struct("<4sQ2H2L4Q")
+MAX_COMMENT = 0xFFFF
+
+FIRST_DELAY = 0.005
+MAX_DELAY = 0.5
+BACKOFF = 2.0
+# Таймаут: BASE_TIMEOUT секунд без роста файла плюс время на запись
+# текущего объёма со скоростью не ниже MIN_WRITE_RATE байт/с
+BASE_TIMEOUT = 10.0
+MIN_WRITE_RATE = 1024 * 1024
+# Сколько файлов проверяется одновременно
+CHECK_WORKERS = 4
+
+
+def has_valid_eocd(file_path):
+    """
+    Проверяет, что ZIP-архив дописан: EOCD найден в хвосте файла, комментарий
+    заканчивается ровно в конце файла, а центральный каталог стоит
+    непосредственно перед EOCD (или перед записями ZIP64).
+    """
+    try:
+        with open(file_path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size < EOCD_STRUCT.size:
+                return False
+            tail_size = min(size, EOCD_STRUCT.size + MAX_COMMENT)
+            f.seek(size - tail_size)
+            tail = f.read(tail_size)
+            pos = tail.rfind(EOCD_SIGNATURE)
+            while pos >= 0:
+                if pos + EOCD_STRUCT.size <= len(tail):
+                    fields = EOCD_STRUCT.unpack_from(tail, pos)
+                    comment_len = fields[7]
+                    if pos + EOCD_STRUCT.size + comment_len == len(tail):
+                        eocd_offset = size - tail_size + pos
+                        return check_central_directory(f, fields, eocd_offset)
+                pos = tail.rfind(EOCD_SIGNATURE, 0, pos)
+            return False
+    except OSError:
+        return False
+
+
+def check_central_directory(f, fields, eocd_offset):
+    cd_size, cd_offset = fields[5], fields[6]
+    cd_end = eocd_offset
+    if cd_size == 0xFFFFFFFF or cd_offset == 0xFFFFFFFF:
+        locator_offset = eocd_offset - ZIP64_LOCATOR_STRUCT.size
+        if locator_offset < 0:
+            return False
+        f.seek(locator_offset)
+        locator = f.read(ZIP64_LOCATOR_STRUCT.size)
+        if len(locator) < ZIP64_LOCATOR_STRUCT.size or not locator.startswith(ZIP64_LOCATOR_SIGNATURE):
+            return False
+        zip64_offset = ZIP64_LOCATOR_STRUCT.unpack(locator)[2]
+        f.seek(zip64_offset)
+        record = f.read(ZIP64_EOCD_STRUCT.size)
+        if len(record) < ZIP64_EOCD_STRUCT.size or not record.startswith(ZIP64_EOCD_SIGNATURE):
+            return False
+        zip64 = ZIP64_EOCD_STRUCT.unpack(record)
+        cd_size, cd_offset = zip64[8], zip64[9]
+        cd_end = zip64_offset
+    if cd_offset + cd_size != cd_end:
+        return False
+    if cd_size == 0:
+        return True
+    f.seek(cd_offset)
+    return f.read(4) == CENTRAL_DIR_SIGNATURE
+
+
+def can_open_exclusively(file_path):
+    """
+    В Windows пытается открыть файл без совместного доступа: пока спулер
+    держит его на запись, открытие падает с ошибкой нарушения совместного
+    доступа. На других системах обязательных блокировок нет — True.
+    """
+    if sys.platform != "win32":
+        return True
+    try:
+        import win32con
+        import win32file
+    except ImportError:
+        # Без pywin32: переименование в себя не проходит, пока файл
+        # открыт без FILE_SHARE_DELETE
+        try:
+            os.rename(file_path, file_path)
+            return True
+        except OSError:
+            return False
+    try:
+        handle = win32file.CreateFile(
+            file_path, win32con.GENERIC_READ, 0, None,
+            win32con.OPEN_EXISTING, 0, None,
+        )
+    except Exception:
+        return False
+    handle.Close()
+    return True
+
+
+def is_complete_file(file_path):
+    return has_valid_eocd(file_path) and can_open_exclusively(file_path)
+
+
+def completion_timeout(size):
+    return BASE_TIMEOUT + size / MIN_WRITE_RATE
+
+
+class CompletionTracker:
+    """
+    Следит сразу за всеми недописанными файлами.
+
+    on_complete(path) — файл дописан;
+    on_timeout(path)  — файл перестал расти, но так и не стал корректным ZIP;
+    on_missing(path)  — файл удалён до завершения записи.
+
+    Поток расписания под блокировкой лишь забирает файлы, чей срок
+    проверки настал; проверки и обработчики выполняются в пуле из workers
+    потоков, поэтому долгий обработчик не задерживает add() и проверки
+    других файлов. Один файл одновременно проверяется не больше чем
+    в одном потоке.
+    """
+
+    def __init__(self, on_complete, on_timeout, on_missing, workers=CHECK_WORKERS):
+        self.on_complete = on_complete
+        self.on_timeout = on_timeout
+        self.on_missing = on_missing
+        self.workers = workers
+        self.cond = threading.Condition()
+        # (время следующей проверки, порядковый номер, путь)
+        self.heap = []
+        # путь -> [задержка, последний размер, время последнего изменения]
+        self.state = {}
+        self.counter = 0
+        self.stopped = False
+        self.thread = None
+        self.pool = None
+
+    def add(self, path):
+        with self.cond:
+            if path in self.state:
+                return
+            self.state[path] = [FIRST_DELAY, -1, time.monotonic()]
+            self.schedule(path, 0.0)
+            self.cond.notify()
+
+    def schedule(self, path, delay):
+        self.counter += 1
+        heapq.heappush(self.heap, (time.monotonic() + delay, self.counter, path))
+
+    def pending_count(self):
+        with self.cond:
+            return len(self.state)
+
+    def check(self, path):
+        """
+        Одна проверка файла (вне блокировки). Файл либо снова ставится
+        в расписание, либо покидает трекер с вызовом обработчика.
+        """
+        with self.cond:
+            delay, last_size, last_change = self.state[path]
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return self.finish(path, self.on_missing)
+        now = time.monotonic()
+        if size != last_size:
+            last_size, last_change = size, now
+        if size > 0 and is_complete_file(path):
+            return self.finish(path, self.on_complete)
+        if now - last_change > completion_timeout(size):
+            return self.finish(path, self.on_timeout)
+        with self.cond:
+            self.state[path] = [min(delay * BACKOFF, MAX_DELAY), last_size, last_change]
+            if not self.stopped:
+                self.schedule(path, delay)
+                self.cond.notify()
+
+    def finish(self, path, callback):
+        with self.cond:
+            del self.state[path]
+        callback(path)
+
+    def due_paths(self):
+        """
+        Ждёт, пока настанет срок хотя бы одной проверки, и забирает из
+        расписания все такие файлы; [] — трекер остановлен.
+        """
+        with self.cond:
+            while not self.stopped:
+                if not self.heap:
+                    self.cond.wait()
+                    continue
+                wait = self.heap[0][0] - time.monotonic()
+                if wait > 0:
+                    self.cond.wait(wait)
+                    continue
+                now = time.monotonic()
+                paths = []
+                while self.heap and self.heap[0][0] <= now:
+                    path = heapq.heappop(self.heap)[2]
+                    if path in self.state:
+                        paths.append(path)
+                if paths:
+                    return paths
+            return []
+
+    def run(self):
+        while True:
+            paths = self.due_paths()
+            if not paths:
+                return
+            for path in paths:
+                try:
+                    future = self.pool.submit(self.check, path)
+                except RuntimeError:
+                    # Пул уже остановлен
+                    return
+                future.add_done_callback(lambda f, p=path: self.report(p, f))
+
+    def report(self, path, future):
+        # Ошибка в проверке или обработчике (например, в конвейере) не
+        # должна пропасть в future, который никто не читает
+        if future.cancelled() or future.exception() is None:
+            return
+        error = future.exception()
+        print(f"Ошибка при обработке {os.path.basename(path)}:")
+        traceback.print_exception(type(error), error, error.__traceback__)
+
+    def start(self):
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="completion")
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+"""
+folder_watcher.py
+
+Отслеживание новых заданий в папках спулера.
+
+Один наблюдатель следит сразу за несколькими папками (по папке на
+виртуальный принтер) — конструкторы и create_watcher() принимают путь или
+список путей. Все бэкенды реализуют один интерфейс:
+    read_events(timeout) -> [(действие, полный путь), ...]
+    close()
+и поддерживают with. Действия: CREATED, MODIFIED, DELETED.
+Первый вызов read_events() сообщает о файлах, которые уже лежат в папках
+(как CREATED), чтобы задания, пришедшие до запуска службы, не терялись.
+
+Бэкенды:
+    InotifyWatcher  — Linux, inotify через ctypes, без опроса диска;
+    Win32Watcher    — Windows, ReadDirectoryChangesW (pywin32);
+    PollingWatcher  — запасной вариант на os.scandir с кэшем stat.
+create_watcher() выбирает подходящий автоматически.
+"""
+
+import os
+import sys
+import time
+import select
+import struct
+
+CREATED = "created"
+MODIFIED = "modified"
+DELETED = "deleted"
+
+DEFAULT_SUFFIX = ".xps"
+
+
+def folder_list(folders):
+    if isinstance(folders, (str, bytes, os.PathLike)):
+        return [folders]
+    return list(folders)
+
+
+def initial_events(folders, suffix):
+    """
+    События CREATED для файлов, уже лежащих в папках.
+    """
+    events = []
+    for folder in folder_list(folders):
+        with os.scandir(folder) as it:
+            for entry in it:
+                if entry.name.lower().endswith(suffix) and entry.is_file():
+                    events.append((CREATED, entry.path))
+    return events
+
+
+def merge_event(pending, action, path):
+    """
+    Схлопывает поток событий по одному файлу в одно итоговое событие:
+    десятки IN_MODIFY во время записи превращаются в один MODIFIED,
+    а CREATED с последующими изменениями остаётся CREATED.
+    """
+    previous = pending.get(path)
+    if previous == CREATED and action == MODIFIED:
+        return
+    pending[path] = action
+
+
+class PollingWatcher:
+    """
+    Опрос папки через os.scandir. На Windows размер и время изменения
+    приходят вместе с записью каталога, поэтому сравниваются у каждого
+    файла на каждом опросе. На POSIX stat — отдельный вызов: «устоявшийся»
+    файл проверяется сразу, если у имени сменился inode (он есть в записи
+    каталога), а иначе раз в RECHECK_SCANS опросов — так замечается и
+    перезапись на месте (тот же job_%d.xps с новым содержимым).
+    """
+
+    # Через сколько опросов без изменений файл считается устоявшимся
+    SETTLE_SCANS = 3
+    # Раз во сколько опросов stat'ится устоявшийся файл (POSIX)
+    RECHECK_SCANS = 10
+
+    def __init__(self, folders, suffix=DEFAULT_SUFFIX, interval=1.0):
+        self.folders = folder_list(folders)
+        self.suffix = suffix
+        self.interval = interval
+        # полный путь -> [inode, size, mtime_ns, опросов без изменений]
+        self.cache = {}
+        # stat() записи каталога бесплатен только на Windows, а inode() там,
+        # наоборот, стоит отдельного вызова
+        self.stat_in_listing = sys.platform == "win32"
+        self.last_scan = 0.0
+
+    def scan(self):
+        events = []
+        seen = set()
+        for folder in self.folders:
+            with os.scandir(folder) as it:
+                for entry in it:
+                    if not entry.name.lower().endswith(self.suffix):
+                        continue
+                    path = entry.path
+                    seen.add(path)
+                    cached = self.cache.get(path)
+                    inode = 0 if self.stat_in_listing else entry.inode()
+                    if (cached is not None and not self.stat_in_listing
+                            and cached[0] == inode and cached[3] >= self.SETTLE_SCANS
+                            and (cached[3] - self.SETTLE_SCANS) % self.RECHECK_SCANS):
+                        cached[3] += 1
+                        continue
+                    try:
+                        if not entry.is_file():
+                            continue
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    if cached is None or cached[0] != inode:
+                        self.cache[path] = [inode, st.st_size, st.st_mtime_ns, 0]
+                        events.append((CREATED, path))
+                    elif (cached[1], cached[2]) != (st.st_size, st.st_mtime_ns):
+                        cached[1], cached[2], cached[3] = st.st_size, st.st_mtime_ns, 0
+                        events.append((MODIFIED, path))
+                    else:
+                        cached[3] += 1
+        for path in list(self.cache):
+            if path not in seen:
+                del self.cache[path]
+                events.append((DELETED, path))
+        self.last_scan = time.monotonic()
+        return events
+
+    def read_events(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            delay = self.last_scan + self.interval - time.monotonic()
+            if deadline is not None:
+                delay = min(delay, deadline - time.monotonic())
+            if delay > 0:
+                time.sleep(delay)
+            if time.monotonic() >= self.last_scan + self.interval:
+                events = self.scan()
+                if events:
+                    return events
+            if deadline is not None and time.monotonic() >= deadline:
+                return []
+
+    def close(self):
+        self.cache.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class InotifyWatcher:
+    """
+    Уведомления ядра Linux (inotify). Пока в папке ничего не меняется,
+    поток спит в select() и не тратит процессор.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, folders, suffix=DEFAULT_SUFFIX):
+        import ctypes
+        import ctypes.util
+
+        self.suffix = suffix
+        # дескриптор наблюдения -> папка
+        self.folders = {}
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = (self.IN_CREATE | self.IN_MODIFY | self.IN_CLOSE_WRITE
+                | self.IN_MOVED_TO | self.IN_MOVED_FROM | self.IN_DELETE)
+        for folder in folder_list(folders):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder), mask)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                os.close(self.fd)
+                raise OSError(errno, f"inotify_add_watch failed for {folder}")
+            self.folders[wd] = folder
+        self.pending_initial = True
+
+    def read_events(self, timeout=None):
+        if self.pending_initial:
+            self.pending_initial = False
+            events = initial_events(self.folders.values(), self.suffix)
+            if events:
+                return events
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        pending = {}
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            self.parse(data, pending)
+        return [(action, path) for path, action in pending.items()]
+
+    def parse(self, data, pending):
+        offset = 0
+        header_size = self.EVENT_HEADER.size
+        while offset + header_size <= len(data):
+            wd, mask, _cookie, length = self.EVENT_HEADER.unpack_from(data, offset)
+            raw_name = data[offset + header_size:offset + header_size + length]
+            offset += header_size + length
+            if mask & self.IN_Q_OVERFLOW:
+                # Очередь ядра переполнилась — пересканируем все папки
+                for action, path in initial_events(self.folders.values(), self.suffix):
+                    merge_event(pending, MODIFIED, path)
+                continue
+            folder = self.folders.get(wd)
+            name = os.fsdecode(raw_name.rstrip(b"\0"))
+            if folder is None or not name.lower().endswith(self.suffix):
+                continue
+            path = os.path.join(folder, name)
+            if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                merge_event(pending, CREATED, path)
+            elif mask & (self.IN_MODIFY | self.IN_CLOSE_WRITE):
+                merge_event(pending, MODIFIED, path)
+            elif mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+                merge_event(pending, DELETED, path)
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Win32Watcher:
+    """
+    ReadDirectoryChangesW в асинхронном (overlapped) режиме, чтобы ожидание
+    можно было ограничить таймаутом и корректно остановить службу.
+    На каждую папку — свой каталог и событие; ожидание общее через
+    WaitForMultipleObjects (не больше 64 папок на наблюдатель).
+    """
+
+    ACTIONS = {
+        1: CREATED,   # FILE_ACTION_ADDED
+        2: DELETED,   # FILE_ACTION_REMOVED
+        3: MODIFIED,  # FILE_ACTION_MODIFIED
+        4: DELETED,   # FILE_ACTION_RENAMED_OLD_NAME
+        5: CREATED,   # FILE_ACTION_RENAMED_NEW_NAME
+    }
+
+    MAXIMUM_WAIT_OBJECTS = 64
+
+    def __init__(self, folders, suffix=DEFAULT_SUFFIX):
+        import pywintypes
+        import win32con
+        import win32event
+        import win32file
+
+        folders = folder_list(folders)
+        if len(folders) > self.MAXIMUM_WAIT_OBJECTS:
+            raise ValueError(f"Win32Watcher: не больше {self.MAXIMUM_WAIT_OBJECTS} папок")
+        self.win32event = win32event
+        self.win32file = win32file
+        self.suffix = suffix
+        self.flags = (win32con.FILE_NOTIFY_CHANGE_FILE_NAME
+                      | win32con.FILE_NOTIFY_CHANGE_SIZE
+                      | win32con.FILE_NOTIFY_CHANGE_LAST_WRITE)
+        # [папка, каталог, overlapped, буфер]
+        self.watches = []
+        try:
+            for folder in folders:
+                handle = win32file.CreateFile(
+                    folder,
+                    0x0001,  # FILE_LIST_DIRECTORY
+                    win32con.FILE_SHARE_READ | win32con.FILE_SHARE_WRITE | win32con.FILE_SHARE_DELETE,
+                    None,
+                    win32con.OPEN_EXISTING,
+                    win32con.FILE_FLAG_BACKUP_SEMANTICS | win32con.FILE_FLAG_OVERLAPPED,
+                    None,
+                )
+                overlapped = pywintypes.OVERLAPPED()
+                overlapped.hEvent = win32event.CreateEvent(None, True, False, None)
+                watch = [folder, handle, overlapped, win32file.AllocateReadBuffer(64 * 1024)]
+                self.watches.append(watch)
+                self.start_read(watch)
+        except Exception:
+            self.close()
+            raise
+        self.pending_initial = True
+
+    def start_read(self, watch):
+        _folder, handle, overlapped, buffer = watch
+        self.win32event.ResetEvent(overlapped.hEvent)
+        self.win32file.ReadDirectoryChangesW(handle, buffer, False, self.flags, overlapped)
+
+    def read_events(self, timeout=None):
+        if self.pending_initial:
+            self.pending_initial = False
+            events = initial_events([watch[0] for watch in self.watches], self.suffix)
+            if events:
+                return events
+        timeout_ms = self.win32event.INFINITE if timeout is None else int(timeout * 1000)
+        rc = self.win32event.WaitForMultipleObjects(
+            [watch[2].hEvent for watch in self.watches], False, timeout_ms
+        )
+        if not (self.win32event.WAIT_OBJECT_0 <= rc < self.win32event.WAIT_OBJECT_0 + len(self.watches)):
+            return []
+        pending = {}
+        for watch in self.watches:
+            # Забираем все сработавшие папки за один вызов
+            if self.win32event.WaitForSingleObject(watch[2].hEvent, 0) != self.win32event.WAIT_OBJECT_0:
+                continue
+            folder, handle, overlapped, buffer = watch
+            nbytes = self.win32file.GetOverlappedResult(handle, overlapped, True)
+            if nbytes == 0:
+                # Буфер переполнился — пересканируем папку целиком
+                for _action, path in initial_events(folder, self.suffix):
+                    merge_event(pending, MODIFIED, path)
+            else:
+                for action, name in self.win32file.FILE_NOTIFY_INFORMATION(buffer, nbytes):
+                    if name.lower().endswith(self.suffix) and action in self.ACTIONS:
+                        merge_event(pending, self.ACTIONS[action], os.path.join(folder, name))
+            self.start_read(watch)
+        return [(action, path) for path, action in pending.items()]
+
+    def close(self):
+        for watch in self.watches:
+            _folder, handle, overlapped, _buffer = watch
+            try:
+                self.win32file.CancelIo(handle)
+            except Exception:
+                pass
+            handle.Close()
+            # Событие OVERLAPPED — тоже дескриптор ядра
+            overlapped.hEvent.Close()
+        self.watches = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def create_watcher(folders, backend="auto", suffix=DEFAULT_SUFFIX, interval=1.0):
+    """
+    Создаёт наблюдатель за папкой или списком папок.
+    backend: "auto", "inotify", "win32" или "poll". В режиме "auto"
+    при недоступности нативного механизма используется опрос.
+    """
+    if backend == "win32":
+        return Win32Watcher(folders, suffix)
+    if backend == "inotify":
+        return InotifyWatcher(folders, suffix)
+    if backend == "poll":
+        return PollingWatcher(folders, suffix, interval)
+    if backend != "auto":
+        raise ValueError(f"Неизвестный бэкенд наблюдателя: {backend}")
+    try:
+        if sys.platform == "win32":
+            return Win32Watcher(folders, suffix)
+        if sys.platform.startswith("linux"):
+            return InotifyWatcher(folders, suffix)
+    except Exception:
+        pass
+    return PollingWatcher(folders, suffix, interval)
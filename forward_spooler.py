@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+"""
+forward_spooler.py
+
+Исходящая очередь отправки заданий на реальные принтеры.
+
+    submit(path, target, cost=..., weight=..., metadata=...) -> Future
+        Задание записывается в SQLite (таблица outbox) и ставится в очередь
+        своего целевого принтера. Future завершается статистикой
+        forward_file() или исключением, если все попытки исчерпаны.
+        metadata — словарь (JSON), который хранится вместе с заданием.
+
+Очередь каждого принтера — с приоритетом по виртуальному сроку, как
+в job_scheduler: срок = момент постановки + стоимость / вес принтера
+(стоимость — job_cost по размеру и числу страниц). Памятка на 2 страницы
+уходит раньше отчёта на 1000 страниц, поставленного чуть раньше, а отчёт
+не голодает. Время от постановки до начала передачи пишется в Metrics
+по классам приоритета (forward_wait_small / _medium / _large). Стоимость
+и вес хранятся в outbox, так что после перезапуска порядок сохраняется.
+
+Для каждого целевого принтера работают свои потоки (по умолчанию один).
+Поток держит соединение с принтером открытым и отправляет подряд все
+готовые задания этого принтера; после IDLE_DISCONNECT секунд простоя или
+ошибки соединение закрывается.
+
+Ошибка отправки не теряет задание: попытка повторяется с экспоненциальной
+задержкой (RETRY_FIRST_DELAY ... RETRY_MAX_DELAY), и лишь после
+MAX_ATTEMPTS попыток задание считается неотправленным. На время задержки
+приостанавливается вся очередь принтера: если он недоступен, остальные
+задания не тратят на него свои попытки. Файл задания при
+этом не трогается — удалять его после успешной отправки должен тот, кто
+поставил задание в очередь.
+
+Незавершённые отправки переживают перезапуск: start() поднимает их из
+outbox и отправляет снова; итог по ним сообщается через
+on_resumed(path, error, metadata) (error = None — отправлено). Гарантия — «хотя бы
+один раз»: если служба упала между концом передачи и записью в outbox,
+задание будет отправлено повторно.
+
+Остановка: stop(timeout) даёт начатым передачам закончиться, а по
+истечении timeout обрывает их между кусками (документ снимается
+с принтера). Неначатые и оборванные задания остаются в outbox и после
+перезапуска отправляются без повторного решения оператора.
+
+Обратное давление: has_capacity(target) ложно, пока в очереди принтера
+max_pending заданий и больше; когда место освобождается, вызывается
+on_capacity(target) — конвейер в этот момент возобновляет анализ.
+"""
+
+import os
+import json
+import time
+import heapq
+import sqlite3
+import threading
+from concurrent.futures import Future
+
+from job_scheduler import priority_class
+from printer_sink import ForwardCancelled, forward_file, open_sink
+
+MAX_PENDING = 16
+MAX_ATTEMPTS = 8
+RETRY_FIRST_DELAY = 1.0
+RETRY_MAX_DELAY = 300.0
+RETRY_BACKOFF = 2
+# Через сколько секунд простоя закрывать соединение с принтером
+IDLE_DISCONNECT = 30.0
+# Сколько при остановке ждать оборванные передачи, секунды
+CANCEL_GRACE = 2.0
+
+
+class ForwardFailed(Exception):
+    pass
+
+
+class Outbox:
+    """
+    Незавершённые отправки в SQLite (одно соединение под блокировкой).
+    """
+
+    def __init__(self, db_path=":memory:"):
+        if db_path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock, self.conn:
+            if db_path != ":memory:":
+                self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS outbox ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " path TEXT NOT NULL,"
+                " target TEXT NOT NULL,"
+                " doc_name TEXT NOT NULL,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " last_error TEXT,"
+                " created_at REAL NOT NULL,"
+                " cost REAL NOT NULL DEFAULT 0,"
+                " weight REAL NOT NULL DEFAULT 1,"
+                " metadata TEXT)"
+            )
+            # outbox, созданный до приоритетов: задания в нём — со
+            # стоимостью 0, т.е. по порядку постановки, и без metadata
+            columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(outbox)")}
+            for column, definition in (("cost", "REAL NOT NULL DEFAULT 0"),
+                                       ("weight", "REAL NOT NULL DEFAULT 1"),
+                                       ("metadata", "TEXT")):
+                if column not in columns:
+                    self.conn.execute(f"ALTER TABLE outbox ADD COLUMN {column} {definition}")
+
+    def add(self, path, target, doc_name, cost=0.0, weight=1.0, metadata=None):
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO outbox (path, target, doc_name, created_at, cost, weight, metadata)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (path, target, doc_name, time.time(), cost, weight,
+                 json.dumps(metadata, ensure_ascii=False) if metadata is not None else None),
+            )
+        return cursor.lastrowid
+
+    def failed_attempt(self, entry_id, attempts, error):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE outbox SET attempts = ?, last_error = ? WHERE id = ?",
+                (attempts, error, entry_id),
+            )
+
+    def remove(self, entry_id):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM outbox WHERE id = ?", (entry_id,))
+
+    def entries(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT * FROM outbox ORDER BY id").fetchall()
+        return [dict(row) for row in rows]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def retry_delay(attempts):
+    return min(RETRY_MAX_DELAY, RETRY_FIRST_DELAY * RETRY_BACKOFF ** (attempts - 1))
+
+
+class ForwardSpooler:
+    """
+    workers — {целевой принтер: число потоков (соединений)}, по умолчанию 1;
+    open_sink(target, doc_name, keep_open) — фабрика приёмников.
+    """
+
+    def __init__(self, store_path=":memory:", workers=None, max_pending=MAX_PENDING,
+                 max_attempts=MAX_ATTEMPTS, metrics=None, on_capacity=None, on_resumed=None,
+                 open_sink=open_sink):
+        self.outbox = Outbox(store_path)
+        self.workers = dict(workers or {})
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.metrics = metrics
+        self.on_capacity = on_capacity
+        self.on_resumed = on_resumed
+        self.open_sink = open_sink
+        self.condition = threading.Condition()
+        # id -> запись; у каждого принтера своя куча (виртуальный срок, id)
+        self.entries = {}
+        self.queues = {}
+        self.pending = {}
+        # принтер -> момент, до которого его очередь приостановлена
+        self.resume_at = {}
+        self.threads = {}
+        self.stopped = False
+        # Установлен — передачи обрываются между кусками
+        self.cancel = threading.Event()
+        if metrics is not None:
+            metrics.add_gauge("forward_pending", lambda: len(self.entries))
+
+    # --- постановка в очередь ------------------------------------------------
+
+    def submit(self, path, target, doc_name=None, cost=0.0, weight=1.0, metadata=None):
+        """
+        cost — оценка стоимости (job_scheduler.job_cost), weight — вес
+        виртуального принтера, с которого пришло задание; metadata
+        вернётся в on_resumed, если отправку завершит уже следующий запуск.
+        """
+        if doc_name is None:
+            doc_name = os.path.basename(path)
+        entry_id = self.outbox.add(path, target, doc_name, cost, weight, metadata)
+        future = Future()
+        self.enqueue({
+            "id": entry_id,
+            "path": path,
+            "target": target,
+            "doc_name": doc_name,
+            "attempts": 0,
+            "cost": cost,
+            "weight": weight,
+            "future": future,
+        })
+        return future
+
+    def enqueue(self, entry, waited=0.0):
+        target = entry["target"]
+        now = time.monotonic()
+        entry["enqueued"] = now - waited
+        entry["deadline"] = entry["enqueued"] + entry["cost"] / (entry["weight"] or 1.0)
+        with self.condition:
+            if self.stopped:
+                raise RuntimeError("ForwardSpooler остановлен")
+            self.entries[entry["id"]] = entry
+            self.pending[target] = self.pending.get(target, 0) + 1
+            heapq.heappush(self.queues.setdefault(target, []), (entry["deadline"], entry["id"]))
+            self.start_workers(target)
+            self.condition.notify_all()
+
+    def has_capacity(self, target):
+        with self.condition:
+            return self.pending.get(target, 0) < self.max_pending
+
+    def pending_count(self, target=None):
+        with self.condition:
+            if target is None:
+                return len(self.entries)
+            return self.pending.get(target, 0)
+
+    # --- отправка ------------------------------------------------------------
+
+    def start_workers(self, target):
+        # Вызывается под self.condition
+        if target in self.threads:
+            return
+        self.threads[target] = []
+        for _ in range(self.workers.get(target, 1)):
+            thread = threading.Thread(target=self.worker, args=(target,),
+                                      name=f"forward:{target}", daemon=True)
+            thread.start()
+            self.threads[target].append(thread)
+
+    def next_entry(self, target, sink_connected):
+        """
+        Ждёт задание принтера с наименьшим виртуальным сроком. None —
+        остановка или простой (соединение пора закрыть).
+        """
+        with self.condition:
+            idle_since = time.monotonic()
+            while not self.stopped:
+                queue = self.queues[target]
+                now = time.monotonic()
+                ready_at = self.resume_at.get(target, 0.0) if queue else None
+                if ready_at is not None and ready_at <= now:
+                    _deadline, entry_id = heapq.heappop(queue)
+                    entry = self.entries[entry_id]
+                    if self.metrics is not None and entry["attempts"] == 0:
+                        self.metrics.observe(f"forward_wait_{priority_class(entry['cost'])}",
+                                             now - entry["enqueued"])
+                    return entry
+                timeout = ready_at - now if queue else None
+                if sink_connected:
+                    idle_left = idle_since + IDLE_DISCONNECT - now
+                    if idle_left <= 0:
+                        return None
+                    timeout = idle_left if timeout is None else min(timeout, idle_left)
+                self.condition.wait(timeout)
+            return None
+
+    def worker(self, target):
+        sink = None
+        while True:
+            entry = self.next_entry(target, sink is not None)
+            if entry is None:
+                if sink is not None:
+                    self.disconnect(sink)
+                    sink = None
+                if self.stopped:
+                    return
+                continue
+            if sink is None:
+                sink = self.open_sink(target, entry["doc_name"], keep_open=True)
+                if self.metrics is not None:
+                    self.metrics.increment("printer_connections")
+            sink.doc_name = entry["doc_name"]
+            try:
+                stats = forward_file(entry["path"], sink, cancel=self.cancel)
+            except ForwardCancelled:
+                # Остановка: задание остаётся в outbox, Future не завершается
+                if self.metrics is not None:
+                    self.metrics.increment("forward_interrupted")
+                return
+            except Exception as e:
+                # Соединение после ошибки не переиспользуется
+                self.disconnect(sink)
+                sink = None
+                self.failed(entry, e)
+                continue
+            self.sent(entry, stats)
+
+    def disconnect(self, sink):
+        try:
+            sink.disconnect()
+        except Exception:
+            pass
+
+    def sent(self, entry, stats):
+        with self.condition:
+            self.resume_at.pop(entry["target"], None)
+        self.outbox.remove(entry["id"])
+        if self.metrics is not None:
+            self.metrics.increment("forward_sent")
+            self.metrics.observe("forward_send", stats["seconds"])
+        self.finish(entry, stats, None)
+
+    def failed(self, entry, error):
+        entry["attempts"] += 1
+        message = f"{type(error).__name__}: {error}"
+        permanent = isinstance(error, FileNotFoundError) and error.filename == entry["path"]
+        if permanent or entry["attempts"] >= self.max_attempts:
+            self.outbox.remove(entry["id"])
+            if self.metrics is not None:
+                self.metrics.increment("forward_failed")
+            self.finish(entry, None, ForwardFailed(
+                f"{os.path.basename(entry['path'])} не отправлено на {entry['target']} "
+                f"после {entry['attempts']} попыток: {message}"))
+            return
+        self.outbox.failed_attempt(entry["id"], entry["attempts"], message)
+        if self.metrics is not None:
+            self.metrics.increment("forward_retries")
+        with self.condition:
+            # Задание сохраняет свой срок, а ждёт вся очередь принтера
+            heapq.heappush(self.queues[entry["target"]], (entry["deadline"], entry["id"]))
+            self.resume_at[entry["target"]] = time.monotonic() + retry_delay(entry["attempts"])
+            self.condition.notify_all()
+
+    def finish(self, entry, stats, error):
+        target = entry["target"]
+        with self.condition:
+            self.entries.pop(entry["id"], None)
+            self.pending[target] -= 1
+            freed = self.pending[target] == self.max_pending - 1
+        future = entry["future"]
+        if future is not None:
+            if error is None:
+                future.set_result(stats)
+            else:
+                future.set_exception(error)
+        elif self.on_resumed is not None:
+            self.on_resumed(entry["path"], error, entry["metadata"])
+        if freed and self.on_capacity is not None:
+            self.on_capacity(target)
+
+    # --- запуск и остановка --------------------------------------------------
+
+    def start(self):
+        """
+        Возобновляет отправки, не завершённые до перезапуска.
+        """
+        resumed = self.outbox.entries()
+        now = time.time()
+        for row in resumed:
+            # Время, проведённое в очереди до перезапуска, засчитывается
+            self.enqueue({
+                "id": row["id"],
+                "path": row["path"],
+                "target": row["target"],
+                "doc_name": row["doc_name"],
+                "attempts": row["attempts"],
+                "cost": row["cost"],
+                "weight": row["weight"],
+                "metadata": json.loads(row["metadata"]) if row["metadata"] else None,
+                "future": None,
+            }, waited=max(0.0, now - row["created_at"]))
+        return len(resumed)
+
+    def stop(self, timeout=None):
+        """
+        Останавливает потоки: начатые передачи дописываются, а не
+        успевшие за timeout секунд обрываются. Недоотправленные задания
+        остаются в outbox и будут отправлены после следующего start().
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+            threads = [thread for group in self.threads.values() for thread in group]
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in threads:
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        alive = [thread for thread in threads if thread.is_alive()]
+        if alive:
+            self.cancel.set()
+            for thread in alive:
+                thread.join(CANCEL_GRACE)
+        if not any(thread.is_alive() for thread in threads):
+            # Поток, не успевший дописать задание, ещё обратится к outbox
+            self.outbox.close()
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""
+job_api.py
+
+Локальный HTTP API очереди заданий — для панелей мониторинга и киосков,
+чтобы им не приходилось сканировать папки спулера самим.
+
+    GET  /jobs[?state=analysed&printer=VIRT1]   — задания из JobIndex
+    GET  /job?path=<путь>                       — одно задание
+    POST /job/forward?path=<путь>               — отправить на принтер
+    POST /job/delete?path=<путь>                — удалить
+    GET  /events?since=<N>&timeout=<с>          — long-poll ленты событий
+    GET  /events/stream                         — та же лента как SSE
+
+Задание описывается полями JobIndex: path, state, size, updated_at и
+record — запись анализа (страницы, форматы, принтер). Отправить или
+удалить можно задание, которое ждёт решения оператора в окне очереди;
+действие выполняется так же, как кнопка в окне, ответ — 202, а итог
+приходит в ленте событий.
+
+Лента событий — этапы заданий из Metrics (appeared, stable, analysed,
+shown, decided, forwarded, finished) с порядковым номером seq. Последние
+EVENT_BACKLOG событий хранятся в памяти: клиент передаёт номер последнего
+полученного (since или заголовок Last-Event-ID) и получает всё, что было
+после. Если клиент отстал больше чем на EVENT_BACKLOG событий, в ответе
+будет "reset": true — нужно заново запросить /jobs.
+
+Сервер слушает только localhost, но до него может достучаться и любая
+веб-страница, открытая оператором в браузере. Поэтому:
+    - запросы с заголовком Host не localhost отклоняются (защита от DNS
+      rebinding — иначе чужой сайт прочитал бы /jobs и ленту событий);
+    - запросы с заголовком Origin чужого сайта отклоняются (CSRF);
+    - если задан token, каждый запрос должен нести заголовок
+      "Authorization: Bearer <token>"; без token API только для чтения —
+      POST отклоняется всегда (служба по умолчанию создаёт токен сама,
+      см. printer_worker.API_TOKEN_FILE).
+"""
+
+import os
+import json
+import hmac
+import time
+import secrets
+import threading
+from collections import deque
+from urllib.parse import parse_qs, urlsplit
+
+from auto_rules import DELETE, FORWARD
+
+EVENT_BACKLOG = 10000
+# Наибольшее время ожидания long-poll и интервал пустых строк SSE, секунды
+LONG_POLL_MAX = 60.0
+SSE_KEEPALIVE = 15.0
+LOCAL_HOSTS = ("127.0.0.1", "localhost", "::1")
+
+
+def is_local_host(value):
+    """
+    Заголовок Host ("localhost:8765", "[::1]:8765") указывает на localhost.
+    """
+    if not value:
+        return False
+    return urlsplit(f"//{value}").hostname in LOCAL_HOSTS
+
+
+def is_local_origin(value):
+    """
+    Заголовка Origin нет (не браузер или запрос с той же страницы) или
+    это страница с localhost.
+    """
+    if value is None:
+        return True
+    url = urlsplit(value)
+    return url.scheme in ("http", "https") and url.hostname in LOCAL_HOSTS
+
+
+def load_token(path):
+    """
+    Токен API из файла path; если файла нет — создаёт случайный. Файл
+    читают локальные клиенты API (панели, киоски).
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            token = f.read().strip()
+        if token:
+            return token
+    except FileNotFoundError:
+        pass
+    token = secrets.token_urlsafe(32)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(token)
+    return token
+
+
+class EventFeed:
+    """
+    Кольцевой буфер событий с порядковыми номерами; ожидающие клиенты
+    просыпаются сразу при публикации.
+    """
+
+    def __init__(self, capacity=EVENT_BACKLOG):
+        self.condition = threading.Condition()
+        self.buffer = deque(maxlen=capacity)
+        self.last = 0
+        self.closed = False
+
+    def publish(self, event):
+        with self.condition:
+            self.last += 1
+            self.buffer.append(dict(event, seq=self.last))
+            self.condition.notify_all()
+
+    def since(self, seq, timeout=0.0):
+        """
+        События после seq; если их нет — ждёт до timeout секунд.
+        Возвращает (номер последнего события, события, пропущены ли
+        вытесненные из буфера).
+        """
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            if seq > self.last:
+                # Номер из прошлого запуска службы — отдать всё, что есть
+                seq = -1
+            while self.last <= seq and not self.closed:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                self.condition.wait(left)
+            oldest = self.buffer[0]["seq"] if self.buffer else self.last + 1
+            reset = seq < oldest - 1
+            events = [event for event in self.buffer if event["seq"] > seq]
+            return self.last, events, reset
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+def job_view(job, printer_of=None):
+    record = job["metadata"]
+    if record is not None and printer_of is not None and "printer" not in record:
+        printer = printer_of(job["path"])
+        record = dict(record, printer=printer["name"] if printer else None)
+    return {
+        "path": job["path"],
+        "state": job["state"],
+        "size": job["size"],
+        "updated_at": job["updated_at"],
+        "record": record,
+    }
+
+
+def serve_api(port, index, request, feed, printer_of=None, token=None, host="127.0.0.1"):
+    """
+    Поднимает API в фоновом потоке. request(path, action) — передать
+    действие FORWARD/DELETE окну очереди, возвращает False, если задание
+    не ждёт решения. Без token действия (POST) отклоняются.
+    Возвращает сервер (server.shutdown() для остановки;
+    перед этим feed.close(), чтобы отпустить клиентов SSE).
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            if not self.authorized(write=False):
+                return
+            url = urlsplit(self.path)
+            query = parse_qs(url.query)
+            if url.path == "/jobs":
+                state = query.get("state", [None])[0]
+                printer = query.get("printer", [None])[0]
+                jobs = [job_view(job, printer_of) for job in index.jobs(state)]
+                if printer is not None:
+                    jobs = [job for job in jobs
+                            if (job["record"] or {}).get("printer") == printer]
+                self.send_json(200, {"jobs": jobs})
+            elif url.path == "/job":
+                job = self.find_job(query)
+                if job is not None:
+                    self.send_json(200, job_view(job, printer_of))
+            elif url.path == "/events":
+                self.long_poll(query)
+            elif url.path == "/events/stream":
+                self.stream()
+            else:
+                self.send_json(404, {"error": "нет такого адреса"})
+
+        def do_POST(self):
+            # Тело запроса не используется, но должно быть прочитано
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if not self.authorized(write=True):
+                return
+            url = urlsplit(self.path)
+            actions = {"/job/forward": FORWARD, "/job/delete": DELETE}
+            if url.path not in actions:
+                self.send_json(404, {"error": "нет такого адреса"})
+                return
+            job = self.find_job(parse_qs(url.query))
+            if job is None:
+                return
+            if not request(job["path"], actions[url.path]):
+                self.send_json(409, {"error": "задание не ждёт решения", "state": job["state"]})
+                return
+            self.send_json(202, {"path": job["path"], "action": actions[url.path]})
+
+        # --- вспомогательное ---------------------------------------------------
+
+        def authorized(self, write):
+            if not is_local_host(self.headers.get("Host")):
+                self.send_json(403, {"error": "запросы принимаются только для localhost"})
+                return False
+            if not is_local_origin(self.headers.get("Origin")):
+                self.send_json(403, {"error": "запросы со сторонних страниц запрещены"})
+                return False
+            if token is None:
+                if not write:
+                    return True
+                self.send_json(403, {"error": "без токена API только для чтения"})
+                return False
+            header = self.headers.get("Authorization", "")
+            if hmac.compare_digest(header.encode("utf-8"), f"Bearer {token}".encode("utf-8")):
+                return True
+            self.send_json(401, {"error": "нужен токен"})
+            return False
+
+        def find_job(self, query):
+            path = query.get("path", [None])[0]
+            if not path:
+                self.send_json(400, {"error": "нужен параметр path"})
+                return None
+            job = index.get(path)
+            if job is None:
+                self.send_json(404, {"error": "задание не найдено"})
+            return job
+
+        def send_json(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def long_poll(self, query):
+            try:
+                since = int(query.get("since", ["0"])[0])
+                timeout = min(LONG_POLL_MAX, float(query.get("timeout", ["25"])[0]))
+            except ValueError:
+                self.send_json(400, {"error": "since и timeout — числа"})
+                return
+            last, events, reset = feed.since(since, timeout)
+            self.send_json(200, {"last": last, "events": events, "reset": reset})
+
+        def stream(self):
+            try:
+                seq = int(self.headers.get("Last-Event-ID") or feed.last)
+            except ValueError:
+                seq = feed.last
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            try:
+                while not feed.closed:
+                    last, events, reset = feed.since(seq, SSE_KEEPALIVE)
+                    if reset:
+                        self.wfile.write(b"event: reset\ndata: {}\n\n")
+                    for event in events:
+                        data = json.dumps(event, ensure_ascii=False)
+                        self.wfile.write(f"id: {event['seq']}\ndata: {data}\n\n".encode("utf-8"))
+                    if not events and not reset:
+                        self.wfile.write(b": keepalive\n\n")
+                    self.wfile.flush()
+                    seq = last
+            except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError):
+                pass
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,484 @@
+# -*- coding: utf-8 -*-
+r"""
+job_archive.py
+
+Архив обработанных заданий с дедупликацией по содержимому.
+
+Пользователи постоянно перепечатывают одни и те же шаблоны: шрифты,
+картинки и целые страницы в разных заданиях совпадают байт в байт. Архив
+хранит задание не целым XPS-файлом, а частями ZIP-пакета, каждая часть —
+один раз на весь архив:
+
+    <каталог>/parts/ab/abcdef...   — часть в том сжатом виде, в каком она
+                                     впервые пришла в архив (имя — BLAKE2b
+                                     от распакованного содержимого);
+    <каталог>/archive.sqlite3      — задания, их части по порядку и число
+                                     ссылок на каждую часть.
+
+Новая часть копируется в архив без распаковки и повторного сжатия, для
+уже известной пишется только ссылка. restore() собирает пакет заново из
+частей (zip_parts.RawZipWriter) — с теми же именами, порядком, датами и
+содержимым частей, что и исходный. Файл, который не читается как ZIP,
+хранится целиком одной частью.
+
+Запуск (просмотр и восстановление):
+    py job_archive.py --root C:\VM_PRINTERS\archive stats
+    py printer_worker.py archive list
+    py printer_worker.py archive restore 42 C:\tmp\job_42.xps
+    py printer_worker.py archive expire --days 180
+
+ArchiveWorker — этап службы после решения: отправленное задание
+архивируется в фоновом потоке, затем файл удаляется из папки спулера.
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import queue
+import shutil
+import sqlite3
+import hashlib
+import zipfile
+import argparse
+import threading
+
+from zip_parts import RawZipWriter, iter_content, raw_chunks
+
+ARCHIVE_DB = "archive.sqlite3"
+PARTS_DIR = "parts"
+HASH_SIZE = 16
+COPY_CHUNK = 1024 * 1024
+# Часть без имени — файл, сохранённый целиком
+WHOLE_FILE = None
+
+
+def content_hash(chunks):
+    digest = hashlib.blake2b(digest_size=HASH_SIZE)
+    for chunk in chunks:
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def date_time_text(date_time):
+    return "%04d-%02d-%02d %02d:%02d:%02d" % tuple(date_time)
+
+
+def parse_date_time(text):
+    date, clock = text.split(" ")
+    return tuple(int(x) for x in date.split("-")) + tuple(int(x) for x in clock.split(":"))
+
+
+class JobArchive:
+    """
+    Архив в каталоге root; потокобезопасен (одно соединение SQLite под
+    блокировкой). Хеширование и копирование частей идут без блокировки,
+    под ней — только запись в SQLite, поэтому stats() (метрика
+    archive_dedup_ratio) и остальные вызовы не ждут архивации большого
+    задания.
+    """
+
+    def __init__(self, root, metrics=None):
+        self.root = root
+        os.makedirs(os.path.join(root, PARTS_DIR), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(root, ARCHIVE_DB), check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS parts ("
+                " hash TEXT PRIMARY KEY,"
+                " method INTEGER NOT NULL,"
+                " crc INTEGER NOT NULL,"
+                " compress_size INTEGER NOT NULL,"
+                " file_size INTEGER NOT NULL,"
+                " refs INTEGER NOT NULL)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " path TEXT NOT NULL,"
+                " printer TEXT,"
+                " file_size INTEGER NOT NULL,"
+                " new_bytes INTEGER NOT NULL,"
+                " metadata TEXT,"
+                " archived_at REAL NOT NULL)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_parts ("
+                " job INTEGER NOT NULL,"
+                " seq INTEGER NOT NULL,"
+                " name TEXT,"
+                " hash TEXT NOT NULL,"
+                " date_time TEXT,"
+                " PRIMARY KEY (job, seq))"
+            )
+        if metrics is not None:
+            metrics.add_gauge("archive_dedup_ratio", lambda: self.stats()["ratio"])
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def part_path(self, digest):
+        return os.path.join(self.root, PARTS_DIR, digest[:2], digest)
+
+    # --- добавление ----------------------------------------------------------
+
+    def add(self, path, record=None):
+        """
+        Архивирует файл задания (record — запись анализа, если есть).
+        Возвращает номер задания в архиве.
+        """
+        # {хеш: временный файл} — новые части, ещё не перенесённые в архив
+        staged = {}
+        try:
+            try:
+                parts = self.store_parts(path, staged)
+            except (zipfile.BadZipFile, NotImplementedError, EOFError, zlib.error):
+                self.discard(staged)
+                parts = self.store_whole(path, staged)
+            file_size = os.path.getsize(path)
+            with self.lock:
+                new_bytes = self.place_parts(path, parts, staged)
+                with self.conn:
+                    cursor = self.conn.execute(
+                        "INSERT INTO jobs (path, printer, file_size, new_bytes, metadata, archived_at)"
+                        " VALUES (?, ?, ?, ?, ?, ?)",
+                        (path, (record or {}).get("printer"), file_size, new_bytes,
+                         json.dumps(record, ensure_ascii=False) if record else None, time.time()),
+                    )
+                    job = cursor.lastrowid
+                    for seq, (name, part, date_time, _info) in enumerate(parts):
+                        self.conn.execute(
+                            "INSERT INTO parts (hash, method, crc, compress_size, file_size, refs)"
+                            " VALUES (:hash, :method, :crc, :compress_size, :file_size, 1)"
+                            " ON CONFLICT(hash) DO UPDATE SET refs = refs + 1", part)
+                        self.conn.execute(
+                            "INSERT INTO job_parts (job, seq, name, hash, date_time) VALUES (?, ?, ?, ?, ?)",
+                            (job, seq, name, part["hash"], date_time))
+        finally:
+            self.discard(staged)
+        return job
+
+    def store_parts(self, path, staged):
+        """
+        Раскладывает ZIP-пакет на части; новые части копируются в сжатом
+        виде во временные файлы staged. Возвращает [(имя, часть, дата,
+        ZipInfo)].
+        """
+        parts = []
+        with zipfile.ZipFile(path, "r") as z, open(path, "rb") as f:
+            for info in z.infolist():
+                digest = content_hash(iter_content(raw_chunks(f, info), info.compress_type))
+                part = {
+                    "hash": digest,
+                    "method": info.compress_type,
+                    "crc": info.CRC,
+                    "compress_size": info.compress_size,
+                    "file_size": info.file_size,
+                }
+                if digest not in staged and not self.known(digest):
+                    staged[digest] = self.write_part(digest, raw_chunks(f, info))
+                parts.append((info.filename, part, date_time_text(info.date_time), info))
+        return parts
+
+    def store_whole(self, path, staged):
+        with open(path, "rb") as f:
+            digest = content_hash(iter(lambda: f.read(COPY_CHUNK), b""))
+        size = os.path.getsize(path)
+        part = {"hash": digest, "method": zipfile.ZIP_STORED, "crc": 0,
+                "compress_size": size, "file_size": size}
+        if not self.known(digest):
+            with open(path, "rb") as f:
+                staged[digest] = self.write_part(digest, iter(lambda: f.read(COPY_CHUNK), b""))
+        return [(WHOLE_FILE, part, None, None)]
+
+    def place_parts(self, path, parts, staged):
+        """
+        Вызывается под блокировкой перед записью задания. Файл части и её
+        строка в parts меняются только здесь, поэтому всегда согласованы:
+        если ту же часть (с тем же хешем, но, возможно, другим методом
+        сжатия) уже записал параллельный add(), наша копия отбрасывается
+        и задание ссылается на его файл и строку. Часть, которую add()
+        счёл известной, мог за это время удалить remove() (последняя
+        ссылка) — такие части копируются заново. Возвращает записано байт.
+        """
+        new_bytes = 0
+        placed = set()
+        for _name, part, _date_time, info in parts:
+            digest = part["hash"]
+            if digest in placed:
+                continue
+            placed.add(digest)
+            target = self.part_path(digest)
+            row = self.conn.execute("SELECT 1 FROM parts WHERE hash = ?", (digest,)).fetchone()
+            if row is not None and os.path.exists(target):
+                continue
+            temp = staged.pop(digest, None)
+            if temp is None:
+                with open(path, "rb") as f:
+                    if info is None:
+                        temp = self.write_part(digest, iter(lambda: f.read(COPY_CHUNK), b""))
+                    else:
+                        temp = self.write_part(digest, raw_chunks(f, info))
+            os.replace(temp, target)
+            if row is not None:
+                # Файл пропал при живой строке — строка описывает нашу копию
+                with self.conn:
+                    self.conn.execute(
+                        "UPDATE parts SET method = :method, crc = :crc,"
+                        " compress_size = :compress_size, file_size = :file_size"
+                        " WHERE hash = :hash", part)
+            new_bytes += part["compress_size"]
+        return new_bytes
+
+    def known(self, digest):
+        with self.lock:
+            row = self.conn.execute("SELECT 1 FROM parts WHERE hash = ?", (digest,)).fetchone()
+        return row is not None and os.path.exists(self.part_path(digest))
+
+    def write_part(self, digest, chunks):
+        """
+        Пишет часть во временный файл рядом с её местом в архиве и
+        возвращает его путь; на место файл переносит place_parts().
+        """
+        target = self.part_path(digest)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # Одну и ту же новую часть могут одновременно писать два add()
+        temp = f"{target}.{threading.get_ident()}.tmp"
+        with open(temp, "wb") as out:
+            for chunk in chunks:
+                out.write(chunk)
+        return temp
+
+    def discard(self, staged):
+        for temp in staged.values():
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+        staged.clear()
+
+    # --- чтение --------------------------------------------------------------
+
+    def jobs(self):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, path, printer, file_size, new_bytes, archived_at FROM jobs ORDER BY id"
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get(self, job):
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job,)).fetchone()
+        if row is None:
+            return None
+        result = dict(row)
+        result["metadata"] = json.loads(result["metadata"]) if result["metadata"] else None
+        return result
+
+    def restore(self, job, dest_path):
+        """
+        Собирает исходный пакет задания job в файл dest_path.
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT job_parts.name, job_parts.date_time, parts.*"
+                " FROM job_parts JOIN parts ON parts.hash = job_parts.hash"
+                " WHERE job_parts.job = ? ORDER BY job_parts.seq", (job,)
+            ).fetchall()
+        if not rows:
+            raise KeyError(job)
+        temp = dest_path + ".part"
+        with open(temp, "wb") as out:
+            if rows[0]["name"] is WHOLE_FILE:
+                with open(self.part_path(rows[0]["hash"]), "rb") as f:
+                    shutil.copyfileobj(f, out)
+            else:
+                with RawZipWriter(out) as writer:
+                    for row in rows:
+                        with open(self.part_path(row["hash"]), "rb") as f:
+                            writer.add_raw(
+                                row["name"], row["method"], row["crc"], row["compress_size"],
+                                row["file_size"], iter(lambda: f.read(COPY_CHUNK), b""),
+                                parse_date_time(row["date_time"]))
+        os.replace(temp, dest_path)
+        return dest_path
+
+    def stats(self):
+        """
+        jobs, parts, logical_bytes (сумма размеров исходных файлов),
+        stored_bytes (размер частей в архиве) и ratio — во сколько раз
+        архив меньше исходных файлов.
+        """
+        with self.lock:
+            jobs, logical = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(file_size), 0) FROM jobs").fetchone()
+            parts, stored = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(compress_size), 0) FROM parts").fetchone()
+        return {
+            "jobs": jobs,
+            "parts": parts,
+            "logical_bytes": logical,
+            "stored_bytes": stored,
+            "ratio": round(logical / stored, 2) if stored else 1.0,
+        }
+
+    # --- удаление ------------------------------------------------------------
+
+    def remove(self, job):
+        """
+        Удаляет задание из архива; части, на которые больше никто не
+        ссылается, удаляются с диска.
+        """
+        with self.lock:
+            with self.conn:
+                hashes = [row[0] for row in self.conn.execute(
+                    "SELECT hash FROM job_parts WHERE job = ?", (job,))]
+                self.conn.execute("DELETE FROM job_parts WHERE job = ?", (job,))
+                self.conn.execute("DELETE FROM jobs WHERE id = ?", (job,))
+                self.conn.executemany(
+                    "UPDATE parts SET refs = refs - 1 WHERE hash = ?", [(h,) for h in hashes])
+                orphans = [row[0] for row in self.conn.execute(
+                    "SELECT hash FROM parts WHERE refs <= 0")]
+                self.conn.execute("DELETE FROM parts WHERE refs <= 0")
+            for digest in orphans:
+                try:
+                    os.remove(self.part_path(digest))
+                except OSError:
+                    pass
+        return len(hashes) > 0
+
+    def expire(self, days):
+        """
+        Удаляет задания старше days дней. Возвращает их число.
+        """
+        cutoff = time.time() - days * 86400
+        with self.lock:
+            old = [row[0] for row in self.conn.execute(
+                "SELECT id FROM jobs WHERE archived_at < ?", (cutoff,))]
+        for job in old:
+            self.remove(job)
+        return len(old)
+
+
+class ArchiveWorker:
+    """
+    Этап после решения: dispose(path, record) ставит отправленное задание
+    в очередь архивации; фоновый поток архивирует его и удаляет файл.
+    Если архивировать не удалось, файл остаётся в папке спулера.
+    """
+
+    def __init__(self, archive, metrics=None):
+        self.archive = archive
+        self.metrics = metrics
+        self.queue = queue.Queue()
+        self.thread = None
+        self.deadline = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="archive", daemon=True)
+        self.thread.start()
+
+    def dispose(self, path, record=None):
+        self.queue.put((path, record))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.deadline is not None and time.monotonic() >= self.deadline:
+                # Остановка затянулась — остальное заархивируется при запуске
+                return
+            path, record = item
+            started = time.monotonic()
+            try:
+                self.archive.add(path, record)
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                print(f"Задание {os.path.basename(path)} не заархивировано: {e}")
+                continue
+            if self.metrics is not None:
+                self.metrics.increment("archived_jobs")
+                self.metrics.observe("archive", time.monotonic() - started)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stop(self, timeout=None):
+        """
+        Дожидается заданий, уже стоящих в очереди (не дольше timeout);
+        не успевшие остаются в папке спулера в состоянии forwarded.
+        """
+        if timeout is not None:
+            self.deadline = time.monotonic() + timeout
+        self.queue.put(None)
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+
+def format_bytes(size):
+    for unit in ("Б", "КБ", "МБ", "ГБ"):
+        if size < 1024 or unit == "ГБ":
+            return f"{size:.0f} {unit}" if unit == "Б" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def main(argv=None, root=None):
+    parser = argparse.ArgumentParser(
+        prog="archive",
+        description="Архив обработанных заданий: список, статистика, восстановление.",
+    )
+    parser.add_argument("--root", default=root, required=root is None, help="каталог архива")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="задания в архиве")
+    commands.add_parser("stats", help="объём и коэффициент дедупликации")
+    restore = commands.add_parser("restore", help="восстановить XPS-файл задания")
+    restore.add_argument("job", type=int)
+    restore.add_argument("dest")
+    remove = commands.add_parser("remove", help="удалить задание из архива")
+    remove.add_argument("job", type=int)
+    expire = commands.add_parser("expire", help="удалить задания старше N дней")
+    expire.add_argument("--days", type=float, required=True)
+    args = parser.parse_args(argv)
+
+    archive = JobArchive(args.root)
+    try:
+        if args.command == "list":
+            for job in archive.jobs():
+                archived = time.strftime("%Y-%m-%d %H:%M", time.localtime(job["archived_at"]))
+                print(f"{job['id']:>6}  {archived}  {job['printer'] or '-':<16} "
+                      f"{format_bytes(job['file_size']):>10}  {job['path']}")
+        elif args.command == "stats":
+            stats = archive.stats()
+            print(f"Заданий: {stats['jobs']}, частей: {stats['parts']}")
+            print(f"Исходный объём: {format_bytes(stats['logical_bytes'])}, "
+                  f"в архиве: {format_bytes(stats['stored_bytes'])}, "
+                  f"дедупликация: ×{stats['ratio']}")
+        elif args.command == "restore":
+            try:
+                archive.restore(args.job, args.dest)
+            except KeyError:
+                print(f"Задания {args.job} нет в архиве", file=sys.stderr)
+                return 1
+            print(f"Задание {args.job} восстановлено: {args.dest}")
+        elif args.command == "remove":
+            if not archive.remove(args.job):
+                print(f"Задания {args.job} нет в архиве", file=sys.stderr)
+                return 1
+        elif args.command == "expire":
+            print(f"Удалено заданий: {archive.expire(args.days)}")
+    finally:
+        archive.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+job_index.py
+
+Постоянный индекс заданий в SQLite, чтобы после перезапуска службы не
+анализировать и не показывать заново всё, что уже лежит в папке спулера.
+
+Запись задания: путь, размер, mtime, отпечаток содержимого, состояние и
+метаданные анализа (JSON). Состояния:
+
+    detected -> stable -> analysed -> decided -> forwarded / deleted
+
+Переходы назад возможны только в detected (файл заменён новым содержимым)
+и из decided в analysed — отправка не удалась, задание снова ждёт решения.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+DETECTED = "detected"
+STABLE = "stable"
+ANALYSED = "analysed"
+DECIDED = "decided"
+FORWARDED = "forwarded"
+DELETED = "deleted"
+
+STATES = (DETECTED, STABLE, ANALYSED, DECIDED, FORWARDED, DELETED)
+
+TRANSITIONS = {
+    DETECTED: {STABLE},
+    STABLE: {ANALYSED},
+    ANALYSED: {DECIDED},
+    DECIDED: {FORWARDED, DELETED, ANALYSED},
+    FORWARDED: set(),
+    DELETED: set(),
+}
+
+# Хвост файла, по которому считается отпечаток: в нём лежит центральный
+# каталог ZIP с CRC32 и размерами всех частей, так что отпечаток меняется
+# вместе с содержимым, но не требует чтения всего многомегабайтного файла
+FINGERPRINT_TAIL = 1024 * 1024
+
+
+def content_fingerprint(file_path):
+    """
+    Отпечаток содержимого: BLAKE2b от размера и хвоста файла.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - FINGERPRINT_TAIL))
+        digest.update(size.to_bytes(8, "little"))
+        digest.update(f.read(FINGERPRINT_TAIL))
+    return digest.hexdigest()
+
+
+class InvalidTransition(ValueError):
+    pass
+
+
+class JobIndex:
+    """
+    Потокобезопасная обёртка над SQLite (одно соединение под блокировкой).
+    """
+
+    def __init__(self, db_path=":memory:"):
+        if db_path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock, self.conn:
+            if db_path != ":memory:":
+                self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " path TEXT PRIMARY KEY,"
+                " size INTEGER NOT NULL,"
+                " mtime_ns INTEGER NOT NULL,"
+                " content_hash TEXT,"
+                " state TEXT NOT NULL,"
+                " metadata TEXT,"
+                " updated_at REAL NOT NULL)"
+            )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def get(self, path):
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM jobs WHERE path = ?", (path,)).fetchone()
+        return row_to_job(row)
+
+    def jobs(self, state=None):
+        with self.lock:
+            if state is None:
+                rows = self.conn.execute("SELECT * FROM jobs ORDER BY path").fetchall()
+            else:
+                rows = self.conn.execute(
+                    "SELECT * FROM jobs WHERE state = ? ORDER BY path", (state,)
+                ).fetchall()
+        return [row_to_job(row) for row in rows]
+
+    def detect(self, path, size, mtime_ns):
+        """
+        Регистрирует файл (новый или заменённый) в состоянии detected.
+        """
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO jobs (path, size, mtime_ns, content_hash, state, metadata, updated_at)"
+                " VALUES (?, ?, ?, NULL, ?, NULL, ?)",
+                (path, size, mtime_ns, DETECTED, time.time()),
+            )
+
+    def mark_stable(self, path, size, mtime_ns, content_hash):
+        """
+        Файл дописан. Если отпечаток совпал с уже известным и задание было
+        проанализировано раньше, состояние и метаданные сохраняются (файл
+        лишь «потрогали»); иначе задание начинается заново как stable.
+        Возвращает актуальную запись.
+        """
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT * FROM jobs WHERE path = ?", (path,)).fetchone()
+            if row is not None and row["content_hash"] == content_hash and row["state"] not in (DETECTED, STABLE):
+                self.conn.execute(
+                    "UPDATE jobs SET size = ?, mtime_ns = ?, updated_at = ? WHERE path = ?",
+                    (size, mtime_ns, time.time(), path),
+                )
+            else:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO jobs (path, size, mtime_ns, content_hash, state, metadata, updated_at)"
+                    " VALUES (?, ?, ?, ?, ?, NULL, ?)",
+                    (path, size, mtime_ns, content_hash, STABLE, time.time()),
+                )
+            row = self.conn.execute("SELECT * FROM jobs WHERE path = ?", (path,)).fetchone()
+        return row_to_job(row)
+
+    def set_state(self, path, state, metadata=None):
+        """
+        Переводит задание в новое состояние с проверкой перехода.
+        """
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT state FROM jobs WHERE path = ?", (path,)).fetchone()
+            if row is None:
+                raise KeyError(path)
+            if state not in TRANSITIONS[row["state"]]:
+                raise InvalidTransition(f"{path}: {row['state']} -> {state}")
+            if metadata is None:
+                self.conn.execute(
+                    "UPDATE jobs SET state = ?, updated_at = ? WHERE path = ?",
+                    (state, time.time(), path),
+                )
+            else:
+                self.conn.execute(
+                    "UPDATE jobs SET state = ?, metadata = ?, updated_at = ? WHERE path = ?",
+                    (state, json.dumps(metadata, ensure_ascii=False), time.time(), path),
+                )
+
+    def remove(self, path):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM jobs WHERE path = ?", (path,))
+
+    def reconcile(self, folder):
+        """
+        Инкрементальная сверка при старте: записи о файлах, которых больше
+        нет в папке, удаляются. Возвращает число удалённых записей.
+        """
+        with self.lock:
+            paths = [row[0] for row in self.conn.execute("SELECT path FROM jobs")]
+        prefix = os.path.join(folder, "")
+        missing = [path for path in paths
+                   if path.startswith(prefix) and not os.path.exists(path)]
+        with self.lock, self.conn:
+            self.conn.executemany("DELETE FROM jobs WHERE path = ?", [(p,) for p in missing])
+        return len(missing)
+
+
+def row_to_job(row):
+    if row is None:
+        return None
+    job = dict(row)
+    job["metadata"] = json.loads(job["metadata"]) if job["metadata"] else None
+    return job
@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+"""
+job_pipeline.py
+
+Конвейер обработки заданий печати. Этапы связаны очередями и не блокируют
+друг друга:
+
+    обнаружение (один наблюдатель на папки всех принтеров)
+        -> стабилизация (CompletionTracker: проверка EOCD всех файлов сразу)
+        -> анализ (analyze_xps в общем пуле потоков или процессов;
+           PriorityExecutor пускает первыми дешёвые задания, с учётом
+           весов и ограничений принтеров; в режиме процессов страницы
+           больших пакетов делятся между процессами — xps_sharding)
+        -> решение пользователя (отдельный поток, по одному заданию)
+
+Наблюдатель продолжает сканировать папки, пока задания ждут записи,
+анализируются или висят в диалоге.
+"""
+
+import os
+import time
+import queue
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from file_completion import CompletionTracker
+from folder_watcher import DELETED, MODIFIED, create_watcher
+from job_index import (
+    ANALYSED, DECIDED, DETECTED, FORWARDED, STABLE, DELETED as JOB_DELETED,
+    JobIndex, content_fingerprint,
+)
+from job_scheduler import PriorityExecutor, job_cost
+from metrics import APPEARED, SHOWN, Metrics
+from printer_config import folder_key, make_printer
+from xps_analysis import analyze_xps, estimate_page_count
+from xps_sharding import analyze_xps_sharded
+
+DEFERRED = "deferred"
+# Как часто цикл обнаружения проверяет stop_event, секунды
+STOP_CHECK_INTERVAL = 0.2
+# Сколько при остановке ждать уже начатые анализы, секунды
+DRAIN_TIMEOUT = 10.0
+
+
+def report_error(message):
+    print(f"{message}:")
+    traceback.print_exc()
+
+
+class JobPipeline:
+    """
+    decide(record) вызывается в отдельном потоке для каждого
+    проанализированного задания (record — словарь из analyze_xps) и
+    возвращает итог: FORWARDED, DELETED или None, если решение отложено.
+    DEFERRED означает, что решение придёт позже через resolve() — задание
+    до тех пор считается находящимся в конвейере.
+
+    Состояние заданий хранится в JobIndex: уже решённые файлы после
+    перезапуска пропускаются, а проанализированные, но не решённые,
+    показываются снова из кэша без повторного анализа.
+
+    Этапы каждого задания и глубины очередей отмечаются в Metrics.
+
+    printers — папка или список принтеров из printer_config; в record перед
+    decide() добавляется имя принтера ("printer"), которому принадлежит
+    папка задания.
+
+    admit(принтер) -> False приостанавливает анализ заданий принтера
+    (обратное давление, когда его целевой принтер не успевает); после
+    освобождения места нужно вызвать kick().
+
+    accounting — print_accounting.PrintAccounting: каждое отправленное или
+    удалённое задание учитывается в нём один раз.
+
+    fallback(record) — решение, если decide() упал (обычно окно оператора:
+    JobQueueWindow.decide); ошибка печатается с трассировкой, а задание не
+    пропадает. Без fallback (или если упал и он) задание остаётся
+    analysed и будет показано снова после перезапуска.
+
+    При остановке задания из очереди анализа снимаются (после перезапуска
+    они просто будут проанализированы), а уже начатые анализы
+    дорабатывают до drain_timeout и сохраняются в индексе как analysed —
+    повторно их разбирать не придётся.
+    """
+
+    def __init__(self, printers, decide, analysis_workers=4, use_processes=False,
+                 watcher_backend="auto", index=None, metrics=None, admit=None,
+                 accounting=None, fallback=None):
+        if isinstance(printers, str):
+            printers = [make_printer(None, printers)]
+        self.printers = {folder_key(p["folder"]): p for p in printers}
+        self.decide = decide
+        self.fallback = fallback
+        self.analysis_workers = analysis_workers
+        self.use_processes = use_processes
+        self.watcher_backend = watcher_backend
+        self.index = index if index is not None else JobIndex()
+        self.metrics = metrics if metrics is not None else Metrics()
+
+        self.tracker = CompletionTracker(
+            self.on_stable, self.on_stable, self.abandon_job
+        )
+        self.decision_queue = queue.Queue()
+        self.lock = threading.Lock()
+        # Задания, которые сейчас проходят конвейер
+        self.in_flight = set()
+        # Задания в очереди анализа и в самом анализе
+        self.analysing = set()
+        self.analysis_done = threading.Condition()
+        self.analysis_limits = {p["name"]: p["max_analysis"] for p in printers if p.get("max_analysis")}
+        self.weights = {p["name"]: p.get("weight", 1.0) for p in printers}
+        self.admit = admit
+        self.accounting = accounting
+        self.executor = None
+        self.process_pool = None
+        self.threads = []
+
+        self.metrics.add_gauge("jobs_in_pipeline", lambda: len(self.in_flight))
+        self.metrics.add_gauge("completion_pending", self.tracker.pending_count)
+        self.metrics.add_gauge("analysis_queue_depth", lambda: len(self.executor))
+        self.metrics.add_gauge("analysis_running", lambda: self.executor.running)
+        self.metrics.add_gauge("decision_queue_depth", self.decision_queue.qsize)
+
+    def printer_of(self, path):
+        return self.printers.get(folder_key(os.path.dirname(path)))
+
+    # --- обнаружение ---------------------------------------------------------
+
+    def on_file_event(self, action, path):
+        with self.lock:
+            if path in self.in_flight:
+                return
+            if action == DELETED:
+                self.index.remove(path)
+                return
+            try:
+                st = os.stat(path)
+            except OSError:
+                return
+            job = self.index.get(path)
+            unchanged = (job is not None and job["size"] == st.st_size
+                         and job["mtime_ns"] == st.st_mtime_ns)
+            if unchanged and job["state"] in (DECIDED, FORWARDED, JOB_DELETED):
+                return
+            self.in_flight.add(path)
+            self.metrics.record(path, APPEARED)
+            if unchanged and job["state"] == ANALYSED:
+                # Проанализировано до перезапуска — сразу к решению
+                self.decision_queue.put(job["metadata"])
+                return
+            if job is None or job["state"] in (DETECTED, STABLE):
+                self.index.detect(path, st.st_size, st.st_mtime_ns)
+        self.tracker.add(path)
+
+    def finish_job(self, path, outcome=None):
+        with self.lock:
+            self.in_flight.discard(path)
+            if not os.path.exists(path):
+                self.index.remove(path)
+        self.metrics.finish(path, outcome)
+
+    def abandon_job(self, path):
+        # Файл исчез или конвейер останавливается — повторно его подхватит
+        # следующее событие наблюдателя
+        with self.lock:
+            self.in_flight.discard(path)
+        self.metrics.finish(path, "abandoned")
+
+    # --- стабилизация и анализ -----------------------------------------------
+
+    def on_stable(self, path):
+        # Файл, так и не ставший корректным ZIP, тоже анализируется:
+        # задание не пропадает молча, оператор увидит его и решит сам
+        try:
+            st = os.stat(path)
+            job = self.index.mark_stable(
+                path, st.st_size, st.st_mtime_ns, content_fingerprint(path)
+            )
+        except OSError:
+            self.abandon_job(path)
+            return
+        self.metrics.record(path, STABLE)
+        if job["state"] == ANALYSED:
+            # Содержимое не изменилось — метаданные берутся из индекса
+            self.decision_queue.put(job["metadata"])
+            return
+        if job["state"] != STABLE:
+            self.finish_job(path, "unchanged")
+            return
+        # Стоимость — по размеру и числу страниц в центральном каталоге
+        cost = job_cost(st.st_size, estimate_page_count(path))
+        with self.analysis_done:
+            self.analysing.add(path)
+        try:
+            future = self.executor.submit(self.printer_of(path)["name"], cost, self.analyze, path)
+        except RuntimeError:
+            # Пул уже остановлен — конвейер завершается
+            self.analysed(path)
+            self.abandon_job(path)
+            return
+        future.add_done_callback(lambda f, p=path: self.on_analyzed(p, f))
+
+    def analyze(self, path):
+        if self.process_pool is None:
+            return analyze_xps(path)
+        # Потоки пула лишь ждут процессы: разбор XML идёт в process_pool,
+        # большие пакеты — по частям
+        return analyze_xps_sharded(path, self.process_pool, self.analysis_workers)
+
+    def on_analyzed(self, path, future):
+        try:
+            record = future.result()
+            self.index.set_state(path, ANALYSED, record)
+        except Exception:
+            self.abandon_job(path)
+            return
+        finally:
+            self.analysed(path)
+        self.metrics.record(path, ANALYSED)
+        self.decision_queue.put(record)
+
+    def analysed(self, path):
+        with self.analysis_done:
+            self.analysing.discard(path)
+            self.analysis_done.notify_all()
+
+    def wait_analyses(self, timeout):
+        """
+        Ждёт завершения начатых анализов не дольше timeout секунд.
+        Возвращает число незавершённых.
+        """
+        deadline = time.monotonic() + timeout
+        with self.analysis_done:
+            while self.analysing:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                self.analysis_done.wait(left)
+            return len(self.analysing)
+
+    # --- решение -------------------------------------------------------------
+
+    def decision_loop(self):
+        while True:
+            record = self.decision_queue.get()
+            if record is None:
+                return
+            path = record["path"]
+            printer = self.printer_of(path)
+            record["printer"] = printer["name"] if printer else None
+            self.metrics.record(path, SHOWN)
+            try:
+                outcome = self.decide(record)
+            except Exception:
+                report_error(f"Решение по заданию {os.path.basename(path)} не принято")
+                outcome = self.decide_fallback(record)
+            if outcome != DEFERRED:
+                self.resolve(path, outcome)
+
+    def decide_fallback(self, record):
+        # Задание передаётся оператору, а не выпадает из конвейера
+        if self.fallback is None:
+            return None
+        try:
+            return self.fallback(record)
+        except Exception:
+            report_error(f"Задание {os.path.basename(record['path'])} не передано оператору")
+            return None
+
+    def resolve(self, path, outcome):
+        """
+        Итог решения по заданию; можно вызывать из любого потока.
+        None — решение отложено: задание остаётся analysed и будет
+        показано снова после перезапуска.
+        """
+        try:
+            if outcome in (FORWARDED, JOB_DELETED):
+                # Окно могло отметить эти этапы раньше, в момент клика
+                self.metrics.record(path, DECIDED)
+                if outcome == FORWARDED:
+                    self.metrics.record(path, FORWARDED)
+                self.mark_decided(path)
+                self.index.set_state(path, outcome)
+                if self.accounting is not None:
+                    self.account(path, outcome)
+        except Exception:
+            report_error(f"Итог {outcome} задания {os.path.basename(path)} не сохранён")
+        finally:
+            self.finish_job(path, outcome)
+
+    def account(self, path, outcome):
+        # После перехода в forwarded/deleted: повторный resolve() того же
+        # задания упадёт на set_state и второй раз не посчитается
+        job = self.index.get(path)
+        record = dict(job["metadata"] or {}) if job else {"path": path}
+        printer = self.printer_of(path)
+        record["printer"] = printer["name"] if printer else None
+        self.accounting.record_job(record, outcome)
+
+    def mark_decided(self, path):
+        """
+        Решение принято, но ещё не исполнено (задание в очереди отправки):
+        после перезапуска оно не будет показано оператору снова.
+        """
+        job = self.index.get(path)
+        if job is not None and job["state"] == ANALYSED:
+            self.index.set_state(path, DECIDED)
+
+    def reopen(self, path):
+        """
+        Отправка не удалась: задание снова ждёт решения. Если оно уже не
+        в конвейере (например, отправка была продолжена после перезапуска),
+        оно заново попадает к decide().
+        """
+        try:
+            job = self.index.get(path)
+            if job is not None and job["state"] == DECIDED:
+                self.index.set_state(path, ANALYSED)
+        except Exception:
+            pass
+        self.on_file_event(MODIFIED, path)
+
+    def kick(self):
+        """
+        Повторно проверить приостановленные admit() задания.
+        """
+        if self.executor is not None:
+            self.executor.dispatch()
+
+    # --- запуск --------------------------------------------------------------
+
+    def start_thread(self, target):
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def run(self, stop_event, drain_timeout=DRAIN_TIMEOUT):
+        """
+        Запускает конвейер и крутит цикл обнаружения до stop_event; затем
+        дожидается начатых анализов (не дольше drain_timeout секунд).
+        """
+        folders = [p["folder"] for p in self.printers.values()]
+        for folder in folders:
+            os.makedirs(folder, exist_ok=True)
+
+        if self.use_processes:
+            self.process_pool = ProcessPoolExecutor(max_workers=self.analysis_workers)
+        self.executor = PriorityExecutor(
+            ThreadPoolExecutor(max_workers=self.analysis_workers),
+            self.analysis_workers,
+            limits=self.analysis_limits,
+            weights=self.weights,
+            metrics=self.metrics,
+            name="analysis",
+            admit=self.admit,
+        )
+        self.tracker.start()
+        self.start_thread(self.decision_loop)
+
+        for folder in folders:
+            self.index.reconcile(folder)
+        try:
+            with create_watcher(folders, self.watcher_backend) as watcher:
+                while not stop_event.is_set():
+                    for action, path in watcher.read_events(timeout=STOP_CHECK_INTERVAL):
+                        self.on_file_event(action, path)
+        finally:
+            self.tracker.stop()
+            # Очередь анализа снимается, начатые анализы дорабатывают;
+            # пул процессов нужен им до конца (xps_sharding)
+            self.executor.shutdown(wait=False)
+            self.wait_analyses(drain_timeout)
+            if self.process_pool is not None:
+                self.process_pool.shutdown(wait=False, cancel_futures=True)
+            self.decision_queue.put(None)
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+"""
+job_preview.py
+
+Миниатюры заданий для окна очереди: оператор видит, что отправляет, не
+открывая файл в другой программе.
+
+Источник картинки — по порядку:
+    1. миниатюра пакета (связь metadata/thumbnail в _rels/.rels, обычно
+       Metadata/thumbnail.png или .jpg от XPS Document Writer);
+    2. миниатюра первой страницы (та же связь в _rels страницы);
+    3. самая большая картинка первой страницы.
+Из ZIP читается только выбранная часть.
+
+Декодирование и уменьшение до PREVIEW_BOX идут в фоновом потоке
+(PreviewLoader), а окну достаётся готовая картинка PPM, которую Tk лишь
+копирует в PhotoImage. Если установлен Pillow, он декодирует любые
+форматы (JPEG, TIFF, большие PNG); без него — PNG размером до
+PURE_DECODE_PIXELS точек встроенным декодером.
+
+Готовые миниатюры лежат в LRU-кэше, ограниченном по байтам. Ключ —
+отпечаток содержимого задания, уже посчитанный конвейером и лежащий
+в JobIndex (content_hash): повторный выбор того же задания — даже под
+другим именем — картинку заново не декодирует, а сам выбор стоит одного
+stat и запроса к индексу, без чтения файла. Задание, которого нет в
+индексе, кэшируется по (путь, размер, время изменения).
+"""
+
+import io
+import os
+import zlib
+import struct
+import zipfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from xps_analysis import PACKAGE_RELS, find_pages, iter_elements, resolve_part
+from xps_split import page_references, rels_name
+
+THUMBNAIL_RELATIONSHIP = "/metadata/thumbnail"
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".wdp", ".jxr")
+# Наибольший размер миниатюры в окне, точки
+PREVIEW_BOX = (240, 320)
+CACHE_BYTES = 32 * 1024 * 1024
+# Больше этого встроенный декодер PNG не берётся: он на чистом Python
+# (миниатюры XPS Document Writer — до 256 точек по большей стороне)
+PURE_DECODE_PIXELS = 256 * 256
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Цветовой тип PNG -> байт на точку (глубина 8 бит)
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+# Задание проверено, подходящей картинки в нём нет
+NO_PREVIEW = "none"
+
+
+class LRUCache:
+    """
+    Потокобезопасный LRU-кэш, ограниченный суммарной «стоимостью»
+    значений (байтами).
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key, default=None):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            self.items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value, cost):
+        with self.lock:
+            old = self.items.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self.items[key] = (value, cost)
+            self.bytes += cost
+            while self.bytes > self.max_bytes and len(self.items) > 1:
+                _key, (_value, evicted) = self.items.popitem(last=False)
+                self.bytes -= evicted
+
+
+# --- поиск картинки ----------------------------------------------------------
+
+def thumbnail_target(z, parts, source):
+    """
+    Часть-миниатюра из связей части source ("" — сам пакет) или None.
+    """
+    rels = parts.get(PACKAGE_RELS if not source else rels_name(source).lower())
+    if rels is None:
+        return None
+    for attrib in iter_elements(z, rels, "Relationship"):
+        if attrib.get("Type", "").lower().endswith(THUMBNAIL_RELATIONSHIP):
+            return resolve_part(source, attrib.get("Target", "")).lower()
+    return None
+
+
+def preview_candidates(z):
+    """
+    Имена частей, из которых можно сделать миниатюру, в порядке
+    предпочтения.
+    """
+    parts = {info.filename.lower(): info for info in z.infolist()}
+    candidates = [thumbnail_target(z, parts, "")]
+    pages = find_pages(z)
+    if pages:
+        first = pages[0][0]
+        candidates.append(thumbnail_target(z, parts, first))
+        try:
+            images = [name for name in page_references(z, parts, first)
+                      if name.endswith(IMAGE_EXTENSIONS) and name in parts]
+        except Exception:
+            images = []
+        candidates.extend(sorted(images, key=lambda name: -parts[name].file_size))
+    seen = set()
+    names = []
+    for name in candidates:
+        if name is not None and name in parts and name not in seen:
+            seen.add(name)
+            names.append(parts[name].filename)
+    return names
+
+
+# --- декодирование -----------------------------------------------------------
+
+def to_ppm(width, height, rgb):
+    return b"P6\n%d %d\n255\n" % (width, height) + bytes(rgb)
+
+
+def fit_step(width, height, box):
+    # Шаг прореживания, чтобы картинка поместилась в box
+    return max(1, -(-width // box[0]), -(-height // box[1]))
+
+
+def paeth(a, b, c):
+    p = a + b - c
+    pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+    if pa <= pb and pa <= pc:
+        return a
+    return b if pb <= pc else c
+
+
+def decode_png(data, box):
+    """
+    Встроенный декодер PNG (8 бит, без чересстрочности): уменьшенная
+    картинка (ширина, высота, RGB-байты) или None, если формат не
+    поддерживается или картинка слишком велика.
+    """
+    if not data.startswith(PNG_SIGNATURE):
+        return None
+    pos = len(PNG_SIGNATURE)
+    header = None
+    palette = b""
+    idat = []
+    while pos + 8 <= len(data):
+        length, kind = struct.unpack(">I4s", data[pos:pos + 8])
+        body = data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+        if kind == b"IHDR":
+            header = struct.unpack(">IIBBBBB", body)
+        elif kind == b"PLTE":
+            palette = body
+        elif kind == b"IDAT":
+            idat.append(body)
+        elif kind == b"IEND":
+            break
+    if header is None:
+        return None
+    width, height, depth, color, _compression, _filter, interlace = header
+    if depth != 8 or interlace or color not in PNG_CHANNELS or width * height > PURE_DECODE_PIXELS:
+        return None
+    bpp = PNG_CHANNELS[color]
+    stride = width * bpp
+    # Распаковка ограничена размером картинки из IHDR: поток IDAT в чужом
+    # файле может разворачиваться в гигабайты
+    expected = (stride + 1) * height
+    raw = zlib.decompressobj().decompress(b"".join(idat), expected + 1)
+    if len(raw) != expected:
+        return None
+    step = fit_step(width, height, box)
+    columns = range(0, width, step)
+    out = bytearray()
+    prev = bytearray(stride)
+    for y in range(height):
+        start = y * (stride + 1)
+        kind = raw[start]
+        row = bytearray(raw[start + 1:start + 1 + stride])
+        if kind == 1:
+            for i in range(bpp, stride):
+                row[i] = (row[i] + row[i - bpp]) & 0xFF
+        elif kind == 2:
+            row = bytearray((a + b) & 0xFF for a, b in zip(row, prev))
+        elif kind == 3:
+            for i in range(stride):
+                left = row[i - bpp] if i >= bpp else 0
+                row[i] = (row[i] + ((left + prev[i]) >> 1)) & 0xFF
+        elif kind == 4:
+            for i in range(stride):
+                if i >= bpp:
+                    row[i] = (row[i] + paeth(row[i - bpp], prev[i], prev[i - bpp])) & 0xFF
+                else:
+                    row[i] = (row[i] + prev[i]) & 0xFF
+        prev = row
+        if y % step:
+            continue
+        for x in columns:
+            i = x * bpp
+            if color == 2:
+                out += row[i:i + 3]
+            elif color == 6:
+                alpha = row[i + 3]
+                out += bytes((c * alpha + 255 * (255 - alpha)) // 255 for c in row[i:i + 3])
+            elif color == 3:
+                out += palette[row[i] * 3:row[i] * 3 + 3]
+            else:
+                gray = row[i]
+                if color == 4:
+                    gray = (gray * row[i + 1] + 255 * (255 - row[i + 1])) // 255
+                out += bytes((gray, gray, gray))
+    return len(columns), len(range(0, height, step)), out
+
+
+def decode_with_pillow(data, box):
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    with Image.open(io.BytesIO(data)) as image:
+        # JPEG декодируется сразу в уменьшенном масштабе
+        image.draft("RGB", box)
+        image.thumbnail(box)
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+            image = Image.alpha_composite(background, image)
+        image = image.convert("RGB")
+        return image.width, image.height, image.tobytes()
+
+
+def decode_image(data, box=PREVIEW_BOX):
+    """
+    (ширина, высота, RGB) уменьшенной до box картинки или None.
+    """
+    try:
+        decoded = decode_with_pillow(data, box)
+    except Exception:
+        decoded = None
+    if decoded is None:
+        try:
+            decoded = decode_png(data, box)
+        except (zlib.error, struct.error, IndexError):
+            decoded = None
+    return decoded
+
+
+def make_preview(path, box=PREVIEW_BOX):
+    """
+    Миниатюра задания: {"width", "height", "ppm", "part"} или None.
+    """
+    with zipfile.ZipFile(path, "r") as z:
+        for name in preview_candidates(z):
+            decoded = decode_image(z.read(name), box)
+            if decoded is not None:
+                width, height, rgb = decoded
+                return {"width": width, "height": height, "ppm": to_ppm(width, height, rgb),
+                        "part": name}
+    return None
+
+
+# --- загрузка в фоне ---------------------------------------------------------
+
+class PreviewLoader:
+    """
+    request(path, callback) — миниатюра задания в фоновом потоке;
+    callback(path, preview) вызывается в этом потоке (preview — словарь
+    make_preview или None). Возвращает Future: запрос, ещё не начатый,
+    можно отменить, когда оператор уже выбрал другое задание.
+
+    index — JobIndex, из которого берётся отпечаток содержимого задания.
+    """
+
+    def __init__(self, cache_bytes=CACHE_BYTES, box=PREVIEW_BOX, workers=1, metrics=None,
+                 index=None):
+        self.cache = LRUCache(cache_bytes)
+        self.box = box
+        self.metrics = metrics
+        self.index = index
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="preview")
+
+    def request(self, path, callback):
+        return self.executor.submit(self.load, path, callback)
+
+    def load(self, path, callback):
+        try:
+            preview = self.get(path)
+        except Exception:
+            preview = None
+        callback(path, preview)
+
+    def cache_key(self, path):
+        st = os.stat(path)
+        job = self.index.get(path) if self.index is not None else None
+        if (job is not None and job["content_hash"] and job["size"] == st.st_size
+                and job["mtime_ns"] == st.st_mtime_ns):
+            return job["content_hash"]
+        return (path, st.st_size, st.st_mtime_ns)
+
+    def get(self, path):
+        key = self.cache_key(path)
+        preview = self.cache.get(key)
+        if self.metrics is not None:
+            self.metrics.increment("preview_cache_hits" if preview is not None
+                                   else "preview_cache_misses")
+        if preview is None:
+            try:
+                preview = make_preview(path, self.box)
+            except (zipfile.BadZipFile, OSError):
+                preview = None
+            if preview is None:
+                # Повторно пакет без картинки тоже не разбирается
+                self.cache.put(key, NO_PREVIEW, 1)
+                return None
+            self.cache.put(key, preview, len(preview["ppm"]))
+        return None if preview == NO_PREVIEW else preview
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
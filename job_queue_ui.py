@@ -0,0 +1,472 @@
+# -*- coding: utf-8 -*-
+"""
+job_queue_ui.py
+
+Одно постоянное окно очереди заданий вместо отдельного tk.Tk() на каждое
+задание.
+
+Конвейер передаёт проанализированные задания через submit() — это
+потокобезопасная очередь, которую окно разбирает пачками по таймеру Tk.
+Список построен на ttk.Treeview: рисуются только видимые строки, поэтому
+сотни заданий прокручиваются без задержек. Выбранные задания можно
+отправить или удалить одним действием; сама работа выполняется в пуле
+потоков, а окно лишь получает обновления состояний. Очередь пула — с
+приоритетом (job_scheduler), у каждого принтера свой лимит одновременных
+действий. Отправка здесь лишь ставит задание в очередь forward() —
+порядок самих передач на принтер (короткие раньше длинных) определяет
+forward_spooler.
+
+Кнопка «Страницы...» отправляет часть задания — выбранные страницы на
+выбранный принтер (xps_split); задание остаётся в списке, так что его можно
+разделить между несколькими принтерами.
+
+Справа от списка — миниатюра выбранного задания (job_preview): она
+готовится в фоновом потоке после короткой паузы в выборе, поэтому быстрая
+прокрутка списка не ждёт разбора пакетов.
+
+Горячие клавиши: Ctrl+A — выбрать все, Enter — отправить, Delete — удалить.
+Те же действия приходят из локального API (job_api) через request().
+"""
+
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+from job_index import DECIDED, DELETED, FORWARDED
+from auto_rules import FORWARD
+from job_pipeline import DEFERRED
+from job_scheduler import PriorityExecutor, job_cost
+from xps_analysis import format_page_sizes
+from xps_split import SplitError, format_page_ranges, parse_page_ranges
+
+# Сколько входящих заданий/обновлений обрабатывать за один тик окна
+BATCH_LIMIT = 500
+POLL_INTERVAL_MS = 100
+# Миниатюра запрашивается, когда выбор не меняется столько миллисекунд
+PREVIEW_DELAY_MS = 150
+
+STATE_PENDING = "ожидает"
+STATE_SENDING = "отправка..."
+STATE_DELETING = "удаление..."
+STATE_SENDING_PAGES = "отправка страниц..."
+
+
+def remove_file(path, record=None):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class JobQueueWindow:
+    """
+    forward(path) — ставит файл в очередь отправки на принтер (вызывается
+    в пуле потоков) и возвращает Future, завершающийся после отправки;
+    on_resolved(path, outcome) — сообщает конвейеру итог по заданию
+    (обычно JobPipeline.resolve; можно назначить после создания окна);
+    printer_workers — {принтер: одновременных действий}, для остальных
+    принтеров — action_workers; printer_weights — веса принтеров в очереди;
+    dispose(path, record) — убирает отправленный файл из папки спулера
+    (по умолчанию удаляет; job_archive.ArchiveWorker — в архив);
+    forward_pages(path, pages, target) — отправляет страницы pages (номера
+    с 1) на целевой принтер target и возвращает Future; без неё кнопки
+    «Страницы...» нет; targets — {принтер: целевой принтер} для выбора;
+    preview — job_preview.PreviewLoader для миниатюр, None — без них.
+    """
+
+    def __init__(self, forward, on_resolved=None, metrics=None, action_workers=2,
+                 printer_workers=None, printer_weights=None, dispose=None,
+                 forward_pages=None, targets=None, preview=None):
+        self.forward = forward
+        self.preview = preview
+        self.forward_pages = forward_pages
+        self.targets = dict(targets or {})
+        self.on_resolved = on_resolved
+        self.dispose = dispose or remove_file
+        self.metrics = metrics
+        self.inbox = queue.Queue()
+        self.updates = queue.Queue()
+        self.commands = queue.Queue()
+        self.previews = queue.Queue()
+        printer_workers = dict(printer_workers or {})
+        workers = max(action_workers, sum(printer_workers.values()))
+        self.executor = PriorityExecutor(
+            ThreadPoolExecutor(max_workers=workers),
+            workers,
+            limits=printer_workers,
+            weights=printer_weights,
+            default_limit=action_workers,
+            metrics=metrics,
+            name="action",
+        )
+        self.records = {}
+        self.busy = set()
+        self.root = None
+        self.preview_path = None
+        self.preview_future = None
+        self.preview_timer = None
+
+    # --- вызовы из других потоков --------------------------------------------
+
+    def submit(self, record):
+        self.inbox.put(record)
+
+    def decide(self, record):
+        """
+        Функция решения для JobPipeline: задание ставится в очередь окна,
+        а итог приходит позже через on_resolved.
+        """
+        self.submit(record)
+        return DEFERRED
+
+    def request(self, path, action):
+        """
+        Действие FORWARD/DELETE над заданием в списке окна из другого
+        потока (job_api) — как нажатие кнопки. False, если задания нет
+        в списке или над ним уже выполняется действие.
+        """
+        if path not in self.records or path in self.busy:
+            return False
+        self.commands.put((path, action))
+        return True
+
+    def act(self, record, action):
+        """
+        Автоматическое действие по правилу (auto_rules): задание не попадает
+        в список, отправка или удаление идут в том же пуле, итог — через
+        on_resolved. При ошибке задание появляется в окне для оператора.
+        """
+        path = record["path"]
+        if self.metrics is not None:
+            self.metrics.record(path, DECIDED)
+        if action == FORWARD:
+            self.schedule(record, self.do_send, path, record)
+        else:
+            self.schedule(record, self.do_delete, path, record)
+        return DEFERRED
+
+    def schedule(self, record, action, *args):
+        cost = 0.0
+        if action in (self.do_send, self.do_send_pages):
+            cost = job_cost(record.get("file_size", 0), record.get("page_count", 1))
+        self.executor.submit(record.get("printer"), cost, action, *args)
+
+    # --- окно ----------------------------------------------------------------
+
+    def build(self):
+        import tkinter as tk
+        from tkinter import ttk
+
+        self.tk = tk
+        self.root = tk.Tk()
+        self.root.title("Очередь заданий печати")
+        self.root.geometry("760x400")
+
+        frm = tk.Frame(self.root, padx=10, pady=10)
+        frm.pack(fill=tk.BOTH, expand=True)
+
+        columns = ("job_id", "printer", "pages", "size", "file_size", "state")
+        self.tree = ttk.Treeview(frm, columns=columns, show="headings", selectmode="extended")
+        for column, title, width in (
+            ("job_id", "ID задания", 90),
+            ("printer", "Принтер", 120),
+            ("pages", "Страниц", 70),
+            ("size", "Размер", 200),
+            ("file_size", "Файл, КБ", 80),
+            ("state", "Состояние", 160),
+        ):
+            self.tree.heading(column, text=title)
+            self.tree.column(column, width=width, anchor=tk.W)
+        scroll = ttk.Scrollbar(frm, orient=tk.VERTICAL, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scroll.set)
+        self.tree.grid(row=0, column=0, columnspan=5, sticky="nsew")
+        scroll.grid(row=0, column=5, sticky="ns")
+        if self.preview is not None:
+            self.root.geometry("1020x400")
+            self.lbl_preview = tk.Label(frm, anchor=tk.CENTER, relief=tk.SUNKEN)
+            self.lbl_preview.grid(row=0, column=6, sticky="nsew", padx=(10, 0))
+            frm.columnconfigure(6, minsize=self.preview.box[0] + 14)
+            self.tree.bind("<<TreeviewSelect>>", lambda e: self.schedule_preview())
+        frm.rowconfigure(0, weight=1)
+        frm.columnconfigure(4, weight=1)
+
+        tk.Button(frm, text="Выбрать все", width=14, command=self.select_all).grid(
+            row=1, column=0, pady=(10, 0), sticky=tk.W)
+        tk.Button(frm, text="Удалить", width=14, command=self.delete_selected).grid(
+            row=1, column=1, pady=(10, 0), padx=5, sticky=tk.W)
+        tk.Button(frm, text="Отправить", width=14, command=self.send_selected).grid(
+            row=1, column=2, pady=(10, 0), sticky=tk.W)
+        if self.forward_pages is not None:
+            tk.Button(frm, text="Страницы...", width=14, command=self.send_pages_selected).grid(
+                row=1, column=3, pady=(10, 0), padx=5, sticky=tk.W)
+        self.lbl_count = tk.Label(frm, text="")
+        self.lbl_count.grid(row=1, column=4, columnspan=2, pady=(10, 0), sticky=tk.E)
+
+        self.root.bind("<Control-a>", lambda e: self.select_all())
+        self.root.bind("<Return>", lambda e: self.send_selected())
+        self.root.bind("<Delete>", lambda e: self.delete_selected())
+        self.update_count()
+
+    def run(self, stop_event):
+        """
+        Главный цикл окна в текущем потоке до stop_event.
+        """
+        self.build()
+        self.stop_event = stop_event
+        self.root.protocol("WM_DELETE_WINDOW", self.root.iconify)
+        self.root.after(POLL_INTERVAL_MS, self.poll)
+        self.root.mainloop()
+        if self.preview is not None:
+            self.preview.shutdown()
+        self.executor.shutdown(wait=True)
+
+    def poll(self):
+        if self.stop_event.is_set():
+            self.root.destroy()
+            return
+        for _ in range(BATCH_LIMIT):
+            try:
+                record = self.inbox.get_nowait()
+            except queue.Empty:
+                break
+            self.add_row(record)
+        for _ in range(BATCH_LIMIT):
+            try:
+                path, state = self.updates.get_nowait()
+            except queue.Empty:
+                break
+            self.apply_update(path, state)
+        for _ in range(BATCH_LIMIT):
+            try:
+                path, action = self.commands.get_nowait()
+            except queue.Empty:
+                break
+            if path in self.records and path not in self.busy:
+                if action == FORWARD:
+                    self.start_action(path, STATE_SENDING, self.do_send)
+                else:
+                    self.start_action(path, STATE_DELETING, self.do_delete)
+        while True:
+            try:
+                path, preview = self.previews.get_nowait()
+            except queue.Empty:
+                break
+            if path == self.preview_path:
+                self.show_preview(preview)
+        self.update_count()
+        self.root.after(POLL_INTERVAL_MS, self.poll)
+
+    def add_row(self, record):
+        path = record["path"]
+        page_size = record["page_size"]
+        if len(record.get("page_sizes") or {}) > 1:
+            page_size = format_page_sizes(record["page_sizes"])
+        values = (
+            record["job_id"],
+            record.get("printer") or "",
+            record["page_count"],
+            page_size,
+            round(record.get("file_size", 0) / 1024),
+            STATE_PENDING,
+        )
+        self.records[path] = record
+        if self.tree.exists(path):
+            self.tree.item(path, values=values)
+        else:
+            self.tree.insert("", self.tk.END, iid=path, values=values)
+
+    def apply_update(self, path, state):
+        if not self.tree.exists(path):
+            return
+        if state in (FORWARDED, DELETED):
+            if path == self.preview_path:
+                self.preview_path = None
+                self.show_preview(None, "")
+            self.tree.delete(path)
+            self.records.pop(path, None)
+            self.busy.discard(path)
+            return
+        if not state.endswith("..."):
+            # Ошибка — задание снова доступно для действий
+            self.busy.discard(path)
+        self.tree.set(path, "state", state)
+
+    def update_count(self):
+        self.lbl_count.config(text=f"В очереди: {len(self.records)}")
+
+    # --- миниатюры -----------------------------------------------------------
+
+    def schedule_preview(self):
+        # Пока выбор меняется (прокрутка стрелками), миниатюры не запрашиваются
+        if self.preview_timer is not None:
+            self.root.after_cancel(self.preview_timer)
+        self.preview_timer = self.root.after(PREVIEW_DELAY_MS, self.request_preview)
+
+    def request_preview(self):
+        self.preview_timer = None
+        selection = self.tree.selection()
+        path = self.tree.focus() if self.tree.focus() in selection else None
+        if path is None and selection:
+            path = selection[0]
+        if path == self.preview_path:
+            return
+        self.preview_path = path
+        if self.preview_future is not None:
+            # Не начатый запрос для прежнего выбора уже не нужен
+            self.preview_future.cancel()
+        if path is None:
+            self.show_preview(None, "")
+            return
+        self.lbl_preview.config(image="", text="Загрузка...")
+        self.preview_future = self.preview.request(
+            path, lambda p, preview: self.previews.put((p, preview)))
+
+    def show_preview(self, preview, empty_text="Нет миниатюры"):
+        if preview is None:
+            self.preview_image = None
+            self.lbl_preview.config(image="", text=empty_text)
+            return
+        self.preview_image = self.tk.PhotoImage(data=preview["ppm"], format="ppm")
+        self.lbl_preview.config(image=self.preview_image, text="")
+
+    # --- действия ------------------------------------------------------------
+
+    def select_all(self):
+        self.tree.selection_set(self.tree.get_children())
+
+    def selected_paths(self):
+        return [path for path in self.tree.selection() if path not in self.busy]
+
+    def send_selected(self):
+        for path in self.selected_paths():
+            self.start_action(path, STATE_SENDING, self.do_send)
+
+    def delete_selected(self):
+        for path in self.selected_paths():
+            self.start_action(path, STATE_DELETING, self.do_delete)
+
+    def send_pages_selected(self):
+        from tkinter import messagebox
+
+        paths = self.selected_paths()
+        if len(paths) != 1:
+            messagebox.showinfo("Страницы", "Выберите одно задание.", parent=self.root)
+            return
+        path = paths[0]
+        answer = self.ask_pages(self.records[path])
+        if answer is None:
+            return
+        pages, target = answer
+        self.busy.add(path)
+        self.tree.set(path, "state", STATE_SENDING_PAGES)
+        # Стоимость в очереди — по выбранным страницам
+        record = dict(self.records[path], page_count=len(pages))
+        self.schedule(record, self.do_send_pages, path, pages, target)
+
+    def ask_pages(self, record):
+        """
+        Диалог «какие страницы и куда»: (номера страниц, целевой принтер)
+        или None, если оператор передумал.
+        """
+        from tkinter import messagebox, ttk
+
+        tk = self.tk
+        dialog = tk.Toplevel(self.root)
+        dialog.title(f"Страницы задания {record['job_id']}")
+        dialog.transient(self.root)
+        frm = tk.Frame(dialog, padx=10, pady=10)
+        frm.pack(fill=tk.BOTH, expand=True)
+        tk.Label(frm, text=f"Страницы (из {record['page_count']}), например 1-5, 8:").grid(
+            row=0, column=0, columnspan=2, sticky=tk.W)
+        pages_var = tk.StringVar(value=f"1-{record['page_count']}")
+        entry = tk.Entry(frm, textvariable=pages_var, width=30)
+        entry.grid(row=1, column=0, columnspan=2, sticky="we", pady=(0, 8))
+        tk.Label(frm, text="Принтер:").grid(row=2, column=0, sticky=tk.W)
+        targets = sorted(set(self.targets.values()))
+        target_var = tk.StringVar(value=self.targets.get(record.get("printer")) or
+                                  (targets[0] if targets else ""))
+        ttk.Combobox(frm, textvariable=target_var, values=targets, width=28).grid(
+            row=3, column=0, columnspan=2, sticky="we")
+        result = []
+
+        def accept(event=None):
+            try:
+                pages = parse_page_ranges(pages_var.get(), record["page_count"])
+            except SplitError as e:
+                messagebox.showerror("Страницы", str(e), parent=dialog)
+                return
+            if not target_var.get():
+                messagebox.showerror("Страницы", "Укажите принтер.", parent=dialog)
+                return
+            result.append((pages, target_var.get()))
+            dialog.destroy()
+
+        tk.Button(frm, text="Отправить", width=12, command=accept).grid(
+            row=4, column=0, pady=(10, 0), sticky=tk.W)
+        tk.Button(frm, text="Отмена", width=12, command=dialog.destroy).grid(
+            row=4, column=1, pady=(10, 0), sticky=tk.E)
+        dialog.bind("<Return>", accept)
+        dialog.bind("<Escape>", lambda e: dialog.destroy())
+        entry.focus_set()
+        entry.select_range(0, tk.END)
+        dialog.grab_set()
+        self.root.wait_window(dialog)
+        return result[0] if result else None
+
+    def start_action(self, path, state, action):
+        self.busy.add(path)
+        self.tree.set(path, "state", state)
+        if self.metrics is not None:
+            self.metrics.record(path, DECIDED)
+        self.schedule(self.records[path], action, path)
+
+    def report_error(self, path, error, record=None):
+        if record is not None:
+            # Автоматическое действие не удалось — задание переходит к оператору
+            self.submit(record)
+        self.updates.put((path, f"ошибка: {error}"))
+
+    def do_send(self, path, record=None):
+        try:
+            future = self.forward(path)
+        except Exception as e:
+            self.report_error(path, e, record)
+            return
+        future.add_done_callback(lambda f: self.sent(path, record, f))
+
+    def sent(self, path, record, future):
+        error = future.exception()
+        if error is not None:
+            # Файл не удаляется — задание можно отправить повторно
+            self.report_error(path, error, record)
+            return
+        self.dispose(path, record or self.records.get(path))
+        self.on_resolved(path, FORWARDED)
+        self.updates.put((path, FORWARDED))
+
+    def do_send_pages(self, path, pages, target):
+        try:
+            future = self.forward_pages(path, pages, target)
+        except Exception as e:
+            self.report_error(path, e)
+            return
+        future.add_done_callback(lambda f: self.pages_sent(path, pages, target, f))
+
+    def pages_sent(self, path, pages, target, future):
+        error = future.exception()
+        if error is not None:
+            self.report_error(path, error)
+            return
+        # Задание остаётся в списке: можно отправить другие страницы или всё
+        self.updates.put((path, f"стр. {format_page_ranges(pages)} → {target}"))
+
+    def do_delete(self, path, record=None):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            self.report_error(path, e, record)
+            return
+        self.on_resolved(path, DELETED)
+        self.updates.put((path, DELETED))
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+job_scheduler.py
+
+Планирование заданий в общих пулах (анализ и отправка на принтер).
+
+Приоритет задания — «виртуальный срок»:
+    срок = момент постановки в очередь + оценка стоимости / вес принтера
+Первым выполняется задание с наименьшим сроком. Памятка на 2 страницы,
+пришедшая после отчёта на 1000 страниц, получает срок раньше и обгоняет
+его. Старение встроено: срок не меняется, а у новых заданий он растёт
+вместе со временем, поэтому большое задание ждёт не дольше своей оценки
+стоимости и не голодает.
+
+Стоимость оценивается до анализа — по размеру файла и числу страниц из
+центрального каталога ZIP (xps_analysis.estimate_page_count).
+
+Ограничения:
+    total_limit — сколько заданий выполняется одновременно всего
+                  (обычно число воркеров пула);
+    limits      — {принтер: максимум одновременных заданий};
+    weights     — {принтер: вес}; вес 2 делит стоимость пополам;
+    admit       — admit(принтер) -> False временно придерживает задания
+                  принтера (обратное давление от следующего этапа; после
+                  освобождения места вызывается PriorityExecutor.dispatch()).
+
+PriorityExecutor ставит такую очередь перед concurrent.futures-пулом
+и пишет в Metrics время ожидания по классам приоритета
+(<имя>_wait_small / _medium / _large).
+"""
+
+import time
+import heapq
+import threading
+from concurrent.futures import Future
+
+# Оценка стоимости задания в секундах «работы»
+SECONDS_PER_PAGE = 0.02
+BYTES_PER_SECOND = 50 * 1024 * 1024
+
+# Классы приоритета для метрик: (верхняя граница стоимости, имя)
+PRIORITY_CLASSES = ((0.5, "small"), (5.0, "medium"))
+LARGEST_CLASS = "large"
+
+
+def job_cost(file_size, page_count):
+    return page_count * SECONDS_PER_PAGE + file_size / BYTES_PER_SECOND
+
+
+def priority_class(cost):
+    for bound, name in PRIORITY_CLASSES:
+        if cost < bound:
+            return name
+    return LARGEST_CLASS
+
+
+class PriorityScheduler:
+    """
+    Очередь с приоритетом по виртуальному сроку и ограничениями по
+    принтерам. Не потокобезопасна: вызывающий держит свою блокировку.
+    """
+
+    def __init__(self, total_limit, limits=None, weights=None, default_limit=None, admit=None):
+        self.total_limit = total_limit
+        self.limits = dict(limits or {})
+        self.weights = dict(weights or {})
+        self.default_limit = default_limit
+        self.admit = admit
+        # {принтер: куча (срок, порядковый номер, элемент)}; выбор идёт
+        # среди голов куч, поэтому принтер, упёршийся в свой лимит, не
+        # заставляет перебирать все его ожидающие задания
+        self.queues = {}
+        self.pending = 0
+        self.counter = 0
+        self.running = {}
+        self.running_total = 0
+
+    def __len__(self):
+        return self.pending
+
+    def push(self, key, item, cost=0.0, now=None):
+        if now is None:
+            now = time.monotonic()
+        deadline = now + cost / self.weights.get(key, 1.0)
+        self.counter += 1
+        heapq.heappush(self.queues.setdefault(key, []), (deadline, self.counter, item))
+        self.pending += 1
+
+    def at_limit(self, key):
+        limit = self.limits.get(key, self.default_limit)
+        if limit is not None and self.running.get(key, 0) >= limit:
+            return True
+        return self.admit is not None and not self.admit(key)
+
+    def pop(self):
+        """
+        Следующее задание (принтер, элемент) с учётом ограничений или None.
+        """
+        if self.running_total >= self.total_limit:
+            return None
+        # Ключ принтера может быть None (задание без конфигурации принтера),
+        # поэтому «ничего не выбрано» отмечает best, а не found
+        found = best = None
+        for key, queue in self.queues.items():
+            if best is not None and queue[0] >= best[0]:
+                continue
+            if not self.at_limit(key):
+                found, best = key, queue
+        if best is None:
+            return None
+        item = heapq.heappop(best)[2]
+        if not best:
+            del self.queues[found]
+        self.pending -= 1
+        self.running[found] = self.running.get(found, 0) + 1
+        self.running_total += 1
+        return found, item
+
+    def done(self, key):
+        self.running[key] -= 1
+        self.running_total -= 1
+
+    def drain(self):
+        """
+        Забирает все ожидающие элементы (при остановке).
+        """
+        items = [entry[2] for queue in self.queues.values() for entry in queue]
+        self.queues = {}
+        self.pending = 0
+        return items
+
+
+class PriorityExecutor:
+    """
+    Приоритетная очередь перед пулом executor (Thread/ProcessPoolExecutor).
+    В пул передаётся не больше workers заданий, поэтому порядок решает
+    планировщик, а не внутренняя FIFO-очередь пула.
+    """
+
+    def __init__(self, executor, workers, limits=None, weights=None, default_limit=None,
+                 metrics=None, name="queue", admit=None):
+        self.executor = executor
+        self.scheduler = PriorityScheduler(workers, limits, weights, default_limit, admit)
+        self.metrics = metrics
+        self.name = name
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def __len__(self):
+        return len(self.scheduler)
+
+    @property
+    def running(self):
+        return self.scheduler.running_total
+
+    def submit(self, key, cost, fn, *args):
+        future = Future()
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("PriorityExecutor остановлен")
+            self.scheduler.push(key, (future, fn, args, time.monotonic(), priority_class(cost)), cost)
+        self.dispatch()
+        return future
+
+    def dispatch(self):
+        # Выбор под блокировкой, отправка в пул — без неё: колбэк
+        # готового future может выполниться сразу в этом же потоке
+        with self.lock:
+            batch = []
+            while not self.closed:
+                item = self.scheduler.pop()
+                if item is None:
+                    break
+                batch.append(item)
+        now = time.monotonic()
+        for key, (future, fn, args, enqueued, cls) in batch:
+            if self.metrics is not None:
+                self.metrics.observe(f"{self.name}_wait_{cls}", now - enqueued)
+            if not future.set_running_or_notify_cancel():
+                self.finish(key)
+                continue
+            try:
+                inner = self.executor.submit(fn, *args)
+            except RuntimeError as e:
+                # Пул уже остановлен
+                future.set_exception(e)
+                self.finish(key)
+                continue
+            inner.add_done_callback(lambda f, k=key, outer=future: self.on_done(k, outer, f))
+
+    def on_done(self, key, outer, inner):
+        # Сначала освобождаем место — следующее задание уходит в пул,
+        # пока обрабатывается результат этого
+        self.finish(key)
+        try:
+            outer.set_result(inner.result())
+        except BaseException as e:
+            outer.set_exception(e)
+
+    def finish(self, key):
+        with self.lock:
+            self.scheduler.done(key)
+        self.dispatch()
+
+    def shutdown(self, wait=True):
+        """
+        Ожидающие задания отменяются, пул останавливается.
+        """
+        with self.lock:
+            self.closed = True
+            pending = self.scheduler.drain()
+        for future, *_ in pending:
+            future.cancel()
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+metrics.py
+
+Инструментирование службы: этапы каждого задания, гистограммы задержек,
+глубины очередей.
+
+Этапы задания (по порядку):
+    appeared -> stable -> analysed -> shown -> decided -> forwarded
+
+Metrics.record(job, stage) запоминает момент этапа (первая отметка
+выигрывает) и добавляет длительность от предыдущего этапа и от появления
+файла в гистограммы с фиксированными корзинами — обновление O(1) под одной
+блокировкой. События для журнала кладутся в очередь и пишутся в JSON Lines
+фоновым потоком, поэтому горячий путь не ждёт диска. Те же события
+получают слушатели add_listener() (например, лента событий job_api).
+
+Экспорт — текст в формате Prometheus:
+    MetricsFileWriter — периодически переписывает файл метрик;
+    serve_metrics()   — HTTP на localhost, GET /metrics.
+"""
+
+import os
+import json
+import time
+import queue
+import bisect
+import threading
+from collections import deque
+
+from job_index import ANALYSED, DECIDED, FORWARDED, STABLE
+
+# stable/analysed/decided/forwarded совпадают с состояниями JobIndex
+APPEARED = "appeared"
+SHOWN = "shown"
+
+STAGES = (APPEARED, STABLE, ANALYSED, SHOWN, DECIDED, FORWARDED)
+
+# Верхние границы корзин, секунды
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+
+# Сколько последних значений держать для перцентилей
+WINDOW = 1024
+
+EVENT_LOG_MAX_BYTES = 10 * 1024 * 1024
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=WINDOW)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+        self.recent.append(value)
+
+    def percentile(self, fraction):
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Metrics:
+    def __init__(self, event_log=None):
+        self.lock = threading.Lock()
+        # задание -> {этап: время}
+        self.jobs = {}
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.listeners = []
+        self.events = None
+        if event_log:
+            os.makedirs(os.path.dirname(os.path.abspath(event_log)), exist_ok=True)
+            self.events = queue.Queue()
+            self.event_log = event_log
+            threading.Thread(target=self.event_writer, daemon=True).start()
+
+    def add_gauge(self, name, func):
+        """
+        Регистрирует показатель, который читается при экспорте
+        (например, длина очереди).
+        """
+        self.gauges[name] = func
+
+    def add_listener(self, func):
+        """
+        func(event) вызывается для каждого события этапа задания в потоке,
+        отметившем этап; должна быть быстрой и не бросать исключений.
+        """
+        self.listeners.append(func)
+
+    def emit(self, event):
+        for listener in self.listeners:
+            listener(event)
+        if self.events is not None:
+            self.events.put(event)
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        with self.lock:
+            self.observe_locked(name, value)
+
+    def observe_locked(self, name, value):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(value)
+
+    def record(self, job, stage, ts=None):
+        """
+        Отмечает этап задания. Повторная отметка того же этапа игнорируется.
+        """
+        now = time.time() if ts is None else ts
+        with self.lock:
+            stages = self.jobs.setdefault(job, {})
+            if stage in stages:
+                return
+            previous = None
+            for name in reversed(STAGES[:STAGES.index(stage)]):
+                if name in stages:
+                    previous = name
+                    break
+            stages[stage] = now
+            since_previous = None
+            if previous is not None:
+                since_previous = now - stages[previous]
+                self.observe_locked(f"{previous}_to_{stage}", since_previous)
+            if stage != APPEARED and APPEARED in stages:
+                self.observe_locked(f"appeared_to_{stage}", now - stages[APPEARED])
+            self.counters[f"stage_{stage}"] = self.counters.get(f"stage_{stage}", 0) + 1
+        if self.events is not None or self.listeners:
+            event = {"ts": now, "job": job, "stage": stage}
+            if since_previous is not None:
+                event["since"] = previous
+                event["duration_ms"] = round(since_previous * 1000, 3)
+            self.emit(event)
+
+    def finish(self, job, outcome=None):
+        """
+        Задание покинуло конвейер: состояние по нему освобождается.
+        """
+        with self.lock:
+            self.jobs.pop(job, None)
+            if outcome:
+                self.counters[f"jobs_{outcome}"] = self.counters.get(f"jobs_{outcome}", 0) + 1
+        if self.events is not None or self.listeners:
+            self.emit({"ts": time.time(), "job": job, "stage": "finished", "outcome": outcome})
+
+    # --- экспорт -------------------------------------------------------------
+
+    def render(self, prefix="vprinter"):
+        """
+        Текущие метрики в текстовом формате Prometheus.
+        """
+        lines = []
+        with self.lock:
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE {prefix}_{name}_total counter")
+                lines.append(f"{prefix}_{name}_total {value}")
+            for name, histogram in sorted(self.histograms.items()):
+                metric = f"{prefix}_{name}_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{le="+Inf"}} {histogram.count}')
+                lines.append(f"{metric}_sum {histogram.total:.6f}")
+                lines.append(f"{metric}_count {histogram.count}")
+                for fraction in (0.5, 0.95, 0.99):
+                    lines.append(f'{prefix}_{name}_recent_seconds{{quantile="{fraction}"}} '
+                                 f"{histogram.percentile(fraction):.6f}")
+            lines.append(f"# TYPE {prefix}_jobs_in_progress gauge")
+            lines.append(f"{prefix}_jobs_in_progress {len(self.jobs)}")
+        for name, func in sorted(self.gauges.items()):
+            try:
+                value = func()
+            except Exception:
+                continue
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            lines.append(f"{prefix}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def event_writer(self):
+        while True:
+            batch = [self.events.get()]
+            while True:
+                try:
+                    batch.append(self.events.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if (os.path.exists(self.event_log)
+                        and os.path.getsize(self.event_log) > EVENT_LOG_MAX_BYTES):
+                    os.replace(self.event_log, self.event_log + ".1")
+                with open(self.event_log, "a", encoding="utf-8") as f:
+                    for event in batch:
+                        f.write(json.dumps(event, ensure_ascii=False) + "\n")
+            except OSError:
+                pass
+
+
+class MetricsFileWriter:
+    """
+    Раз в interval секунд атомарно переписывает файл с метриками.
+    """
+
+    def __init__(self, metrics, path, interval=5.0):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def write(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.metrics.render())
+        os.replace(tmp_path, self.path)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.write()
+            except OSError:
+                pass
+
+    def start(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def stop(self):
+        self.stopped.set()
+        try:
+            self.write()
+        except OSError:
+            pass
+
+
+def serve_metrics(metrics, port, host="127.0.0.1"):
+    """
+    Поднимает HTTP-эндпоинт /metrics в фоновом потоке. Возвращает сервер
+    (server.shutdown() для остановки).
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
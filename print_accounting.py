@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+r"""
+print_accounting.py
+
+Учёт страниц для выставления счетов: по принтерам, дням и форматам.
+
+Каждое решённое задание дописывается в журнал job_events (только
+добавление, записи не меняются) и в той же транзакции прибавляется к
+сводным таблицам:
+
+    daily_jobs    (день, принтер, итог)          — заданий, страниц, байт;
+    daily_formats (день, принтер, итог, формат)  — страниц.
+
+Обновление сводок — несколько UPSERT по первичному ключу на задание (число
+форматов в записи ограничено, см. xps_analysis.MAX_CUSTOM_SIZES), поэтому
+стоимость записи не зависит от длины истории. Отчёт за месяцы читает
+только сводки: строк в них не больше «дни × принтеры × форматы», сколько
+бы миллионов заданий ни было в журнале. rebuild() пересчитывает сводки по
+журналу целиком (после ручной правки или восстановления из копии).
+
+Задание учитывается один раз: JobPipeline вызывает record_job() только
+после успешного перехода задания в forwarded/deleted. Отправка части
+задания (кнопка «Страницы...») учитывается отдельным событием forwarded
+с выбранными страницами и их форматами; в поле target журнала — целевой
+принтер, выбранный оператором (у целых заданий он не пишется: он задан
+конфигурацией принтера).
+
+Отчёты:
+    py printer_worker.py report --from 2026-01 --to 2026-03
+    py printer_worker.py report --from 2026-03-01 --to 2026-03-15 --by day,format
+    py print_accounting.py --db C:\VM_PRINTERS\accounting.sqlite3 --by printer --format csv
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import sqlite3
+import argparse
+import calendar
+import datetime
+import threading
+
+from job_index import FORWARDED
+
+# Разрезы отчёта: имя -> выражение над столбцами сводки
+GROUPS = {
+    "day": "day",
+    "month": "substr(day, 1, 7)",
+    "printer": "printer",
+    "outcome": "outcome",
+    "format": "page_size",
+}
+DEFAULT_GROUPS = ("month", "printer")
+
+
+class AccountingError(ValueError):
+    pass
+
+
+def day_of(ts):
+    return time.strftime("%Y-%m-%d", time.localtime(ts))
+
+
+def parse_day(text, end=False):
+    """
+    "2026-03" или "2026-03-15" -> "2026-03-01" / "2026-03-15";
+    для конца интервала месяц разворачивается в последний день.
+    """
+    parts = text.split("-")
+    try:
+        if len(parts) == 2:
+            year, month = int(parts[0]), int(parts[1])
+            day = datetime.date(year, month, 1)
+            if end:
+                day = day.replace(day=calendar.monthrange(year, month)[1])
+            return day.isoformat()
+        if len(parts) == 3:
+            return datetime.date(*(int(x) for x in parts)).isoformat()
+    except ValueError:
+        pass
+    raise AccountingError(f"Неверная дата: {text!r} (нужно ГГГГ-ММ или ГГГГ-ММ-ДД)")
+
+
+class PrintAccounting:
+    """
+    Журнал и сводки в SQLite (одно соединение под блокировкой).
+    """
+
+    def __init__(self, db_path=":memory:"):
+        if db_path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock, self.conn:
+            if db_path != ":memory:":
+                self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_events ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " ts REAL NOT NULL,"
+                " day TEXT NOT NULL,"
+                " printer TEXT NOT NULL,"
+                " outcome TEXT NOT NULL,"
+                " path TEXT NOT NULL,"
+                " job_id TEXT,"
+                " page_count INTEGER NOT NULL,"
+                " file_size INTEGER NOT NULL,"
+                " page_sizes TEXT NOT NULL,"
+                " target TEXT)"
+            )
+            columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(job_events)")}
+            if "target" not in columns:
+                # Журнал, созданный до учёта отправки страниц
+                self.conn.execute("ALTER TABLE job_events ADD COLUMN target TEXT")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS daily_jobs ("
+                " day TEXT NOT NULL,"
+                " printer TEXT NOT NULL,"
+                " outcome TEXT NOT NULL,"
+                " jobs INTEGER NOT NULL,"
+                " pages INTEGER NOT NULL,"
+                " bytes INTEGER NOT NULL,"
+                " PRIMARY KEY (day, printer, outcome))"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS daily_formats ("
+                " day TEXT NOT NULL,"
+                " printer TEXT NOT NULL,"
+                " outcome TEXT NOT NULL,"
+                " page_size TEXT NOT NULL,"
+                " pages INTEGER NOT NULL,"
+                " PRIMARY KEY (day, printer, outcome, page_size))"
+            )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    # --- запись --------------------------------------------------------------
+
+    def record_job(self, record, outcome, ts=None):
+        """
+        Учитывает решённое задание (record — запись analyze_xps с полем
+        printer и, для отправки части задания, target).
+        """
+        self.record_jobs([(record, outcome, ts)])
+
+    def record_jobs(self, items):
+        """
+        То же для пачки [(record, outcome, ts)] одной транзакцией.
+        """
+        now = time.time()
+        with self.lock, self.conn:
+            for record, outcome, ts in items:
+                self.append(record, outcome, now if ts is None else ts)
+
+    def append(self, record, outcome, ts):
+        # Вызывается под self.lock внутри транзакции
+        day = day_of(ts)
+        printer = record.get("printer") or ""
+        pages = int(record.get("page_count", 0))
+        size = int(record.get("file_size", 0))
+        histogram = record.get("page_sizes") or {}
+        if not histogram and pages:
+            histogram = {record.get("page_size", ""): pages}
+        self.conn.execute(
+            "INSERT INTO job_events (ts, day, printer, outcome, path, job_id, page_count,"
+            " file_size, page_sizes, target) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (ts, day, printer, outcome, record.get("path", ""), record.get("job_id"),
+             pages, size, json.dumps(histogram, ensure_ascii=False), record.get("target")),
+        )
+        self.add_to_rollups(day, printer, outcome, pages, size, histogram)
+
+    def add_to_rollups(self, day, printer, outcome, pages, size, histogram, jobs=1):
+        self.conn.execute(
+            "INSERT INTO daily_jobs (day, printer, outcome, jobs, pages, bytes)"
+            " VALUES (?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT(day, printer, outcome) DO UPDATE SET"
+            " jobs = jobs + excluded.jobs, pages = pages + excluded.pages,"
+            " bytes = bytes + excluded.bytes",
+            (day, printer, outcome, jobs, pages, size),
+        )
+        self.conn.executemany(
+            "INSERT INTO daily_formats (day, printer, outcome, page_size, pages)"
+            " VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT(day, printer, outcome, page_size) DO UPDATE SET"
+            " pages = pages + excluded.pages",
+            [(day, printer, outcome, name, count) for name, count in histogram.items()],
+        )
+
+    def rebuild(self):
+        """
+        Пересчитывает сводки по всему журналу. Возвращает число событий.
+        """
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM daily_jobs")
+            self.conn.execute("DELETE FROM daily_formats")
+            count = 0
+            for row in self.conn.execute(
+                    "SELECT day, printer, outcome, page_count, file_size, page_sizes"
+                    " FROM job_events"):
+                self.add_to_rollups(row["day"], row["printer"], row["outcome"],
+                                    row["page_count"], row["file_size"],
+                                    json.loads(row["page_sizes"]))
+                count += 1
+        return count
+
+    # --- отчёты --------------------------------------------------------------
+
+    def report(self, start=None, end=None, groups=DEFAULT_GROUPS, printer=None,
+               outcome=FORWARDED):
+        """
+        Итоги за дни [start, end] ("ГГГГ-ММ-ДД", включительно) в разрезе
+        groups (ключи GROUPS). Строки — словари с полями разрезов и
+        jobs, pages, bytes; в разрезе по формату заданий и байт нет
+        (задание с несколькими форматами посчитано в каждом), только pages.
+        outcome None — все итоги (и отправленные, и удалённые).
+        """
+        unknown = [g for g in groups if g not in GROUPS]
+        if unknown:
+            raise AccountingError(f"Неизвестные разрезы: {unknown}; есть {sorted(GROUPS)}")
+        by_format = "format" in groups
+        table = "daily_formats" if by_format else "daily_jobs"
+        totals = "SUM(pages) AS pages" if by_format else (
+            "SUM(jobs) AS jobs, SUM(pages) AS pages, SUM(bytes) AS bytes")
+        where = []
+        params = []
+        for clause, value in (("day >= ?", start), ("day <= ?", end),
+                              ("printer = ?", printer), ("outcome = ?", outcome)):
+            if value is not None:
+                where.append(clause)
+                params.append(value)
+        columns = [f"{GROUPS[g]} AS {g}" for g in groups]
+        sql = f"SELECT {', '.join(columns + [totals])} FROM {table}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        if groups:
+            keys = ", ".join(str(i) for i in range(1, len(groups) + 1))
+            sql += f" GROUP BY {keys} ORDER BY {keys}"
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [dict(row) for row in rows if row["pages"] is not None]
+
+    def events(self, start=None, end=None):
+        """
+        События журнала за дни [start, end] (для выгрузки и проверки).
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT * FROM job_events WHERE day >= ? AND day <= ? ORDER BY id",
+                (start or "0000-00-00", end or "9999-99-99"),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+
+def write_table(rows, out, fmt):
+    if not rows:
+        print("Нет данных за период", file=sys.stderr)
+        return
+    fields = list(rows[0])
+    if fmt == "csv":
+        writer = csv.DictWriter(out, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+        return
+    if fmt == "jsonl":
+        for row in rows:
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+        return
+    widths = {f: max(len(f), *(len(str(row[f])) for row in rows)) for f in fields}
+    numeric = {f for f in fields if isinstance(rows[0][f], int)}
+
+    def cell(field, value):
+        text = str(value)
+        return text.rjust(widths[field]) if field in numeric else text.ljust(widths[field])
+
+    out.write("  ".join(cell(f, f) for f in fields).rstrip() + "\n")
+    for row in rows:
+        out.write("  ".join(cell(f, row[f]) for f in fields).rstrip() + "\n")
+
+
+def main(argv=None, db_path=None):
+    parser = argparse.ArgumentParser(
+        prog="report",
+        description="Отчёт по напечатанным страницам: принтеры, дни/месяцы, форматы.",
+    )
+    parser.add_argument("--db", default=db_path, required=db_path is None,
+                        help="база учёта (accounting.sqlite3)")
+    parser.add_argument("--from", dest="start", help="начало: ГГГГ-ММ или ГГГГ-ММ-ДД")
+    parser.add_argument("--to", dest="end", help="конец (включительно): ГГГГ-ММ или ГГГГ-ММ-ДД")
+    parser.add_argument("--by", default=",".join(DEFAULT_GROUPS),
+                        help="разрезы через запятую: " + ",".join(GROUPS))
+    parser.add_argument("--printer", help="только этот виртуальный принтер")
+    parser.add_argument("--all-outcomes", action="store_true",
+                        help="учитывать и удалённые задания (по умолчанию — только отправленные)")
+    parser.add_argument("--format", choices=("table", "csv", "jsonl"), default="table")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="пересчитать сводки по журналу перед отчётом")
+    args = parser.parse_args(argv)
+
+    try:
+        start = parse_day(args.start) if args.start else None
+        end = parse_day(args.end, end=True) if args.end else None
+        groups = [g.strip() for g in args.by.split(",") if g.strip()]
+        accounting = PrintAccounting(args.db)
+        try:
+            if args.rebuild:
+                print(f"Сводки пересчитаны по {accounting.rebuild()} событиям", file=sys.stderr)
+            started = time.perf_counter()
+            rows = accounting.report(start, end, groups, args.printer,
+                                     None if args.all_outcomes else FORWARDED)
+            elapsed = time.perf_counter() - started
+        finally:
+            accounting.close()
+    except AccountingError as e:
+        print(e, file=sys.stderr)
+        return 2
+    write_table(rows, sys.stdout, args.format)
+    print(f"Строк: {len(rows)}, запрос {elapsed * 1000:.1f} мс", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+r"""
+printer_config.py
+
+Конфигурация виртуальных принтеров для одного процесса-обработчика.
+
+Пример printers.json:
+    {
+      "printers": [
+        {"name": "VIRT1", "folder": "C:\\VM_PRINTERS\\VIRT1",
+         "target": "Microsoft XPS Document Writer"},
+        {"name": "VIRT2", "folder": "C:\\VM_PRINTERS\\VIRT2",
+         "target": "file:C:\\VM_PRINTERS\\out\\virt2.xps",
+         "max_analysis": 2, "max_forwards": 1, "weight": 2,
+         "rules": "C:\\VM_PRINTERS\\rules_virt2.json"}
+      ]
+    }
+
+Поля принтера:
+    name          — имя виртуального принтера (обязательно, уникально);
+    folder        — папка, куда он сохраняет XPS (обязательно, уникальна);
+    target        — куда пересылать: имя принтера Windows или "file:<путь>";
+    max_analysis  — сколько его заданий анализируется одновременно
+                    (по умолчанию — без отдельного ограничения);
+    max_forwards  — сколько заданий одновременно отправляется на target;
+    weight        — вес в очередях анализа и отправки (по умолчанию 1):
+                    задания принтера с весом 2 идут так, будто они вдвое
+                    дешевле (см. job_scheduler.py);
+    rules         — свой файл правил auto_rules вместо общего;
+    port          — порт принтера Windows (по умолчанию <folder>\job_%d.xps);
+    driver        — драйвер (по умолчанию найденный XPS-драйвер).
+Поля port и driver нужны только установке (printer_provisioning.py).
+"""
+
+import os
+import json
+
+DEFAULT_MAX_FORWARDS = 1
+PORT_FILE_NAME = "job_%d.xps"
+
+
+class ConfigError(ValueError):
+    pass
+
+
+def folder_key(folder):
+    """
+    Ключ папки для сопоставления путей файлов с принтерами.
+    """
+    return os.path.normcase(os.path.abspath(folder))
+
+
+def printer_port(printer):
+    """
+    Порт Windows, в который печатает виртуальный принтер.
+    """
+    return printer.get("port") or os.path.join(printer["folder"], PORT_FILE_NAME)
+
+
+def make_printer(name, folder, target=None, max_analysis=None,
+                 max_forwards=DEFAULT_MAX_FORWARDS, weight=1.0, rules=None,
+                 port=None, driver=None):
+    return {
+        "name": name,
+        "folder": folder,
+        "target": target,
+        "max_analysis": max_analysis,
+        "max_forwards": max_forwards,
+        "weight": weight,
+        "rules": rules,
+        "port": port,
+        "driver": driver,
+    }
+
+
+def parse_printers(config):
+    printers = []
+    names = set()
+    folders = set()
+    for number, entry in enumerate(config.get("printers", []), 1):
+        name = entry.get("name")
+        folder = entry.get("folder")
+        if not name or not folder:
+            raise ConfigError(f"Принтер {number}: нужны name и folder")
+        unknown = set(entry) - {"name", "folder", "target", "max_analysis", "max_forwards",
+                                "weight", "rules", "port", "driver"}
+        if unknown:
+            raise ConfigError(f"{name}: неизвестные поля {sorted(unknown)}")
+        weight = entry.get("weight", 1.0)
+        if not isinstance(weight, (int, float)) or weight <= 0:
+            raise ConfigError(f"{name}: вес должен быть положительным числом")
+        if name in names:
+            raise ConfigError(f"Принтер {name} описан дважды")
+        if folder_key(folder) in folders:
+            raise ConfigError(f"{name}: папка {folder} уже занята другим принтером")
+        names.add(name)
+        folders.add(folder_key(folder))
+        printers.append(make_printer(
+            name,
+            folder,
+            target=entry.get("target"),
+            max_analysis=entry.get("max_analysis"),
+            max_forwards=entry.get("max_forwards", DEFAULT_MAX_FORWARDS),
+            weight=weight,
+            rules=entry.get("rules"),
+            port=entry.get("port"),
+            driver=entry.get("driver"),
+        ))
+    if not printers:
+        raise ConfigError("Не описано ни одного принтера")
+    return printers
+
+
+def load_printers(path, default=None):
+    """
+    Читает printers.json. Если файла нет, возвращает [default] — так
+    работает прежняя конфигурация с одним принтером.
+    """
+    if not os.path.exists(path) and default is not None:
+        return [default]
+    with open(path, encoding="utf-8") as f:
+        return parse_printers(json.load(f))
@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+r"""
+printer_provisioning.py
+
+Массовая установка и обновление виртуальных принтеров по printers.json —
+без мастера и по одному клику на принтер.
+
+Желаемое состояние — принтеры из printer_config (имя, папка, порт
+<папка>\job_%d.xps или поле port, драйвер — поле driver или найденный
+XPS-драйвер) и служба printer_worker. Действительное — один снимок
+платформы: принтеры, порты, драйверы и служба перечисляются один раз на
+весь прогон, а не для каждого принтера.
+
+plan() сравнивает состояния и возвращает только нужные изменения;
+apply_plan() выполняет их в пуле потоков: действия одного принтера — по
+порядку (папка, затем принтер), разные принтеры — параллельно. Повторный
+прогон с той же конфигурацией ничего не меняет.
+
+Платформы:
+    Win32Platform — Windows: новый принтер — PrintUIEntry (он же создаёт
+                    локальный порт), смена порта или драйвера — SetPrinter,
+                    удаление — DeletePrinter; служба перенастраивается
+                    ChangeServiceConfig, а не удаляется и создаётся заново;
+    FakePlatform  — состояние в памяти с задержкой на каждый вызов: прогон
+                    и замеры на Linux, без Windows.
+
+Запуск:
+    py setup_virtual_printer.py provision C:\VM_PRINTERS\printers.json
+    py setup_virtual_printer.py provision printers.json --dry-run
+    py printer_provisioning.py printers.json --fake --fake-latency 0.2 --workers 16
+"""
+
+import os
+import sys
+import time
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from printer_config import PORT_FILE_NAME, load_printers, printer_port
+
+CREATE_FOLDER = "create_folder"
+ADD_PRINTER = "add_printer"
+UPDATE_PRINTER = "update_printer"
+DELETE_PRINTER = "delete_printer"
+INSTALL_SERVICE = "install_service"
+UPDATE_SERVICE = "update_service"
+
+DEFAULT_WORKERS = 8
+SERVICE_KEY = "service"
+
+
+class ProvisioningError(Exception):
+    pass
+
+
+def find_xps_driver(driver_names):
+    """
+    Драйвер для виртуальных принтеров: Microsoft XPS Document Writer или
+    любой другой XPS-драйвер; None, если их нет.
+    """
+    candidates = [name for name in driver_names if "xps document writer" in name.lower()]
+    if not candidates:
+        candidates = [name for name in driver_names if "xps" in name.lower()]
+    return candidates[0] if candidates else None
+
+
+def same_path(a, b):
+    return os.path.normcase(os.path.normpath(a)) == os.path.normcase(os.path.normpath(b))
+
+
+def make_action(kind, target, **params):
+    return {"kind": kind, "target": target, "params": params}
+
+
+def plan(printers, snapshot, service=None, prune=False):
+    """
+    Изменения, которые приводят снимок платформы snapshot к конфигурации:
+    список действий {"kind", "target", "params"}. service — желаемая
+    служба {"name", "display_name", "binary"} или None, если не трогать.
+    prune — удалить принтеры с портом job_%d.xps, которых нет в
+    конфигурации (их создаёт только эта установка).
+    """
+    actions = []
+    default_driver = find_xps_driver(snapshot["drivers"])
+    wanted = set()
+    for printer in printers:
+        name = printer["name"]
+        wanted.add(name)
+        port = printer_port(printer)
+        driver = printer.get("driver") or default_driver
+        if driver is None:
+            raise ProvisioningError("В системе нет XPS-драйвера; укажите driver в конфигурации")
+        if driver not in snapshot["drivers"]:
+            raise ProvisioningError(f"{name}: драйвер {driver!r} не установлен")
+        if printer["folder"] not in snapshot["folders"]:
+            actions.append(make_action(CREATE_FOLDER, name, folder=printer["folder"]))
+        current = snapshot["printers"].get(name)
+        if current is None:
+            actions.append(make_action(ADD_PRINTER, name, name=name, port=port, driver=driver,
+                                       port_exists=port in snapshot["ports"]))
+        elif not same_path(current["port"], port) or current["driver"] != driver:
+            actions.append(make_action(UPDATE_PRINTER, name, name=name, port=port, driver=driver,
+                                       port_exists=port in snapshot["ports"]))
+    if prune:
+        for name, current in sorted(snapshot["printers"].items()):
+            if name not in wanted and current["port"].lower().endswith(PORT_FILE_NAME):
+                actions.append(make_action(DELETE_PRINTER, name, name=name))
+    if service is not None:
+        current = snapshot["service"]
+        if current is None:
+            actions.append(make_action(INSTALL_SERVICE, SERVICE_KEY, **service))
+        elif current["binary"] != service["binary"] or not current["auto_start"]:
+            actions.append(make_action(UPDATE_SERVICE, SERVICE_KEY, **service))
+    return actions
+
+
+def apply_plan(platform, actions, workers=DEFAULT_WORKERS, on_result=None):
+    """
+    Выполняет действия: по цепочке на принтер, цепочки — параллельно
+    в workers потоках. Ошибка останавливает только свою цепочку.
+    on_result(action, error, seconds) вызывается после каждого действия.
+    Возвращает список (действие, ошибка или None).
+    """
+    chains = {}
+    for action in actions:
+        chains.setdefault(action["target"], []).append(action)
+    results = []
+    lock = threading.Lock()
+
+    def run_chain(chain):
+        for action in chain:
+            started = time.perf_counter()
+            try:
+                getattr(platform, action["kind"])(**action["params"])
+                error = None
+            except Exception as e:
+                error = e
+            with lock:
+                results.append((action, error))
+            if on_result is not None:
+                on_result(action, error, time.perf_counter() - started)
+            if error is not None:
+                return
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        list(pool.map(run_chain, chains.values()))
+    return results
+
+
+# --- платформы ---------------------------------------------------------------
+
+class FakePlatform:
+    """
+    Принтеры, порты, драйверы и служба в памяти. Каждый вызов «занимает»
+    latency секунд (как запуск PrintUIEntry), calls — счётчик вызовов.
+    """
+
+    def __init__(self, printers=None, drivers=("Microsoft XPS Document Writer v4",),
+                 folders=(), service=None, latency=0.0):
+        self.printers = {name: dict(info) for name, info in (printers or {}).items()}
+        self.ports = {info["port"] for info in self.printers.values()}
+        self.drivers = list(drivers)
+        self.folders = set(folders)
+        self.service = dict(service) if service else None
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def call(self, kind):
+        time.sleep(self.latency)
+        with self.lock:
+            self.calls[kind] = self.calls.get(kind, 0) + 1
+
+    def snapshot(self, folders):
+        self.call("snapshot")
+        with self.lock:
+            return {
+                "printers": {name: dict(info) for name, info in self.printers.items()},
+                "ports": set(self.ports),
+                "drivers": list(self.drivers),
+                "folders": {folder for folder in folders if folder in self.folders},
+                "service": dict(self.service) if self.service else None,
+            }
+
+    def create_folder(self, folder):
+        self.call(CREATE_FOLDER)
+        with self.lock:
+            self.folders.add(folder)
+
+    def add_printer(self, name, port, driver, port_exists=False):
+        self.call(ADD_PRINTER)
+        with self.lock:
+            if name in self.printers:
+                raise ProvisioningError(f"Принтер {name} уже существует")
+            self.ports.add(port)
+            self.printers[name] = {"port": port, "driver": driver}
+
+    def update_printer(self, name, port, driver, port_exists=False):
+        self.call(UPDATE_PRINTER)
+        with self.lock:
+            self.ports.add(port)
+            self.printers[name] = {"port": port, "driver": driver}
+
+    def delete_printer(self, name):
+        self.call(DELETE_PRINTER)
+        with self.lock:
+            del self.printers[name]
+
+    def install_service(self, name, display_name, binary):
+        self.call(INSTALL_SERVICE)
+        with self.lock:
+            self.service = {"binary": binary, "auto_start": True}
+
+    def update_service(self, name, display_name, binary):
+        self.call(UPDATE_SERVICE)
+        with self.lock:
+            self.service = {"binary": binary, "auto_start": True}
+
+
+class Win32Platform:
+    """
+    Принтеры и служба Windows через pywin32 (нужны права администратора).
+    """
+
+    def __init__(self, service_name):
+        import win32print
+        import win32service
+
+        self.win32print = win32print
+        self.win32service = win32service
+        self.service_name = service_name
+
+    def snapshot(self, folders):
+        win32print = self.win32print
+        printers = {
+            info["pPrinterName"]: {"port": info["pPortName"], "driver": info["pDriverName"]}
+            for info in win32print.EnumPrinters(win32print.PRINTER_ENUM_LOCAL, None, 2)
+        }
+        return {
+            "printers": printers,
+            "ports": {port["Name"] for port in win32print.EnumPorts(None, 1)},
+            "drivers": [driver["Name"] for driver in win32print.EnumPrinterDrivers(None, None, 1)],
+            "folders": {folder for folder in folders if os.path.isdir(folder)},
+            "service": self.service_config(),
+        }
+
+    def service_config(self):
+        import pywintypes
+
+        win32service = self.win32service
+        scm = win32service.OpenSCManager(None, None, win32service.SC_MANAGER_CONNECT)
+        try:
+            try:
+                service = win32service.OpenService(scm, self.service_name,
+                                                   win32service.SERVICE_QUERY_CONFIG)
+            except pywintypes.error:
+                return None
+            try:
+                config = win32service.QueryServiceConfig(service)
+            finally:
+                win32service.CloseServiceHandle(service)
+        finally:
+            win32service.CloseServiceHandle(scm)
+        return {"binary": config[3], "auto_start": config[1] == win32service.SERVICE_AUTO_START}
+
+    def create_folder(self, folder):
+        os.makedirs(folder, exist_ok=True)
+
+    def add_printer(self, name, port, driver, port_exists=False):
+        # PrintUIEntry с ntprint.inf сам регистрирует локальный порт
+        inf_path = os.path.join(os.environ.get("WINDIR", r"C:\Windows"), "inf", "ntprint.inf")
+        subprocess.run(
+            ["rundll32", "printui.dll,PrintUIEntry", "/if", "/b", name, "/r", port,
+             "/m", driver, "/f", inf_path],
+            check=True,
+        )
+
+    def update_printer(self, name, port, driver, port_exists=False):
+        if not port_exists:
+            # SetPrinter не создаёт порт — принтер пересоздаётся с новым
+            self.delete_printer(name)
+            self.add_printer(name, port, driver)
+            return
+        win32print = self.win32print
+        handle = win32print.OpenPrinter(name, {"DesiredAccess": win32print.PRINTER_ALL_ACCESS})
+        try:
+            info = win32print.GetPrinter(handle, 2)
+            info["pPortName"] = port
+            info["pDriverName"] = driver
+            win32print.SetPrinter(handle, 2, info, 0)
+        finally:
+            win32print.ClosePrinter(handle)
+
+    def delete_printer(self, name):
+        win32print = self.win32print
+        handle = win32print.OpenPrinter(name, {"DesiredAccess": win32print.PRINTER_ALL_ACCESS})
+        try:
+            win32print.DeletePrinter(handle)
+        finally:
+            win32print.ClosePrinter(handle)
+
+    def install_service(self, name, display_name, binary):
+        win32service = self.win32service
+        scm = win32service.OpenSCManager(None, None, win32service.SC_MANAGER_ALL_ACCESS)
+        try:
+            service = win32service.CreateService(
+                scm, name, display_name, win32service.SERVICE_ALL_ACCESS,
+                win32service.SERVICE_WIN32_OWN_PROCESS, win32service.SERVICE_AUTO_START,
+                win32service.SERVICE_ERROR_NORMAL, binary, None, 0, None, None, None)
+            win32service.CloseServiceHandle(service)
+        finally:
+            win32service.CloseServiceHandle(scm)
+
+    def update_service(self, name, display_name, binary):
+        win32service = self.win32service
+        scm = win32service.OpenSCManager(None, None, win32service.SC_MANAGER_ALL_ACCESS)
+        try:
+            service = win32service.OpenService(scm, name, win32service.SERVICE_CHANGE_CONFIG)
+            try:
+                win32service.ChangeServiceConfig(
+                    service, win32service.SERVICE_NO_CHANGE, win32service.SERVICE_AUTO_START,
+                    win32service.SERVICE_NO_CHANGE, binary, None, 0, None, None, None,
+                    display_name)
+            finally:
+                win32service.CloseServiceHandle(service)
+        finally:
+            win32service.CloseServiceHandle(scm)
+
+
+# --- командная строка --------------------------------------------------------
+
+def describe(action):
+    params = action["params"]
+    if action["kind"] == CREATE_FOLDER:
+        return f"{action['target']}: создать папку {params['folder']}"
+    if action["kind"] == ADD_PRINTER:
+        return f"{params['name']}: установить (порт {params['port']}, драйвер {params['driver']})"
+    if action["kind"] == UPDATE_PRINTER:
+        return f"{params['name']}: изменить порт/драйвер на {params['port']}, {params['driver']}"
+    if action["kind"] == DELETE_PRINTER:
+        return f"{params['name']}: удалить"
+    if action["kind"] == INSTALL_SERVICE:
+        return f"служба {params['name']}: зарегистрировать"
+    return f"служба {params['name']}: обновить настройки"
+
+
+def service_binary(worker_path):
+    return f'"{sys.executable}" "{worker_path}"'
+
+
+def main(argv=None, service_name=None, display_name=None, worker_path=None):
+    parser = argparse.ArgumentParser(
+        prog="provision",
+        description="Установка и обновление виртуальных принтеров по printers.json.",
+    )
+    parser.add_argument("config", help="printers.json (см. printer_config.py)")
+    parser.add_argument("-w", "--workers", type=int, default=DEFAULT_WORKERS,
+                        help="сколько принтеров настраивать одновременно")
+    parser.add_argument("--dry-run", action="store_true", help="только показать изменения")
+    parser.add_argument("--prune", action="store_true",
+                        help="удалить принтеры с портом job_%%d.xps, которых нет в конфигурации")
+    parser.add_argument("--no-service", action="store_true", help="не трогать службу")
+    parser.add_argument("--fake", action="store_true",
+                        help="платформа в памяти вместо Windows (проверка и замеры)")
+    parser.add_argument("--fake-latency", type=float, default=0.1,
+                        help="задержка одного вызова платформы-заглушки, секунды")
+    args = parser.parse_args(argv)
+
+    try:
+        printers = load_printers(args.config)
+    except (OSError, ValueError) as e:
+        print(f"Конфигурация не прочитана: {e}", file=sys.stderr)
+        return 2
+    service = None
+    if not args.no_service and service_name:
+        worker_path = worker_path or os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                  "printer_worker.py")
+        service = {"name": service_name, "display_name": display_name or service_name,
+                   "binary": service_binary(worker_path)}
+    platform = (FakePlatform(latency=args.fake_latency) if args.fake
+                else Win32Platform(service_name))
+
+    started = time.perf_counter()
+    snapshot = platform.snapshot([p["folder"] for p in printers])
+    try:
+        actions = plan(printers, snapshot, service, args.prune)
+    except ProvisioningError as e:
+        print(e, file=sys.stderr)
+        return 2
+    print(f"Принтеров в конфигурации: {len(printers)}, в системе: {len(snapshot['printers'])}, "
+          f"изменений: {len(actions)}")
+    if args.dry_run or not actions:
+        for action in actions:
+            print(f"  {describe(action)}")
+        return 0
+
+    lock = threading.Lock()
+
+    def on_result(action, error, seconds):
+        with lock:
+            mark = "✓" if error is None else "✗"
+            suffix = "" if error is None else f": {error}"
+            print(f"  {mark} {describe(action)} ({seconds:.2f} с){suffix}", flush=True)
+
+    results = apply_plan(platform, actions, args.workers, on_result)
+    failed = sum(1 for _action, error in results if error is not None)
+    skipped = len(actions) - len(results)
+    print(f"Готово за {time.perf_counter() - started:.2f} с: выполнено {len(results) - failed}, "
+          f"ошибок {failed}, пропущено после ошибок {skipped}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+printer_sink.py
+
+Отправка заданий на реальный принтер потоком, без чтения файла в память.
+
+«Приёмник» (sink) — объект с методами open(), write(chunk), close() для
+одного документа и disconnect() — закрыть соединение с принтером.
+С keep_open=True соединение (дескриптор принтера) не закрывается после
+документа и переиспользуется следующими — так работает forward_spooler.
+    Win32PrinterSink  — принтер Windows через WritePrinter (pywin32);
+    FileSink          — файл или именованный канал, заменяет принтер
+                        на Linux и в бенчмарках;
+    FolderPrinterSink — принтер-заглушка: каждый документ — отдельный файл
+                        в папке, нет папки — «принтер недоступен».
+open_sink() создаёт приёмник по имени: "file:<путь>" — FileSink,
+"dir:<папка>" — FolderPrinterSink, иначе — имя принтера Windows.
+
+forward_file() передаёт файл кусками фиксированного размера через один
+переиспользуемый буфер (или срезами mmap), так что расход памяти не зависит
+от размера задания, и возвращает статистику передачи. Передачу можно
+оборвать между кусками (остановка службы): документ при этом не
+закрывается как готовый, а снимается с принтера.
+"""
+
+import os
+import mmap
+import time
+
+CHUNK_SIZE = 1024 * 1024
+FILE_SINK_PREFIX = "file:"
+FOLDER_SINK_PREFIX = "dir:"
+DEFAULT_DOC_NAME = "JobFromVirtual"
+
+
+class ForwardCancelled(Exception):
+    pass
+
+
+class Win32PrinterSink:
+    def __init__(self, printer_name, doc_name=DEFAULT_DOC_NAME, datatype="RAW", keep_open=False):
+        self.printer_name = printer_name
+        self.doc_name = doc_name
+        self.datatype = datatype
+        self.keep_open = keep_open
+        self.handle = None
+        self.in_doc = False
+
+    def connect(self):
+        if self.handle is not None:
+            return
+        import win32print
+
+        self.win32print = win32print
+        self.handle = win32print.OpenPrinter(self.printer_name)
+
+    def open(self):
+        self.connect()
+        try:
+            self.win32print.StartDocPrinter(self.handle, 1, (self.doc_name, None, self.datatype))
+            self.in_doc = True
+            self.win32print.StartPagePrinter(self.handle)
+        except Exception:
+            # Дескриптор мог «протухнуть» — следующая попытка откроет новый
+            self.disconnect()
+            raise
+
+    def write(self, chunk):
+        view = memoryview(chunk)
+        while view:
+            written = self.win32print.WritePrinter(self.handle, view)
+            if not written:
+                raise OSError(f"WritePrinter вернул 0 для {self.printer_name}")
+            view = view[written:]
+
+    def close(self):
+        if self.handle is None:
+            return
+        try:
+            self.win32print.EndPagePrinter(self.handle)
+            self.win32print.EndDocPrinter(self.handle)
+            self.in_doc = False
+        except Exception:
+            self.disconnect()
+            raise
+        if not self.keep_open:
+            self.disconnect()
+
+    def disconnect(self):
+        if self.handle is None:
+            return
+        handle, self.handle = self.handle, None
+        try:
+            if self.in_doc:
+                # Документ не дописан — убираем его из очереди принтера
+                self.in_doc = False
+                self.win32print.AbortPrinter(handle)
+        except Exception:
+            pass
+        finally:
+            self.win32print.ClosePrinter(handle)
+
+
+class FileSink:
+    """
+    Пишет задание в файл или канал (FIFO) вместо принтера.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    def open(self):
+        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+        self.fd = os.open(self.path, flags, 0o644)
+
+    def write(self, chunk):
+        view = memoryview(chunk)
+        while view:
+            written = os.write(self.fd, view)
+            view = view[written:]
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def disconnect(self):
+        self.close()
+
+
+class FolderPrinterSink:
+    """
+    Принтер-заглушка для Linux и тестов: каждый документ сохраняется
+    отдельным файлом в папке (сначала .part, затем переименование — как
+    принтер, принявший задание целиком). Если папки нет, принтер считается
+    недоступным: open() бросает OSError. rate — ограничение скорости,
+    байт/с, чтобы изображать медленный принтер.
+    """
+
+    def __init__(self, folder, doc_name=DEFAULT_DOC_NAME, keep_open=False, rate=None):
+        self.folder = folder
+        self.doc_name = doc_name
+        self.keep_open = keep_open
+        self.rate = rate
+        self.connected = False
+        self.fd = None
+        self.counter = 0
+
+    def connect(self):
+        if not self.connected:
+            if not os.path.isdir(self.folder):
+                raise OSError(f"Принтер-заглушка недоступен: нет папки {self.folder}")
+            self.connected = True
+
+    def open(self):
+        self.connect()
+        self.counter += 1
+        name = f"{time.time_ns()}_{os.getpid()}_{id(self)}_{self.counter}_{os.path.basename(self.doc_name)}"
+        self.final_path = os.path.join(self.folder, name)
+        self.part_path = self.final_path + ".part"
+        flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0)
+        try:
+            self.fd = os.open(self.part_path, flags, 0o644)
+        except OSError:
+            self.disconnect()
+            raise
+
+    def write(self, chunk):
+        view = memoryview(chunk)
+        while view:
+            written = os.write(self.fd, view)
+            view = view[written:]
+        if self.rate:
+            time.sleep(len(chunk) / self.rate)
+
+    def close(self):
+        if self.fd is None:
+            return
+        os.close(self.fd)
+        self.fd = None
+        os.replace(self.part_path, self.final_path)
+        if not self.keep_open:
+            self.disconnect()
+
+    def disconnect(self):
+        if self.fd is not None:
+            # Документ не дописан — принтер его не получил
+            os.close(self.fd)
+            self.fd = None
+            try:
+                os.remove(self.part_path)
+            except OSError:
+                pass
+        self.connected = False
+
+
+def open_sink(target, doc_name=DEFAULT_DOC_NAME, keep_open=False):
+    """
+    Создаёт приёмник по имени цели: "file:<путь>", "dir:<папка>" или имя
+    принтера.
+    """
+    if target.startswith(FILE_SINK_PREFIX):
+        return FileSink(target[len(FILE_SINK_PREFIX):])
+    if target.startswith(FOLDER_SINK_PREFIX):
+        return FolderPrinterSink(target[len(FOLDER_SINK_PREFIX):], doc_name, keep_open)
+    return Win32PrinterSink(target, doc_name, keep_open=keep_open)
+
+
+def check_cancel(cancel, file_path):
+    if cancel is not None and cancel.is_set():
+        raise ForwardCancelled(f"Передача {os.path.basename(file_path)} прервана")
+
+
+def forward_file(file_path, sink, chunk_size=CHUNK_SIZE, use_mmap=False, cancel=None):
+    """
+    Передаёт файл в приёмник кусками по chunk_size. Обычный режим
+    переиспользует один буфер через readinto; режим mmap передаёт срезы
+    отображения файла без копирования в память процесса. cancel —
+    threading.Event: если он установлен, перед следующим куском передача
+    обрывается с ForwardCancelled.
+
+    Возвращает словарь {"bytes", "chunks", "seconds", "throughput"}
+    (throughput — байт/с).
+    """
+    started = time.perf_counter()
+    total = 0
+    chunks = 0
+    sink.open()
+    try:
+        with open(file_path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if use_mmap and size > 0:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, \
+                        memoryview(mapped) as view:
+                    for offset in range(0, size, chunk_size):
+                        check_cancel(cancel, file_path)
+                        with view[offset:offset + chunk_size] as chunk:
+                            sink.write(chunk)
+                            total += len(chunk)
+                        chunks += 1
+            else:
+                buffer = bytearray(chunk_size)
+                with memoryview(buffer) as view:
+                    while True:
+                        check_cancel(cancel, file_path)
+                        n = f.readinto(buffer)
+                        if not n:
+                            break
+                        with view[:n] as chunk:
+                            sink.write(chunk)
+                        total += n
+                        chunks += 1
+    except BaseException:
+        # Документ передан не целиком — обрываем его, а не закрываем
+        # как готовый
+        sink.disconnect()
+        raise
+    sink.close()
+    seconds = time.perf_counter() - started
+    return {
+        "bytes": total,
+        "chunks": chunks,
+        "seconds": seconds,
+        "throughput": total / seconds if seconds > 0 else 0.0,
+    }
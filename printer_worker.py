@@ -3,153 +3,304 @@
 import os
 import sys
 import time
+import uuid
 import threading
-import zipfile
-import tkinter as tk
-from tkinter import messagebox
-import win32event
-import win32service
-import win32serviceutil
-import win32print
-import xml.etree.ElementTree as ET
 
+try:
+    import win32service
+    import win32serviceutil
+except ImportError:
+    # Без pywin32 доступны консольный режим и пакетный анализ (analyze)
+    win32serviceutil = None
+
+# Модули службы (tkinter, конвейер, метрики, API) импортируются в
+# watch_folder_loop: консольные подкоманды (analyze, archive, split,
+# report) запускаются без них
+
+VIRTUAL_PRINTER_NAME = "MyVirtualPrinterPython"
 WATCH_FOLDER = r"C:\VM_PRINTERS\VIRT1"
+# Индекс заданий переживает перезапуск службы
+JOB_INDEX_PATH = r"C:\VM_PRINTERS\jobs.sqlite3"
+# Имя принтера Windows, "file:<путь>" для записи в файл вместо принтера или
+# "dir:<папка>" — принтер-заглушка (каждое задание — файл в папке)
 REAL_PRINTER_NAME = "Microsoft XPS Document Writer"
+# Несколько виртуальных принтеров в одном процессе (см. printer_config.py);
+# без этого файла работает один принтер из констант выше
+PRINTERS_CONFIG = r"C:\VM_PRINTERS\printers.json"
 SERVICE_NAME = "PyVirtualPrinterWorker"
 SERVICE_DISPLAY_NAME = "Python VirtualPrinter Worker Service"
+# "auto" — ReadDirectoryChangesW/inotify, "poll" — опрос папки раз в секунду
+WATCHER_BACKEND = "auto"
+# Параллельный анализ заданий: число воркеров и пул процессов вместо потоков
+# (в режиме процессов страницы больших пакетов делятся между процессами)
+ANALYSIS_WORKERS = 4
+ANALYSIS_USE_PROCESSES = False
+# Сколько заданий отправляется на целевой принтер одновременно (столько же
+# открытых соединений; в printers.json задаётся полем max_forwards)
+FORWARD_WORKERS = 2
+# Очередь отправки на принтеры переживает перезапуск службы
+OUTBOX_PATH = r"C:\VM_PRINTERS\outbox.sqlite3"
+# Если столько заданий ждут отправки на целевой принтер, анализ новых
+# заданий его виртуальных принтеров приостанавливается
+FORWARD_MAX_PENDING = 16
+# Метрики по этапам заданий (формат Prometheus) и журнал событий (JSON Lines);
+# METRICS_PORT — порт HTTP-эндпоинта /metrics на localhost, None — выключен
+METRICS_FILE = r"C:\VM_PRINTERS\metrics.prom"
+EVENT_LOG_PATH = r"C:\VM_PRINTERS\events.jsonl"
+METRICS_PORT = None
+# Локальный API очереди заданий и лента событий (см. job_api.py): порт на
+# localhost, None — выключен. Клиенты передают заголовок
+# "Authorization: Bearer <токен>": API_TOKEN или, если он не задан, токен
+# из API_TOKEN_FILE (создаётся при первом запуске)
+API_PORT = None
+API_TOKEN = None
+API_TOKEN_FILE = r"C:\VM_PRINTERS\api_token.txt"
+# Правила автоматической отправки/удаления (см. auto_rules.py); файл
+# перечитывается при изменении, без него все задания ждут оператора.
+# У принтера может быть свой файл (поле rules в printers.json)
+RULES_PATH = r"C:\VM_PRINTERS\rules.json"
+# Архив отправленных заданий с дедупликацией частей (см. job_archive.py);
+# None — отправленные файлы просто удаляются
+ARCHIVE_DIR = r"C:\VM_PRINTERS\archive"
+# Учёт страниц по принтерам, дням и форматам (см. print_accounting.py)
+ACCOUNTING_PATH = r"C:\VM_PRINTERS\accounting.sqlite3"
+# За сколько секунд служба должна остановиться: начатые анализы и отправки
+# дорабатывают, сколько успеют, остальное продолжится после запуска
+SHUTDOWN_TIMEOUT = 15.0
+# Отправка части задания (кнопка «Страницы...»): выбранные страницы
+# собираются здесь отдельным пакетом и удаляются после отправки
+SPLIT_DIR = r"C:\VM_PRINTERS\split"
 
-def get_page_size(xps_path):
-    sizes = {
-        (816, 1056): "Letter",
-        (794, 1123): "A4",
-        (1123, 1587): "A3",
-        (1587, 2245): "A2",
-        (559, 794): "A5",
-    }
-    try:
-        with zipfile.ZipFile(xps_path, 'r') as z:
-            for name in z.namelist():
-                if name.endswith('.fpage'):
-                    xml_content = z.read(name)
-                    root = ET.fromstring(xml_content)
-                    width = round(float(root.attrib.get('Width', '794')))
-                    height = round(float(root.attrib.get('Height', '1123')))
-                    size_name = sizes.get((width, height), "A4")
-                    return size_name
-        return "A4"
-    except:
-        return "A4"
-
-def wait_for_complete_file(file_path, timeout=10):
-    initial_size = -1
-    for _ in range(timeout):
-        if not os.path.exists(file_path):
-            return False
-        current_size = os.path.getsize(file_path)
-        if current_size == initial_size:
-            return True
-        initial_size = current_size
-        time.sleep(1)
-    return False
-
-def process_single_xps(file_path):
-    if not wait_for_complete_file(file_path):
+def report_forward(file_path, future):
+    error = future.exception()
+    if error is not None:
+        print(f"Задание {os.path.basename(file_path)} не отправлено: {error}")
         return
+    stats = future.result()
+    print(f"Задание {os.path.basename(file_path)} отправлено: {stats['bytes']} байт "
+          f"за {stats['seconds']:.2f} с ({stats['throughput'] / 1e6:.1f} МБ/с)")
 
-    base = os.path.basename(file_path)
-    job_id = os.path.splitext(base)[0].replace("job_", "")
+def watch_folder_loop(stop_event):
+    from auto_rules import AutoDecider, RuleEngine
+    from forward_spooler import ForwardSpooler
+    from job_api import EventFeed, load_token, serve_api
+    from job_archive import ArchiveWorker, JobArchive
+    from job_index import FORWARDED, JobIndex
+    from job_pipeline import JobPipeline
+    from job_scheduler import job_cost
+    from job_preview import PreviewLoader
+    from job_queue_ui import JobQueueWindow, remove_file
+    from metrics import Metrics, MetricsFileWriter, serve_metrics
+    from print_accounting import PrintAccounting
+    from printer_config import load_printers, make_printer
+    from xps_analysis import analyze_xps, job_id_from_path
+    from xps_split import extract_pages, format_page_ranges
 
-    if "%d" in job_id:
-        job_id = "Неизвестно"
+    metrics = Metrics(event_log=EVENT_LOG_PATH)
+    metrics_writer = MetricsFileWriter(metrics, METRICS_FILE)
+    metrics_writer.start()
+    metrics_server = serve_metrics(metrics, METRICS_PORT) if METRICS_PORT else None
 
-    page_count = 0
-    try:
-        with zipfile.ZipFile(file_path, 'r') as z:
-            page_count = sum(1 for name in z.namelist() if name.lower().endswith(".fpage"))
-    except:
-        page_count = 1
-
-    page_size = get_page_size(file_path)
-
-    root = tk.Tk()
-    root.title(f"Задание {job_id}")
-    root.geometry("300x150")
-    root.resizable(False, False)
-
-    lbl = tk.Label(
-        root,
-        text=f"ID задания: {job_id}\nСтраниц: {page_count}\nРазмер: {page_size}",
-        justify=tk.CENTER
-    )
-    lbl.pack(pady=10)
+    printers = load_printers(PRINTERS_CONFIG, default=make_printer(
+        VIRTUAL_PRINTER_NAME, WATCH_FOLDER, REAL_PRINTER_NAME, max_forwards=FORWARD_WORKERS))
+    targets = {p["name"]: p["target"] or REAL_PRINTER_NAME for p in printers}
+    connections = {}
+    for printer in printers:
+        target = targets[printer["name"]]
+        connections[target] = max(connections.get(target, 1), printer["max_forwards"])
 
-    def on_delete():
-        try:
-            os.remove(file_path)
-        except:
-            pass
-        root.destroy()
+    index = JobIndex(JOB_INDEX_PATH)
+    accounting = PrintAccounting(ACCOUNTING_PATH)
+    archiver = None
+    dispose = remove_file
+    if ARCHIVE_DIR:
+        archiver = ArchiveWorker(JobArchive(ARCHIVE_DIR, metrics=metrics), metrics=metrics)
+        archiver.start()
+        dispose = archiver.dispose
+        # Отправленные, но не заархивированные до остановки службы
+        for job in index.jobs(FORWARDED):
+            if os.path.exists(job["path"]):
+                dispose(job["path"], job["metadata"])
+
+    def is_split_part(file_path):
+        return os.path.normcase(os.path.dirname(file_path)) == os.path.normcase(SPLIT_DIR)
 
-    def on_send():
+    def record_pages(record, doc_name):
         try:
-            hPrinter = win32print.OpenPrinter(REAL_PRINTER_NAME)
-            with open(file_path, "rb") as f:
-                xps_data = f.read()
-            win32print.StartDocPrinter(hPrinter, 1, ("JobFromVirtual", None, "RAW"))
-            win32print.StartPagePrinter(hPrinter)
-            win32print.WritePrinter(hPrinter, xps_data)
-            win32print.EndPagePrinter(hPrinter)
-            win32print.EndDocPrinter(hPrinter)
-            win32print.ClosePrinter(hPrinter)
+            accounting.record_job(record, FORWARDED)
         except Exception as e:
-            messagebox.showerror("Ошибка", f"Не удалось отправить на принтер:\n{e}")
+            print(f"Страницы {doc_name} не учтены: {e}")
 
+    def on_resumed(file_path, error, metadata):
+        # Отправка, начатая до перезапуска службы, завершилась
+        if is_split_part(file_path):
+            report = "отправлены" if error is None else f"не отправлены: {error}"
+            print(f"Страницы {os.path.basename(file_path)} {report} после перезапуска")
+            if error is None and metadata is not None:
+                record_pages(metadata, os.path.basename(file_path))
+            remove_file(file_path)
+        elif error is None:
+            print(f"Задание {os.path.basename(file_path)} отправлено после перезапуска")
+            job = index.get(file_path)
+            pipeline.resolve(file_path, FORWARDED)
+            dispose(file_path, job["metadata"] if job else None)
+        else:
+            print(f"Задание {os.path.basename(file_path)} не отправлено: {error}")
+            pipeline.reopen(file_path)
+
+    spooler = ForwardSpooler(
+        OUTBOX_PATH,
+        workers=connections,
+        max_pending=FORWARD_MAX_PENDING,
+        metrics=metrics,
+        on_capacity=lambda target: pipeline.kick(),
+        on_resumed=on_resumed,
+    )
+
+    def forward(file_path):
+        # Задание уходит в очередь отправки; до её завершения оно считается
+        # решённым и после перезапуска не будет показано снова
+        pipeline.mark_decided(file_path)
+        job = index.get(file_path)
+        record = (job["metadata"] if job else None) or {}
+        printer = pipeline.printer_of(file_path)
+        # Порядок отправки на принтер — по стоимости задания и весу принтера
+        future = spooler.submit(file_path, targets[printer["name"]],
+                                cost=job_cost(record.get("file_size", 0), record.get("page_count", 1)),
+                                weight=printer["weight"])
+
+        def done(f):
+            report_forward(file_path, f)
+            if f.exception() is not None:
+                pipeline.reopen(file_path)
+
+        future.add_done_callback(done)
+        return future
+
+    def forward_pages(file_path, pages, target):
+        # Задание остаётся нерешённым: отправляется только копия страниц
+        part_path = os.path.join(SPLIT_DIR, f"{uuid.uuid4().hex}_{os.path.basename(file_path)}")
+        extract_pages(file_path, part_path, pages)
+        doc_name = f"{os.path.basename(file_path)} (стр. {format_page_ranges(pages)})"
+        # Задание целиком учитывает конвейер, а отправленные страницы — здесь:
+        # их число и форматы берутся из собранного пакета, пока он на диске.
+        # Учёт — только после успешной отправки; запись хранится в outbox,
+        # чтобы учесть и отправку, завершённую после перезапуска (on_resumed)
         try:
-            os.remove(file_path)
-        except:
-            pass
-        root.destroy()
+            printer = pipeline.printer_of(file_path)
+            record = analyze_xps(part_path)
+            record.update(path=file_path, job_id=job_id_from_path(file_path),
+                          printer=printer["name"], target=target)
+            future = spooler.submit(part_path, target, doc_name=doc_name,
+                                    cost=job_cost(os.path.getsize(part_path), len(pages)),
+                                    weight=printer["weight"], metadata=record)
+        except Exception:
+            remove_file(part_path)
+            raise
 
-    tk.Button(root, text="Удалить", width=12, command=on_delete).pack(side=tk.LEFT, padx=20, pady=10)
-    tk.Button(root, text="Отправить", width=12, command=on_send).pack(side=tk.RIGHT, padx=20, pady=10)
+        def done(f):
+            report_forward(part_path, f)
+            if f.exception() is None:
+                record_pages(record, doc_name)
+            remove_file(part_path)
 
-    root.mainloop()
+        future.add_done_callback(done)
+        return future
 
-def watch_folder_loop(stop_event):
-    if not os.path.exists(WATCH_FOLDER):
-        os.makedirs(WATCH_FOLDER, exist_ok=True)
+    # Пакеты страниц, не попавшие в outbox до остановки службы
+    os.makedirs(SPLIT_DIR, exist_ok=True)
+    queued = {entry["path"] for entry in spooler.outbox.entries()}
+    for name in os.listdir(SPLIT_DIR):
+        if os.path.join(SPLIT_DIR, name) not in queued:
+            remove_file(os.path.join(SPLIT_DIR, name))
 
-    known_files = {}
+    # Одно окно очереди на всё время работы; конвейер — в фоновом потоке
+    window = JobQueueWindow(forward, metrics=metrics, action_workers=FORWARD_WORKERS,
+                            printer_workers={p["name"]: p["max_forwards"] for p in printers},
+                            printer_weights={p["name"]: p["weight"] for p in printers},
+                            dispose=dispose, forward_pages=forward_pages, targets=targets,
+                            preview=PreviewLoader(metrics=metrics, index=index))
+    # Сначала правила (свои у принтера или общие), а что они оставили —
+    # в окно к оператору
+    engines = {}
+    deciders = {}
+    for printer in printers:
+        rules_path = printer["rules"] or RULES_PATH
+        if rules_path not in engines:
+            engines[rules_path] = RuleEngine(rules_path)
+        deciders[printer["name"]] = AutoDecider(
+            engines[rules_path], window.act, window.decide, metrics=metrics)
 
-    while not stop_event.is_set():
-        current_files = {name: os.path.getsize(os.path.join(WATCH_FOLDER, name))
-                         for name in os.listdir(WATCH_FOLDER) if name.lower().endswith(".xps")}
+    def decide(record):
+        return deciders[record["printer"]].decide(record)
+
+    pipeline = JobPipeline(
+        printers,
+        decide,
+        analysis_workers=ANALYSIS_WORKERS,
+        use_processes=ANALYSIS_USE_PROCESSES,
+        watcher_backend=WATCHER_BACKEND,
+        index=index,
+        accounting=accounting,
+        metrics=metrics,
+        # Если правила или окно упали на задании, оно ждёт оператора
+        fallback=window.decide,
+        # Обратное давление: целевой принтер не успевает — новые задания
+        # его виртуальных принтеров ждут анализа в папке
+        admit=lambda printer: spooler.has_capacity(targets[printer]),
+    )
+    window.on_resolved = pipeline.resolve
+    api_server = None
+    if API_PORT:
+        feed = EventFeed()
+        metrics.add_listener(feed.publish)
+        api_server = serve_api(API_PORT, index, window.request, feed,
+                               printer_of=pipeline.printer_of,
+                               token=API_TOKEN or load_token(API_TOKEN_FILE))
+    spooler.start()
+    pipeline_thread = threading.Thread(target=pipeline.run,
+                                       args=(stop_event, SHUTDOWN_TIMEOUT / 2), daemon=True)
+    pipeline_thread.start()
+    try:
+        window.run(stop_event)
+    finally:
+        stop_event.set()
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
 
-        for name, size in current_files.items():
-            if name not in known_files or known_files[name] != size:
-                process_single_xps(os.path.join(WATCH_FOLDER, name))
+        def left():
+            return max(0.0, deadline - time.monotonic())
 
-        known_files = current_files
-        time.sleep(1)
+        # Отправки идут, пока конвейер дожидается начатых анализов
+        pipeline_thread.join(left())
+        spooler.stop(timeout=left())
+        if archiver is not None:
+            archiver.stop(timeout=left())
+        metrics_writer.stop()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        if api_server is not None:
+            feed.close()
+            api_server.shutdown()
 
-class ServiceFramework(win32serviceutil.ServiceFramework):
-    _svc_name_ = SERVICE_NAME
-    _svc_display_name_ = SERVICE_DISPLAY_NAME
+if win32serviceutil is not None:
+    class ServiceFramework(win32serviceutil.ServiceFramework):
+        _svc_name_ = SERVICE_NAME
+        _svc_display_name_ = SERVICE_DISPLAY_NAME
 
-    def __init__(self, args):
-        super().__init__(args)
-        self.stop_event = win32event.CreateEvent(None, 0, 0, None)
+        def __init__(self, args):
+            super().__init__(args)
+            # Конвейер и окно проверяют stop_event.is_set(), поэтому это
+            # threading.Event, а не событие Win32
+            self.stop_event = threading.Event()
 
-    def SvcStop(self):
-        self.ReportServiceStatus(win32service.SERVICE_STOP_PENDING)
-        win32event.SetEvent(self.stop_event)
+        def SvcStop(self):
+            # Запас сверх SHUTDOWN_TIMEOUT — на закрытие окна и баз
+            self.ReportServiceStatus(win32service.SERVICE_STOP_PENDING,
+                                     waitHint=int(SHUTDOWN_TIMEOUT * 1000) + 5000)
+            self.stop_event.set()
 
-    def SvcDoRun(self):
-        watch_thread = threading.Thread(target=watch_folder_loop, args=(self.stop_event,))
-        watch_thread.daemon = True
-        watch_thread.start()
-        win32event.WaitForSingleObject(self.stop_event, win32event.INFINITE)
-        watch_thread.join()
+        def SvcDoRun(self):
+            watch_folder_loop(self.stop_event)
 
 def run_as_console():
     print("Запуск printer_worker в консольном режиме.")
@@ -168,5 +319,21 @@ def run_as_console():
 if __name__ == "__main__":
     if len(sys.argv) > 1 and sys.argv[1].lower() == "--console":
         run_as_console()
+    elif len(sys.argv) > 1 and sys.argv[1].lower() == "analyze":
+        from analyze_jobs import main
+        sys.exit(main(sys.argv[2:]))
+    elif len(sys.argv) > 1 and sys.argv[1].lower() == "archive":
+        from job_archive import main
+        sys.exit(main(sys.argv[2:], root=ARCHIVE_DIR))
+    elif len(sys.argv) > 1 and sys.argv[1].lower() == "split":
+        from xps_split import main
+        sys.exit(main(sys.argv[2:]))
+    elif len(sys.argv) > 1 and sys.argv[1].lower() == "report":
+        from print_accounting import main
+        sys.exit(main(sys.argv[2:], db_path=ACCOUNTING_PATH))
+    elif win32serviceutil is None:
+        print("Для работы службой нужен pywin32 (pip install pywin32); без него "
+              "доступны --console, analyze, archive, split и report.", file=sys.stderr)
+        sys.exit(1)
     else:
         win32serviceutil.HandleCommandLine(ServiceFramework)
\ No newline at end of file
@@ -22,6 +22,10 @@ MyVirtualPrinterPython без наличия «настоящего» сетев
 
 Запуск:
     py setup_virtual_printer.py
+    py setup_virtual_printer.py provision C:\VM_PRINTERS\printers.json [--dry-run] [--prune]
+
+Вторая форма ставит сразу все принтеры из printers.json без окна и
+меняет только то, что отличается от конфигурации (printer_provisioning.py).
 
 Важно: скрипт нужно запускать «от имени администратора».
 """
@@ -37,6 +41,8 @@ import win32serviceutil
 import win32service
 import win32con
 
+from printer_provisioning import find_xps_driver
+
 # ------------------------------------------------------------------------------
 # КОНСТАНТЫ
 # ------------------------------------------------------------------------------
@@ -104,14 +110,8 @@ def create_virtual_printer():
         )
         return False
 
-    xps_candidates = [
-        name for name in driver_names
-        if "xps document writer" in name.lower()
-    ]
-    if not xps_candidates:
-        xps_candidates = [name for name in driver_names if "xps" in name.lower()]
-
-    if not xps_candidates:
+    virt_driver = find_xps_driver(driver_names)
+    if virt_driver is None:
         messagebox.showerror(
             "Ошибка",
             "В системе не найден драйвер XPS (например, 'Microsoft XPS Document Writer').\n"
@@ -119,8 +119,6 @@ def create_virtual_printer():
         )
         return False
 
-    virt_driver = xps_candidates[0]
-
     # 4) Устанавливаем виртуальный принтер через PrintUIEntry:
     inf_path = os.path.join(
         os.environ.get("WINDIR", r"C:\Windows"), "inf", "ntprint.inf"
@@ -431,6 +429,11 @@ class SetupGUI:
         self.btn_stop.config(state=tk.NORMAL)
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1].lower() == "provision":
+        from printer_provisioning import main as provision
+        worker_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "printer_worker.py")
+        sys.exit(provision(sys.argv[2:], service_name=SERVICE_NAME,
+                           display_name=SERVICE_DISPLAY_NAME, worker_path=worker_path))
     root = tk.Tk()
     app = SetupGUI(root)
     root.mainloop()
@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""
+xps_analysis.py
+
+Анализ XPS-заданий печати без зависимостей от Windows (pywin32/tkinter),
+поэтому модуль можно использовать и из службы, и из консольных утилит.
+
+analyze_xps() открывает ZIP-архив ровно один раз. Страницы находятся по
+структуре документа, как их видит приложение для печати:
+    _rels/.rels -> FixedDocumentSequence (.fdseq) -> FixedDocument (.fdoc)
+    -> PageContent Source="..."
+Лишние части (брошенные страницы, ресурсы) не считаются, а страницы с
+нестандартным расширением не теряются. Если у PageContent указаны Width и
+Height, страница даже не открывается; иначе читается начало FixedPage —
+потоковый разбор останавливается на корневом теге, где лежат атрибуты
+Width/Height, не распаковывая остальную страницу. Пакет без читаемой
+структуры разбирается по-старому: страницы — все части *.fpage.
+
+Страницы читаются по одной, и разобранный XML сразу освобождается: от
+размера самих страниц память не зависит. С числом страниц растёт лишь
+список ссылок на них (find_pages: имя части, ZipInfo, подсказка размера) —
+того же порядка, что и центральный каталог ZIP, который zipfile и так
+держит в памяти; в записи задания остаётся только гистограмма форматов.
+"""
+
+import os
+import zipfile
+import posixpath
+from urllib.parse import unquote
+import xml.etree.ElementTree as ET
+
+# Размеры страниц в единицах XPS (1/96 дюйма), книжная ориентация
+PAGE_SIZES = {
+    (816, 1056): "Letter",
+    (794, 1123): "A4",
+    (1123, 1587): "A3",
+    (1587, 2245): "A2",
+    (559, 794): "A5",
+}
+
+# Допуск при сопоставлении размеров (~1.5 мм): драйверы пишут 793.7x1122.5 и т.п.
+PAGE_SIZE_TOLERANCE = 6
+
+# Сколько разных нестандартных размеров различать в гистограмме;
+# остальные попадают в общую корзину, чтобы запись оставалась компактной
+MAX_CUSTOM_SIZES = 16
+OTHER_PAGE_SIZE = "Другой"
+# Страница из FixedDocument, части которой нет в пакете: размер неизвестен,
+# и считать её A4 значило бы выдумать формат для учёта и правил
+UNKNOWN_PAGE_SIZE = "Неизвестно"
+
+# По сколько байт XML страницы передавать парсеру
+PARSE_CHUNK = 4096
+
+# Тип связи пакета с FixedDocumentSequence (XPS и OpenXPS различаются
+# только пространством имён)
+FIXED_REPRESENTATION = "/fixedrepresentation"
+PACKAGE_RELS = "_rels/.rels"
+
+DEFAULT_PAGE_SIZE = "A4"
+DEFAULT_WIDTH = 794
+DEFAULT_HEIGHT = 1123
+
+
+def job_id_from_path(xps_path):
+    """
+    Извлекает ID задания из имени файла job_<ID>.xps.
+    Если порт не подставил номер (остался шаблон %d) — «Неизвестно».
+    """
+    base = os.path.basename(xps_path)
+    job_id = os.path.splitext(base)[0].replace("job_", "")
+    if "%d" in job_id:
+        job_id = "Неизвестно"
+    return job_id
+
+
+def parse_page_header(chunks):
+    """
+    (Width, Height) корневого элемента FixedPage из потока кусков XML.
+    Всё переданное парсеру разбирается целиком, поэтому куски должны быть
+    маленькими (PARSE_CHUNK): разбор останавливается на первом открывающем
+    теге, и многомегабайтная страница не распаковывается и не разбирается.
+    """
+    parser = ET.XMLPullParser(events=("start",))
+    for chunk in chunks:
+        parser.feed(chunk)
+        for _event, elem in parser.read_events():
+            width = float(elem.attrib.get("Width", DEFAULT_WIDTH))
+            height = float(elem.attrib.get("Height", DEFAULT_HEIGHT))
+            return width, height
+    return float(DEFAULT_WIDTH), float(DEFAULT_HEIGHT)
+
+
+def read_page_header(z, info):
+    """
+    Возвращает (Width, Height) корневого элемента FixedPage.
+    """
+    with z.open(info) as stream:
+        return parse_page_header(iter(lambda: stream.read(PARSE_CHUNK), b""))
+
+
+def match_page_size(width, height):
+    """
+    Сопоставляет размер страницы с форматом с учётом допуска и ориентации.
+    Возвращает (название, альбомная ли страница); для нестандартного размера
+    название имеет вид «ШxВ мм».
+    """
+    landscape = width > height
+    short, long_ = (height, width) if landscape else (width, height)
+    for (w, h), name in PAGE_SIZES.items():
+        if abs(short - w) <= PAGE_SIZE_TOLERANCE and abs(long_ - h) <= PAGE_SIZE_TOLERANCE:
+            return name, landscape
+    return f"{round(short * 25.4 / 96)}x{round(long_ * 25.4 / 96)} мм", landscape
+
+
+def add_to_histogram(histogram, name):
+    """
+    Увеличивает счётчик формата, ограничивая число нестандартных корзин.
+    """
+    if (name not in histogram and name not in PAGE_SIZES.values()
+            and len(histogram) >= len(PAGE_SIZES) + MAX_CUSTOM_SIZES):
+        name = OTHER_PAGE_SIZE
+    histogram[name] = histogram.get(name, 0) + 1
+
+
+def format_page_sizes(histogram):
+    """
+    Строка для показа пользователю: «A4 ×120, A3 ×8».
+    """
+    items = sorted(histogram.items(), key=lambda item: -item[1])
+    return ", ".join(f"{name} ×{count}" for name, count in items)
+
+
+def summarize_pages(record, sizes):
+    """
+    Заполняет в записи задания поля страниц по размерам (Width, Height)
+    в порядке документа: page_count, формат первой страницы, гистограмму
+    форматов и число альбомных страниц. Размер None — страница без части
+    в пакете, она идёт в корзину UNKNOWN_PAGE_SIZE.
+    """
+    page_count = 0
+    histogram = {}
+    landscape_pages = 0
+    for size in sizes:
+        if size is None:
+            if page_count == 0:
+                record["page_size"] = UNKNOWN_PAGE_SIZE
+            page_count += 1
+            histogram[UNKNOWN_PAGE_SIZE] = histogram.get(UNKNOWN_PAGE_SIZE, 0) + 1
+            continue
+        width, height = size
+        name, landscape = match_page_size(width, height)
+        if page_count == 0:
+            record["width"] = round(width)
+            record["height"] = round(height)
+            record["page_size"] = name
+        page_count += 1
+        add_to_histogram(histogram, name)
+        if landscape:
+            landscape_pages += 1
+    record["page_count"] = page_count
+    record["page_sizes"] = histogram
+    record["landscape_pages"] = landscape_pages
+    return record
+
+
+def local_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def resolve_part(source, target):
+    """
+    Имя части в ZIP по ссылке target из части source (ссылка абсолютная
+    "/Documents/1/FixedDoc.fdoc" или относительная "Pages/1.fpage").
+    """
+    target = unquote(target.split("#", 1)[0])
+    if not target.startswith("/"):
+        target = posixpath.join(posixpath.dirname("/" + source), target)
+    return posixpath.normpath(target).lstrip("/")
+
+
+def iter_elements(z, info, name):
+    """
+    Атрибуты элементов name из XML-части; разбор потоковый, разобранные
+    элементы сразу освобождаются.
+    """
+    with z.open(info) as stream:
+        for _event, elem in ET.iterparse(stream):
+            if local_name(elem.tag) == name:
+                yield elem.attrib
+            elem.clear()
+
+
+def page_hint(attrib):
+    try:
+        return float(attrib["Width"]), float(attrib["Height"])
+    except (KeyError, ValueError):
+        return None
+
+
+def document_pages(z):
+    """
+    Страницы пакета в порядке документа: [(имя части, ZipInfo или None,
+    (Width, Height) из PageContent или None)]. None — структура документа
+    не читается (нет связи fixedrepresentation, битый XML).
+    """
+    parts = {info.filename.lower(): info for info in z.infolist()}
+
+    def part(name):
+        return parts.get(name.lower())
+
+    try:
+        rels = part(PACKAGE_RELS)
+        if rels is None:
+            return None
+        sequence = None
+        for attrib in iter_elements(z, rels, "Relationship"):
+            if attrib.get("Type", "").endswith(FIXED_REPRESENTATION):
+                sequence = resolve_part("", attrib.get("Target", ""))
+                break
+        if sequence is None or part(sequence) is None:
+            return None
+        documents = [resolve_part(sequence, attrib.get("Source", ""))
+                     for attrib in iter_elements(z, part(sequence), "DocumentReference")]
+        pages = []
+        for document in documents:
+            if part(document) is None:
+                return None
+            for attrib in iter_elements(z, part(document), "PageContent"):
+                name = resolve_part(document, attrib.get("Source", ""))
+                pages.append((name, part(name), page_hint(attrib)))
+        return pages
+    except (ET.ParseError, zipfile.BadZipFile, KeyError, OSError):
+        return None
+
+
+def find_pages(z):
+    """
+    Страницы по структуре документа, а если её нет — все части *.fpage
+    в порядке архива (без подсказок размера).
+    """
+    pages = document_pages(z)
+    if pages is None:
+        pages = [(info.filename, info, None) for info in z.infolist()
+                 if info.filename.lower().endswith(".fpage")]
+    return pages
+
+
+def page_sizes_of(z, pages):
+    """
+    (Width, Height) страниц из find_pages: подсказка PageContent или
+    заголовок FixedPage; нечитаемая страница считается A4, а для
+    страницы без части в пакете выдаётся None.
+    """
+    for _name, info, hint in pages:
+        if hint is not None:
+            yield hint
+            continue
+        if info is None:
+            yield None
+            continue
+        try:
+            yield read_page_header(z, info)
+        except Exception:
+            yield float(DEFAULT_WIDTH), float(DEFAULT_HEIGHT)
+
+
+def estimate_page_count(xps_path):
+    """
+    Число страниц по структуре документа (или по именам *.fpage) — без
+    чтения самих страниц; для оценки стоимости задания до анализа.
+    0, если архив не читается.
+    """
+    try:
+        with zipfile.ZipFile(xps_path, "r") as z:
+            return len(find_pages(z))
+    except Exception:
+        return 0
+
+
+def default_record(xps_path):
+    """
+    Запись задания до анализа — она же итог для повреждённого архива.
+    """
+    return {
+        "path": xps_path,
+        "job_id": job_id_from_path(xps_path),
+        "file_size": 0,
+        "page_count": 1,
+        "page_size": DEFAULT_PAGE_SIZE,
+        "width": DEFAULT_WIDTH,
+        "height": DEFAULT_HEIGHT,
+        "page_sizes": {},
+        "landscape_pages": 0,
+    }
+
+
+def analyze_xps(xps_path):
+    """
+    Анализирует XPS-файл за одно открытие архива.
+
+    Возвращает словарь с метаданными задания:
+        path, job_id, file_size, page_count,
+        page_size, width, height    — формат первой страницы,
+        page_sizes                  — {формат: число страниц},
+        landscape_pages             — число альбомных страниц.
+    При повреждённом архиве page_count = 1, page_size = "A4"
+    (как и раньше в process_single_xps/get_page_size).
+    """
+    record = default_record(xps_path)
+    try:
+        record["file_size"] = os.path.getsize(xps_path)
+        with zipfile.ZipFile(xps_path, "r") as z:
+            summarize_pages(record, page_sizes_of(z, find_pages(z)))
+    except Exception:
+        pass
+    return record
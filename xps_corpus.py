@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+xps_corpus.py
+
+Генератор синтетических XPS-пакетов для бенчмарков и проверки анализа
+на машинах без XPS Document Writer.
+
+Пакет повторяет структуру, которую пишет Microsoft XPS Document Writer:
+    [Content_Types].xml, _rels/.rels -> FixedDocSeq.fdseq
+    -> Documents/1/FixedDoc.fdoc (PageContent) -> Documents/1/Pages/N.fpage
+    + Documents/1/Pages/_rels/N.fpage.rels, Resources/ (шрифты, картинки)
+    + Metadata/thumbnail.png (миниатюра пакета)
+
+Варьируется число страниц, набор форматов, размер страниц (глифы) и
+встроенных ресурсов, число ресурсных частей.
+"""
+
+import os
+import random
+import struct
+import zipfile
+import zlib
+
+from xps_analysis import PAGE_SIZES
+
+XPS_NS = "http://schemas.microsoft.com/xps/2005/06"
+RELS_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+REL_FIXEDREPR = "http://schemas.microsoft.com/xps/2005/06/fixedrepresentation"
+REL_THUMBNAIL = "http://schemas.openxmlformats.org/package/2006/relationships/metadata/thumbnail"
+REL_REQUIRED = "http://schemas.microsoft.com/xps/2005/06/required-resource"
+
+SIZE_BY_NAME = {name: size for size, name in PAGE_SIZES.items()}
+
+CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="utf-8"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="fdseq" ContentType="application/vnd.ms-package.xps-fixeddocumentsequence+xml"/>'
+    '<Default Extension="fdoc" ContentType="application/vnd.ms-package.xps-fixeddocument+xml"/>'
+    '<Default Extension="fpage" ContentType="application/vnd.ms-package.xps-fixedpage+xml"/>'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="odttf" ContentType="application/vnd.ms-package.obfuscated-opentype"/>'
+    '<Default Extension="png" ContentType="image/png"/>'
+    '</Types>'
+)
+
+
+def make_png(width=8, height=8, color=(200, 40, 40)):
+    """
+    Минимальная корректная PNG-картинка (RGB) заданного размера.
+    """
+    def chunk(kind, data):
+        return (struct.pack(">I", len(data)) + kind + data
+                + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+    row = b"\0" + bytes(color) * width
+    raw = row * height
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw))
+            + chunk(b"IEND", b""))
+
+
+def rels_xml(relationships):
+    items = "".join(
+        f'<Relationship Id="R{i}" Type="{kind}" Target="{target}"/>'
+        for i, (kind, target) in enumerate(relationships)
+    )
+    return f'<?xml version="1.0" encoding="utf-8"?><Relationships xmlns="{RELS_NS}">{items}</Relationships>'
+
+
+def page_xml(width, height, glyph_runs, font_uri, image_uri):
+    glyphs = "".join(
+        f'<Glyphs Fill="#ff000000" FontUri="{font_uri}" FontRenderingEmSize="12" '
+        f'OriginX="{40 + (i % 40)}" OriginY="{60 + i}" '
+        f'UnicodeString="Синтетическая строка {i} для проверки анализа XPS"/>'
+        for i in range(glyph_runs)
+    )
+    image = ""
+    if image_uri:
+        image = (f'<Path Data="M 0,0 L 100,0 100,100 0,100 z">'
+                 f'<Path.Fill><ImageBrush ImageSource="{image_uri}" Viewbox="0,0,8,8" '
+                 f'ViewboxUnits="Absolute" Viewport="0,0,100,100" ViewportUnits="Absolute"/>'
+                 f'</Path.Fill></Path>')
+    return (f'<FixedPage xmlns="{XPS_NS}" xmlns:x="http://schemas.microsoft.com/xps/2005/06/resourcedictionary-key" '
+            f'Width="{width}" Height="{height}" xml:lang="ru-RU">{image}{glyphs}</FixedPage>')
+
+
+def generate_xps(path, page_sizes=("A4",), glyph_runs=50, resource_size=64 * 1024,
+                 resource_parts=2, page_hints=False, thumbnail=True, seed=0):
+    """
+    Создаёт синтетический XPS-файл.
+
+    page_sizes     — форматы страниц по порядку: названия из PAGE_SIZES
+                     или кортежи (ширина, высота); альбомная — с суффиксом "-L".
+    glyph_runs     — число строк Glyphs на странице (размер .fpage).
+    resource_size  — размер каждой ресурсной части (несжимаемые байты).
+    resource_parts — число ресурсных частей (шрифты/картинки).
+    page_hints     — писать Width/Height в PageContent документа.
+    Возвращает путь к файлу.
+    """
+    rng = random.Random(seed)
+    sizes = []
+    for size in page_sizes:
+        if isinstance(size, str):
+            landscape = size.endswith("-L")
+            width, height = SIZE_BY_NAME[size[:-2] if landscape else size]
+            if landscape:
+                width, height = height, width
+            sizes.append((width, height))
+        else:
+            sizes.append(tuple(size))
+
+    fonts = [f"/Resources/Fonts/{i}.odttf" for i in range((resource_parts + 1) // 2)]
+    images = [f"/Resources/Images/{i}.png" for i in range(resource_parts // 2)]
+
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("[Content_Types].xml", CONTENT_TYPES)
+        package_rels = [(REL_FIXEDREPR, "/FixedDocSeq.fdseq")]
+        if thumbnail:
+            package_rels.append((REL_THUMBNAIL, "/Metadata/thumbnail.png"))
+            z.writestr("Metadata/thumbnail.png", make_png(32, 24), zipfile.ZIP_STORED)
+        z.writestr("_rels/.rels", rels_xml(package_rels))
+        z.writestr(
+            "FixedDocSeq.fdseq",
+            f'<FixedDocumentSequence xmlns="{XPS_NS}">'
+            f'<DocumentReference Source="/Documents/1/FixedDoc.fdoc"/></FixedDocumentSequence>',
+        )
+
+        contents = []
+        for number, (width, height) in enumerate(sizes, 1):
+            hints = f' Width="{width}" Height="{height}"' if page_hints else ""
+            contents.append(f'<PageContent Source="Pages/{number}.fpage"{hints}/>')
+        z.writestr(
+            "Documents/1/FixedDoc.fdoc",
+            f'<FixedDocument xmlns="{XPS_NS}">{"".join(contents)}</FixedDocument>',
+        )
+
+        for part in fonts:
+            data = rng.getrandbits(8 * resource_size).to_bytes(resource_size, "little")
+            z.writestr(part.lstrip("/"), data, zipfile.ZIP_STORED)
+        for part in images:
+            z.writestr(part.lstrip("/"), make_png(8, 8) + bytes(max(0, resource_size - 100)))
+
+        for number, (width, height) in enumerate(sizes, 1):
+            font = fonts[number % len(fonts)] if fonts else "/Resources/Fonts/none.odttf"
+            image = images[number % len(images)] if images else ""
+            z.writestr(f"Documents/1/Pages/{number}.fpage",
+                       page_xml(width, height, glyph_runs, font, image))
+            required = [(REL_REQUIRED, p) for p in (font, image) if p and (p in fonts or p in images)]
+            z.writestr(f"Documents/1/Pages/_rels/{number}.fpage.rels", rels_xml(required))
+    return path
+
+
+def generate_corpus(folder, jobs=20, max_pages=50, formats=("A4", "A4", "A4", "A3", "A4-L"),
+                    glyph_runs=50, resource_size=64 * 1024, resource_parts=2, seed=0):
+    """
+    Создаёт в папке набор заданий job_<N>.xps со случайным числом страниц
+    и смесью форматов. Возвращает список путей.
+    """
+    os.makedirs(folder, exist_ok=True)
+    rng = random.Random(seed)
+    paths = []
+    for number in range(jobs):
+        pages = rng.randint(1, max_pages)
+        sizes = [rng.choice(formats) for _ in range(pages)]
+        path = os.path.join(folder, f"job_{number}.xps")
+        generate_xps(path, sizes, glyph_runs, resource_size, resource_parts, seed=seed + number)
+        paths.append(path)
+    return paths
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+xps_sharding.py
+
+Анализ очень больших XPS-пакетов в пуле процессов: страницы одного пакета
+делятся на части (шарды), каждая часть разбирается в своём процессе, а
+результаты сливаются в одну запись задания — такую же, как у analyze_xps.
+
+Разбор XML в ElementTree держит GIL, поэтому потоки здесь не помогают,
+а процессы масштабируются по ядрам. Родитель читает только центральный
+каталог ZIP и передаёт воркерам смещения локальных заголовков страниц;
+воркер открывает файл сам и читает каждую страницу прямо по смещению
+(без повторного разбора центрального каталога), распаковывая лишь начало
+страницы до корневого тега FixedPage. Страницы с подсказкой размера в
+PageContent не читаются вовсе. Если страницу так прочитать нельзя
+(шифрование, необычное сжатие), воркер читает её обычным zipfile.
+
+Маленькие пакеты не делятся: они целиком уходят в пул одним заданием,
+так что пул общий для страниц одного большого и многих малых пакетов.
+"""
+
+import os
+import math
+import zlib
+import zipfile
+
+from xps_analysis import (
+    DEFAULT_HEIGHT, DEFAULT_WIDTH, PARSE_CHUNK, analyze_xps, default_record, find_pages,
+    parse_page_header, read_page_header, summarize_pages,
+)
+from zip_parts import data_offset
+
+# Пакеты с меньшим числом страниц не делятся на части
+SHARD_THRESHOLD = 256
+# Минимальный размер части: меньше — накладные расходы дороже выигрыша
+SHARD_MIN_PAGES = 32
+# Частей на процесс: с запасом, чтобы быстрые процессы забирали работу
+SHARDS_PER_WORKER = 2
+
+
+def page_entries(xps_path):
+    """
+    Страницы пакета в порядке документа (xps_analysis.find_pages):
+    [(имя, смещение локального заголовка, метод сжатия, сжатый размер,
+    подсказка (Width, Height) или None)]. У отсутствующей в архиве
+    страницы смещение None.
+    """
+    with zipfile.ZipFile(xps_path, "r") as z:
+        return [
+            (name, None, None, None, hint) if info is None else
+            (name, info.header_offset, info.compress_type, info.compress_size, hint)
+            for name, info, hint in find_pages(z)
+        ]
+
+
+def read_header_at(f, entry):
+    """
+    (Width, Height) страницы, прочитанной по смещению её локального
+    заголовка в открытом файле f.
+    """
+    _name, offset, method, compress_size, _hint = entry
+    if method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+        raise NotImplementedError(f"метод сжатия {method}")
+    f.seek(data_offset(f, offset))
+    return parse_page_header(iter_part(f, method, compress_size))
+
+
+def iter_part(f, method, compress_size):
+    """
+    Содержимое части ZIP кусками не больше PARSE_CHUNK (после распаковки).
+    """
+    decompressor = zlib.decompressobj(-15) if method == zipfile.ZIP_DEFLATED else None
+    left = compress_size
+    while left > 0:
+        data = f.read(min(PARSE_CHUNK, left))
+        if not data:
+            return
+        left -= len(data)
+        if decompressor is None:
+            yield data
+            continue
+        while data:
+            yield decompressor.decompress(data, PARSE_CHUNK)
+            data = decompressor.unconsumed_tail
+
+
+def analyze_shard(xps_path, entries):
+    """
+    Выполняется в процессе пула: размеры страниц части в исходном порядке.
+    """
+    sizes = []
+    z = None
+    with open(xps_path, "rb") as f:
+        try:
+            for entry in entries:
+                if entry[4] is not None:
+                    sizes.append(entry[4])
+                    continue
+                if entry[1] is None:
+                    # Части страницы нет в пакете — как в page_sizes_of
+                    sizes.append(None)
+                    continue
+                try:
+                    sizes.append(read_header_at(f, entry))
+                    continue
+                except Exception:
+                    pass
+                try:
+                    if z is None:
+                        z = zipfile.ZipFile(xps_path, "r")
+                    sizes.append(read_page_header(z, z.getinfo(entry[0])))
+                except Exception:
+                    sizes.append((float(DEFAULT_WIDTH), float(DEFAULT_HEIGHT)))
+        finally:
+            if z is not None:
+                z.close()
+    return sizes
+
+
+def split_shards(entries, workers):
+    size = max(SHARD_MIN_PAGES, math.ceil(len(entries) / (workers * SHARDS_PER_WORKER)))
+    return [entries[i:i + size] for i in range(0, len(entries), size)]
+
+
+def analyze_xps_sharded(xps_path, pool, workers, threshold=SHARD_THRESHOLD):
+    """
+    Анализирует пакет в пуле процессов pool (concurrent.futures) с workers
+    воркерами. Пакет от threshold страниц делится на части; результат тот
+    же, что у analyze_xps(xps_path). Блокирует вызывающий поток до
+    готовности всех частей.
+    """
+    record = default_record(xps_path)
+    try:
+        record["file_size"] = os.path.getsize(xps_path)
+        entries = page_entries(xps_path)
+    except Exception:
+        # Повреждённый архив — пусть analyze_xps вернёт запись по умолчанию
+        return pool.submit(analyze_xps, xps_path).result()
+    if all(entry[4] is not None for entry in entries):
+        # Все размеры уже известны из FixedDocument
+        return summarize_pages(record, (entry[4] for entry in entries))
+    if len(entries) < threshold:
+        return pool.submit(analyze_xps, xps_path).result()
+    futures = [pool.submit(analyze_shard, xps_path, shard)
+               for shard in split_shards(entries, workers)]
+    return summarize_pages(record, (size for future in futures for size in future.result()))
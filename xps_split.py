@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+r"""
+xps_split.py
+
+Отправка части задания: новый XPS-пакет только с выбранными страницами.
+
+Переписываются лишь маленькие XML-части структуры — список PageContent
+в .fdoc (и DocumentReference в .fdseq, если из документа не выбрано ни
+одной страницы) и [Content_Types].xml, причём текстом: всё, кроме
+выброшенных элементов, остаётся байт в байт. Страницы, их связи, шрифты и
+картинки копируются в сжатом виде (zip_parts), без распаковки, — выделить
+5 страниц из задания на 400 стоит столько, сколько весят эти 5 страниц и
+их ресурсы.
+
+Что попадает в новый пакет:
+    - выбранные страницы, их _rels и ресурсы, на которые они ссылаются
+      (связями required-resource или атрибутами FontUri/ImageSource),
+      в том числе через словари ресурсов (.dict);
+    - ресурсы (шрифты, картинки, цветовые профили, словари), на которые
+      не ссылается ни выбранная страница, ни связь пакета или документа,
+      отбрасываются;
+    - невыбранные страницы и их _rels отбрасываются;
+    - всё остальное (метаданные, миниатюра, PrintTicket, структура
+      документа) копируется как есть.
+
+    parse_page_ranges("1-5, 8", 400) -> [1, 2, 3, 4, 5, 8]
+    format_page_ranges([1, 2, 3, 5]) -> "1-3, 5"
+    extract_pages(src, dest, pages)  — пакет со страницами pages (с 1)
+    split_pages(src, ranges, folder) — по пакету на каждый диапазон
+
+Запуск:
+    py printer_worker.py split C:\VM_PRINTERS\VIRT1\job_7.xps 1-5
+    py printer_worker.py split job_7.xps 1-200 201-400 -o C:\tmp
+"""
+
+import os
+import re
+import sys
+import codecs
+import zipfile
+import argparse
+import posixpath
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import unescape
+
+from xps_analysis import FIXED_REPRESENTATION, PACKAGE_RELS, iter_elements, resolve_part
+from zip_parts import RawZipWriter, raw_chunks
+
+CONTENT_TYPES = "[Content_Types].xml"
+# Части-ресурсы: без ссылки с оставшихся страниц они не нужны
+RESOURCE_EXTENSIONS = (
+    ".odttf", ".ttf", ".otf", ".ttc",
+    ".png", ".jpg", ".jpeg", ".tif", ".tiff", ".wdp", ".jxr",
+    ".icc", ".icm", ".dict",
+)
+# Атрибуты разметки FixedPage со ссылкой на ресурс
+REFERENCE_ATTRIBUTES = ("FontUri", "ImageSource", "Source")
+
+
+def element_pattern(name):
+    # Пустой элемент или элемент с содержимым (PageContent.LinkTargets);
+    # префикс пространства имён допускается
+    return re.compile(
+        rf"<(?:[\w.-]+:)?{name}(?=[\s/>])(?:[^>]*?/>|.*?</(?:[\w.-]+:)?{name}\s*>)", re.S)
+
+
+PAGE_CONTENT = element_pattern("PageContent")
+DOCUMENT_REFERENCE = element_pattern("DocumentReference")
+OVERRIDE = element_pattern("Override")
+SOURCE = re.compile(r"""\sSource\s*=\s*(?:"([^"]*)"|'([^']*)')""")
+PART_NAME = re.compile(r"""\sPartName\s*=\s*(?:"([^"]*)"|'([^']*)')""")
+
+
+class SplitError(ValueError):
+    pass
+
+
+def parse_page_ranges(text, page_count):
+    """
+    Номера страниц (с 1, по возрастанию, без повторов) из строки вида
+    "1-5, 8, 10-". Открытый конец диапазона — до последней страницы.
+    """
+    pages = set()
+    for item in text.replace(";", ",").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        first, dash, last = item.partition("-")
+        try:
+            first = int(first) if first.strip() else 1
+            last = (int(last) if last.strip() else page_count) if dash else first
+        except ValueError:
+            raise SplitError(f"Непонятный диапазон страниц: {item!r}")
+        if first < 1 or last > page_count or first > last:
+            raise SplitError(f"Диапазон {item} вне страниц 1-{page_count}")
+        pages.update(range(first, last + 1))
+    if not pages:
+        raise SplitError("Не выбрано ни одной страницы")
+    return sorted(pages)
+
+
+def format_page_ranges(pages):
+    """
+    Обратное к parse_page_ranges: [1, 2, 3, 5] -> "1-3, 5".
+    """
+    ranges = []
+    for number in sorted(pages):
+        if ranges and ranges[-1][1] == number - 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return ", ".join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
+
+
+def rels_name(part):
+    return posixpath.join(posixpath.dirname(part), "_rels", posixpath.basename(part) + ".rels")
+
+
+def attribute(pattern, markup):
+    match = pattern.search(markup)
+    if match is None:
+        return None
+    return unescape(match.group(1) if match.group(1) is not None else match.group(2),
+                    {"&quot;": '"', "&apos;": "'"})
+
+
+def read_text(z, info):
+    data = z.read(info)
+    if data.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        encoding = "utf-16"
+    elif data.startswith(codecs.BOM_UTF8):
+        encoding = "utf-8-sig"
+    else:
+        encoding = "utf-8"
+    return data.decode(encoding), encoding
+
+
+def read_structure(z, parts):
+    """
+    Структура пакета: (имя .fdseq, его текст, кодировка, [(имя .fdoc,
+    текст, кодировка, элемент DocumentReference, [(элемент PageContent,
+    имя страницы)])]).
+    """
+    rels = parts.get(PACKAGE_RELS)
+    if rels is None:
+        raise SplitError("В пакете нет _rels/.rels")
+    sequence = None
+    for attrib in iter_elements(z, rels, "Relationship"):
+        if attrib.get("Type", "").endswith(FIXED_REPRESENTATION):
+            sequence = resolve_part("", attrib.get("Target", ""))
+            break
+    if sequence is None or sequence.lower() not in parts:
+        raise SplitError("В пакете нет FixedDocumentSequence")
+    sequence_text, sequence_encoding = read_text(z, parts[sequence.lower()])
+    documents = []
+    for reference in DOCUMENT_REFERENCE.findall(sequence_text):
+        document = resolve_part(sequence, attribute(SOURCE, reference) or "")
+        if document.lower() not in parts:
+            raise SplitError(f"В пакете нет документа {document}")
+        text, encoding = read_text(z, parts[document.lower()])
+        pages = [(markup, resolve_part(document, attribute(SOURCE, markup) or ""))
+                 for markup in PAGE_CONTENT.findall(text)]
+        documents.append((document, text, encoding, reference, pages))
+    return sequence, sequence_text, sequence_encoding, documents
+
+
+def remove_elements(text, elements):
+    for markup in elements:
+        text = text.replace(markup, "", 1)
+    return text
+
+
+def iter_attributes(z, info):
+    """
+    Атрибуты всех элементов XML-части (потоковый разбор).
+    """
+    with z.open(info) as stream:
+        for _event, elem in ET.iterparse(stream):
+            yield elem.attrib
+            elem.clear()
+
+
+def page_references(z, parts, page):
+    """
+    Имена частей, на которые ссылается страница: её связи и атрибуты
+    разметки, а также всё, на что ссылаются подключённые ею словари
+    ресурсов (.dict), в том числе вложенные.
+    """
+    names = set()
+    pending = [page]
+    visited = set()
+    while pending:
+        source = pending.pop()
+        if source.lower() in visited:
+            continue
+        visited.add(source.lower())
+        found = set()
+        rels = parts.get(rels_name(source).lower())
+        if rels is not None:
+            for attrib in iter_elements(z, rels, "Relationship"):
+                if attrib.get("TargetMode") != "External":
+                    found.add(resolve_part(source, attrib.get("Target", "")))
+        info = parts.get(source.lower())
+        if info is not None:
+            for attrib in iter_attributes(z, info):
+                for key in REFERENCE_ATTRIBUTES:
+                    value = attrib.get(key)
+                    if value and not value.startswith("{"):
+                        found.add(resolve_part(source, value))
+        for name in found:
+            names.add(name.lower())
+            if name.lower().endswith(".dict"):
+                pending.append(name)
+    return names
+
+
+def extract_pages(src, dest, pages):
+    """
+    Пишет в dest пакет со страницами pages (номера с 1) из src. Возвращает
+    {"pages", "parts", "copied_bytes", "bytes"}: copied_bytes — сжатые
+    данные, скопированные без распаковки, bytes — размер нового пакета.
+    """
+    with zipfile.ZipFile(src, "r") as z, open(src, "rb") as f:
+        infos = z.infolist()
+        parts = {info.filename.lower(): info for info in infos}
+        sequence, sequence_text, sequence_encoding, documents = read_structure(z, parts)
+        all_pages = [page for *_rest, doc_pages in documents for page in doc_pages]
+        if not all_pages:
+            raise SplitError("В пакете нет страниц")
+        wanted = set(pages)
+        if min(wanted) < 1 or max(wanted) > len(all_pages):
+            raise SplitError(f"Страницы вне диапазона 1-{len(all_pages)}")
+        selected = {all_pages[number - 1][1].lower() for number in wanted}
+
+        dropped = set()
+        rewritten = {}
+        removed_references = []
+        for document, text, encoding, reference, doc_pages in documents:
+            removed = [markup for markup, page in doc_pages if page.lower() not in selected]
+            if len(removed) == len(doc_pages):
+                # Документ выпал целиком — убираем его из последовательности
+                removed_references.append(reference)
+                dropped.update((document.lower(), rels_name(document).lower()))
+            elif removed:
+                rewritten[document.lower()] = remove_elements(text, removed).encode(encoding)
+        if removed_references:
+            rewritten[sequence.lower()] = remove_elements(
+                sequence_text, removed_references).encode(sequence_encoding)
+        for _markup, page in all_pages:
+            if page.lower() not in selected:
+                dropped.update((page.lower(), rels_name(page).lower()))
+
+        # Ресурсы нужны, если на них ссылаются выбранные страницы или
+        # связи самого пакета и документов (миниатюра и т. п.); связи
+        # самих ресурсов (словарей) учтены в page_references
+        page_rels = {rels_name(page).lower() for _markup, page in all_pages}
+        needed = set()
+        for name in selected:
+            needed |= page_references(z, parts, name)
+        for info in infos:
+            name = info.filename.lower()
+            if name.endswith(".rels") and name not in page_rels and name not in dropped:
+                source = posixpath.join(posixpath.dirname(posixpath.dirname(name)),
+                                        posixpath.basename(name)[:-len(".rels")])
+                if source.endswith(RESOURCE_EXTENSIONS):
+                    continue
+                for attrib in iter_elements(z, info, "Relationship"):
+                    if attrib.get("TargetMode") != "External":
+                        needed.add(resolve_part(source, attrib.get("Target", "")).lower())
+        for info in infos:
+            name = info.filename.lower()
+            if name.endswith(RESOURCE_EXTENSIONS) and name not in needed:
+                dropped.update((name, rels_name(name).lower()))
+
+        content_types = parts.get(CONTENT_TYPES.lower())
+        if content_types is not None:
+            text, encoding = read_text(z, content_types)
+            stale = [markup for markup in OVERRIDE.findall(text)
+                     if (attribute(PART_NAME, markup) or "").lstrip("/").lower() in dropped]
+            if stale:
+                rewritten[CONTENT_TYPES.lower()] = remove_elements(text, stale).encode(encoding)
+
+        temp = dest + ".tmp"
+        copied = 0
+        count = 0
+        try:
+            with open(temp, "wb") as out, RawZipWriter(out) as writer:
+                for info in infos:
+                    name = info.filename.lower()
+                    if name in dropped:
+                        continue
+                    count += 1
+                    if name in rewritten:
+                        writer.add_data(info.filename, rewritten[name], date_time=info.date_time)
+                        continue
+                    writer.add_raw(info.filename, info.compress_type, info.CRC,
+                                   info.compress_size, info.file_size,
+                                   raw_chunks(f, info), info.date_time)
+                    copied += info.compress_size
+            os.replace(temp, dest)
+        except BaseException:
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+            raise
+    return {"pages": len(wanted), "parts": count, "copied_bytes": copied,
+            "bytes": os.path.getsize(dest)}
+
+
+def page_count_of(src):
+    with zipfile.ZipFile(src, "r") as z:
+        parts = {info.filename.lower(): info for info in z.infolist()}
+        documents = read_structure(z, parts)[3]
+    return sum(len(doc_pages) for *_rest, doc_pages in documents)
+
+
+def split_pages(src, ranges, folder):
+    """
+    По пакету на каждый диапазон из ranges (строки для parse_page_ranges)
+    в папке folder. Возвращает [(путь, статистика extract_pages)].
+    """
+    page_count = page_count_of(src)
+    stem = os.path.splitext(os.path.basename(src))[0]
+    results = []
+    for text in ranges:
+        pages = parse_page_ranges(text, page_count)
+        label = re.sub(r"[^\d-]+", "_", text.strip()).strip("_")
+        dest = os.path.join(folder, f"{stem}_p{label}.xps")
+        results.append((dest, extract_pages(src, dest, pages)))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="split",
+        description="Выделение страниц задания в отдельные XPS-пакеты без перепаковки.",
+    )
+    parser.add_argument("path", help="XPS-файл задания")
+    parser.add_argument("ranges", nargs="+", help='диапазоны страниц: "1-5", "1-3,8", "10-"')
+    parser.add_argument("-o", "--output", help="папка для новых пакетов (по умолчанию — рядом)")
+    args = parser.parse_args(argv)
+
+    folder = args.output or os.path.dirname(os.path.abspath(args.path))
+    os.makedirs(folder, exist_ok=True)
+    try:
+        results = split_pages(args.path, args.ranges, folder)
+    except (SplitError, zipfile.BadZipFile, OSError) as e:
+        print(f"Не удалось разделить {args.path}: {e}", file=sys.stderr)
+        return 2
+    for dest, stats in results:
+        print(f"{dest}: страниц {stats['pages']}, частей {stats['parts']}, "
+              f"{stats['bytes'] / 1024:.0f} КБ (скопировано без распаковки "
+              f"{stats['copied_bytes'] / 1024:.0f} КБ)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+zip_parts.py
+
+Чтение и запись частей ZIP (XPS-пакета) «как есть» — в сжатом виде, без
+распаковки и повторного сжатия. zipfile так не умеет: при записи он всегда
+сжимает данные сам.
+
+    raw_chunks(f, info)      — сжатые байты части из открытого файла
+                               по смещению её локального заголовка;
+    RawZipWriter(f)          — пишет ZIP из готовых сжатых частей
+                               (add_raw) и обычных данных (add_data).
+
+RawZipWriter пишет только классический ZIP без ZIP64: до 65535 частей и
+до 4 ГБ; на большем пакете add_raw бросает zipfile.LargeZipFile.
+"""
+
+import time
+import zlib
+import struct
+import zipfile
+
+LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+LOCAL_HEADER_SIGNATURE = 0x04034B50
+CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+CENTRAL_HEADER_SIGNATURE = 0x02014B50
+END_RECORD = struct.Struct("<IHHHHIIH")
+END_RECORD_SIGNATURE = 0x06054B50
+
+# Версия формата 2.0: deflate; флаг 0x800 — имя в UTF-8
+ZIP_VERSION = 20
+FLAG_ENCRYPTED = 0x1
+FLAG_UTF8 = 0x800
+ZIP32_LIMIT = 0xFFFFFFFF
+ZIP32_MAX_ENTRIES = 0xFFFF
+
+RAW_CHUNK = 64 * 1024
+
+
+def data_offset(f, header_offset):
+    """
+    Смещение сжатых данных части по смещению её локального заголовка.
+    """
+    f.seek(header_offset)
+    fields = LOCAL_HEADER.unpack(f.read(LOCAL_HEADER.size))
+    if fields[0] != LOCAL_HEADER_SIGNATURE:
+        raise zipfile.BadZipFile(f"нет локального заголовка по смещению {header_offset}")
+    if fields[2] & FLAG_ENCRYPTED:
+        raise NotImplementedError("зашифрованная часть")
+    return header_offset + LOCAL_HEADER.size + fields[9] + fields[10]
+
+
+def raw_chunks(f, info, chunk_size=RAW_CHUNK):
+    """
+    Сжатые данные части info (ZipInfo) кусками из открытого файла f.
+    """
+    f.seek(data_offset(f, info.header_offset))
+    left = info.compress_size
+    while left > 0:
+        data = f.read(min(chunk_size, left))
+        if not data:
+            raise zipfile.BadZipFile(f"{info.filename}: данные обрываются")
+        left -= len(data)
+        yield data
+
+
+def iter_content(chunks, method):
+    """
+    Распакованное содержимое части из её сжатых кусков.
+    """
+    if method == zipfile.ZIP_STORED:
+        yield from chunks
+        return
+    if method != zipfile.ZIP_DEFLATED:
+        raise NotImplementedError(f"метод сжатия {method}")
+    decompressor = zlib.decompressobj(-15)
+    for chunk in chunks:
+        yield decompressor.decompress(chunk)
+    yield decompressor.flush()
+
+
+def dos_date_time(date_time):
+    year, month, day, hour, minute, second = date_time
+    if year < 1980:
+        year, month, day, hour, minute, second = 1980, 1, 1, 0, 0, 0
+    return (((year - 1980) << 9) | (month << 5) | day,
+            (hour << 11) | (minute << 5) | (second // 2))
+
+
+class RawZipWriter:
+    """
+    Последовательная запись ZIP в двоичный файл f. close() дописывает
+    центральный каталог (сам файл не закрывает).
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.offset = 0
+        self.central = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+
+    def add_raw(self, name, method, crc, compress_size, file_size, chunks,
+                date_time=(1980, 1, 1, 0, 0, 0)):
+        """
+        Добавляет часть из уже сжатых данных chunks (методом method, с
+        CRC32 и размерами исходной части).
+        """
+        if (len(self.central) >= ZIP32_MAX_ENTRIES or self.offset > ZIP32_LIMIT
+                or compress_size > ZIP32_LIMIT or file_size > ZIP32_LIMIT):
+            raise zipfile.LargeZipFile("пакет требует ZIP64")
+        encoded = name.encode("utf-8")
+        flags = 0 if encoded.isascii() else FLAG_UTF8
+        date, clock = dos_date_time(date_time)
+        header_offset = self.offset
+        self.write(LOCAL_HEADER.pack(
+            LOCAL_HEADER_SIGNATURE, ZIP_VERSION, flags, method, clock, date,
+            crc, compress_size, file_size, len(encoded), 0))
+        self.write(encoded)
+        written = 0
+        for chunk in chunks:
+            self.write(chunk)
+            written += len(chunk)
+        if written != compress_size:
+            raise zipfile.BadZipFile(f"{name}: записано {written} байт вместо {compress_size}")
+        self.central.append(CENTRAL_HEADER.pack(
+            CENTRAL_HEADER_SIGNATURE, ZIP_VERSION, ZIP_VERSION, flags, method, clock, date,
+            crc, compress_size, file_size, len(encoded), 0, 0, 0, 0, 0, header_offset) + encoded)
+
+    def add_data(self, name, data, method=zipfile.ZIP_DEFLATED, date_time=None):
+        """
+        Добавляет небольшую часть из байтов data (сжимая их здесь).
+        """
+        if date_time is None:
+            date_time = time.localtime()[:6]
+        raw = data
+        if method == zipfile.ZIP_DEFLATED:
+            compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+            raw = compressor.compress(data) + compressor.flush()
+        self.add_raw(name, method, zlib.crc32(data), len(raw), len(data), [raw], date_time)
+
+    def write(self, data):
+        self.f.write(data)
+        self.offset += len(data)
+
+    def close(self):
+        start = self.offset
+        for entry in self.central:
+            self.write(entry)
+        if start > ZIP32_LIMIT:
+            raise zipfile.LargeZipFile("пакет требует ZIP64")
+        self.write(END_RECORD.pack(
+            END_RECORD_SIGNATURE, 0, 0, len(self.central), len(self.central),
+            self.offset - start, start, 0))